@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+
+"""Headless batch export of QGis projects to MapServer mapfiles
+
+    Usage:
+        python2 BatchExporter.py [-j N | -l N] [-o options.json] [-d outdir] project.qgs [project.qgs ...]
+
+    Projects may also be given as glob patterns (e.g. 'projects/*.qgs'), which is handy on
+    platforms where the shell does not expand them.
+
+    Projects are spread over a pool of worker processes. Each worker boots its own
+    QgsApplication once and then exports the projects it is handed one by one, writing one mapfile
+    per project. A status line is printed for each project and the exit status is non-zero if any
+    of the exports failed.
+
+    The options file is a JSON object whose keys are arguments of `MapfileExporter.export()`,
+    e.g.:
+
+        {
+            "mapServerURL": "http://example.com/cgi-bin/mapserv",
+            "shapePath": "/srv/data",
+            "fontsetPath": "/srv/fonts/fontset",
+            "backgroundColor": "#ffffff",
+            "useSLD": false
+        }
+
+    Options that are derived from the project itself (layers, extent, projection, map name) are
+    filled in by the worker.
+
+    With --cache, the serialized layers of each project are cached in a directory next to its
+    mapfile (e.g. project.map.cache) and unchanged layers are reused by the next export. This
+    needs "backend": "python" in the options file.
+
+    With --layer-jobs N, projects are exported one after the other and the layers of each project
+    are serialized in N worker processes instead (see: ParallelExport.py). This pays off for
+    projects with many layers, and needs "backend": "python" as well.
+
+    With --profile, the time spent in each phase of an export is written next to its mapfile as
+    JSON (e.g. project.map.profile.json, see: Profiler.py).
+"""
+
+import os
+import sys
+import glob
+import json
+import locale
+import time
+import traceback
+import multiprocessing
+from optparse import OptionParser
+
+# Allow running this file directly from the plugin directory
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+"""Default QGis installation prefix"""
+DEFAULT_QGIS_PREFIX = os.environ.get('QGIS_PREFIX_PATH', '/usr')
+
+
+"""Options of `MapfileExporter.export()` that can be set through the options file"""
+EXPORT_OPTIONS = [
+    'width', 'height', 'shapePath', 'backgroundColor', 'imageType', 'imagePath', 'imageURL',
+    'tempPath', 'validationRegexp', 'templatePath', 'templateHeaderPath', 'templateFooterPath',
+    'mapServerURL', 'createFontFile', 'fontsetPath', 'useSLD', 'backend', 'pgServiceFile',
+    'buildSpatialIndexes', 'consolidateLayers', 'buildOverviews', 'overviewResampling',
+    'prefetchThreads', 'metadataCachePath', 'generalizeLayers', 'sharedSymbolset',
+    'minify', 'narrowPostgisColumns'
+]
+
+
+class ProjectLegend(object):
+    """A stand-in for `QgsLegendInterface` backed by the layer tree of the current project"""
+
+    def __init__(self, project):
+        self.treeLayers = project.layerTreeRoot().findLayers()
+
+    def layers(self):
+        """Return the project's layers in legend order"""
+        return [tl.layer() for tl in self.treeLayers if tl.layer() is not None]
+
+    def isLayerVisible(self, layer):
+        for tl in self.treeLayers:
+            if tl.layerId() == layer.id():
+                return tl.isVisible() == Qt.Checked
+
+        return False
+
+
+def initWorker(qgisPrefix):
+    """Boot a headless QgsApplication in a worker process"""
+
+    global Qt, QFileInfo, QColor
+    global QgsApplication, QgsProject, QgsMapLayerRegistry, QgsRectangle
+    global QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsMessageLog
+    global MapfileExporter, Profiler, utils
+
+    from PyQt4.QtCore import Qt, QFileInfo
+    from PyQt4.QtGui import QColor
+    from qgis.core import QgsApplication, QgsProject, QgsMapLayerRegistry, QgsRectangle, \
+            QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsMessageLog, \
+            QgsProviderRegistry
+
+    # The currently applied locale affects how mapscript handles numeric formatting
+    # (see MapServer bug #1762: https://trac.osgeo.org/mapserver/ticket/1762)
+    locale.setlocale(locale.LC_ALL, 'C')
+
+    QgsApplication.setPrefixPath(qgisPrefix, True)
+
+    # Keep a reference to the application around for the lifetime of the worker
+    initWorker.app = QgsApplication([], False)
+    initWorker.app.initQgis()
+
+    if len(QgsProviderRegistry.instance().providerList()) == 0:
+        raise RuntimeError('No data providers available.')
+
+    # Only import the exporter once QGis is up and running
+    import MapfileExporter
+    import Profiler
+    import utils
+
+    # Forward log messages to stderr, there is no one to look at the message log panel
+    def logMessage(message, tag, level):
+        sys.stderr.write((u'[%s] %s: %s\n' % (os.getpid(), tag, message)).encode('utf-8'))
+
+    QgsMessageLog.instance().messageReceived.connect(logMessage)
+
+
+def projectExtent(crs, layers):
+    """Compute the combined extent of `layers` in the project's CRS"""
+
+    extent = QgsRectangle()
+    extent.setMinimal()
+
+    for layer in layers:
+        layerExtent = layer.extent()
+        if layer.crs() != crs:
+            layerExtent = QgsCoordinateTransform(layer.crs(), crs).transformBoundingBox(layerExtent)
+
+        extent.combineExtentWith(layerExtent)
+
+    return extent
+
+
+def exportOptions(options):
+    """Convert JSON options to arguments of `MapfileExporter.export()`"""
+
+    kwargs = {}
+    for key, value in options.items():
+        if key not in EXPORT_OPTIONS:
+            raise ValueError('Unknown export option: %s' % key)
+
+        if key == 'backgroundColor':
+            value = QColor(value)
+        elif isinstance(value, unicode):
+            value = value.encode('utf-8')
+
+        kwargs[str(key)] = value
+
+    return kwargs
+
+
+def exportProject(job):
+    """Export a single project into a mapfile
+
+        `settings` holds the settings of the batch itself (e.g. `cache`), as opposed to the options
+        passed on to the exporter.
+
+        Returns a `(projectPath, mapfilePath, ok, message, seconds)` tuple.
+    """
+
+    projectPath, mapfilePath, options, settings = job
+    start = time.time()
+
+    try:
+        project = QgsProject.instance()
+        QgsMapLayerRegistry.instance().removeAllMapLayers()
+        project.clear()
+
+        if not project.read(QFileInfo(projectPath)):
+            return (projectPath, mapfilePath, False, 'Unable to read project file.', 0)
+
+        legend = ProjectLegend(project)
+        layers = legend.layers()
+
+        crs = QgsCoordinateReferenceSystem()
+        crs.createFromProj4(project.readEntry('SpatialRefSys', '/ProjectCRSProj4String')[0])
+        if not crs.isValid() and len(layers) > 0:
+            crs = layers[0].crs()
+
+        name = project.title()
+        if name == '':
+            name = QFileInfo(projectPath).completeBaseName()
+
+        kwargs = exportOptions(options)
+        kwargs.update(
+            name = utils.toUTF8(name),
+            units = utils.unitMap.get(crs.mapUnits(), utils.mapscript.MS_METERS),
+            extent = projectExtent(crs, layers),
+            projection = utils.toUTF8(crs.toProj4()),
+            mapfilePath = mapfilePath.decode('utf-8'),
+            layers = layers,
+            legend = legend
+        )
+
+        if settings.get('cache'):
+            kwargs['cachePath'] = mapfilePath.decode('utf-8') + u'.cache'
+
+        kwargs['jobs'] = settings.get('layerJobs', 1)
+
+        if settings.get('profile'):
+            kwargs['profiler'] = Profiler.Profiler()
+
+        ok = MapfileExporter.export(**kwargs)
+        message = '' if ok else 'Unable to write mapfile.'
+
+        if settings.get('profile'):
+            kwargs['profiler'].dump(mapfilePath + '.profile.json')
+
+    except Exception:
+        ok, message = False, traceback.format_exc()
+
+    return (projectPath, mapfilePath, ok, message, time.time() - start)
+
+
+def findProjects(patterns):
+    """Expand glob patterns into a sorted list of unique project paths"""
+
+    projects = []
+    for pattern in patterns:
+        matches = glob.glob(pattern) if glob.has_magic(pattern) else [pattern]
+        for path in sorted(matches):
+            path = os.path.abspath(path)
+            if path not in projects:
+                projects.append(path)
+
+    return projects
+
+
+def mapfilePathFor(projectPath, outputDir):
+    """Derive the mapfile path of a project"""
+
+    base = os.path.splitext(os.path.basename(projectPath))[0] + '.map'
+    return os.path.join(outputDir if outputDir else os.path.dirname(projectPath), base)
+
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog [options] PROJECT.qgs [PROJECT.qgs ...]')
+    parser.add_option('-j', '--jobs', type='int', default=multiprocessing.cpu_count(),
+            help='number of worker processes [default: %default]')
+    parser.add_option('-o', '--options', metavar='FILE',
+            help='JSON file with the options passed to the exporter')
+    parser.add_option('-d', '--output-dir', metavar='DIR',
+            help='directory to write mapfiles to [default: next to each project]')
+    parser.add_option('--qgis-prefix', default=DEFAULT_QGIS_PREFIX, metavar='DIR',
+            help='QGis installation prefix [default: %default]')
+    parser.add_option('-c', '--cache', action='store_true', default=False,
+            help='cache serialized layers next to each mapfile and reuse unchanged ones')
+    parser.add_option('-l', '--layer-jobs', type='int', default=1, metavar='N',
+            help='export projects one at a time, serializing layers in N worker processes')
+    parser.add_option('-p', '--profile', action='store_true', default=False,
+            help='write the time spent in each export phase next to each mapfile')
+
+    opts, args = parser.parse_args(argv)
+
+    projects = findProjects(args)
+    if len(projects) == 0:
+        parser.error('No projects to export.')
+
+    options = {}
+    if opts.options:
+        with open(opts.options) as fin:
+            options = json.load(fin)
+
+    settings = {'cache': opts.cache, 'layerJobs': opts.layer_jobs, 'profile': opts.profile}
+
+    if opts.output_dir and not os.path.isdir(opts.output_dir):
+        os.makedirs(opts.output_dir)
+
+    jobs = [(p, mapfilePathFor(p, opts.output_dir), options, settings) for p in projects]
+
+    # Worker processes cannot start pools of their own, so with parallel layers the projects are
+    # exported by the main process.
+    pool = None
+    if opts.layer_jobs > 1:
+        initWorker(opts.qgis_prefix)
+        results = (exportProject(job) for job in jobs)
+    else:
+        # Each project is handed to a worker on its own, as export times vary wildly between
+        # projects.
+        pool = multiprocessing.Pool(
+            processes = max(1, min(opts.jobs, len(jobs))),
+            initializer = initWorker,
+            initargs = (opts.qgis_prefix,)
+        )
+        results = pool.imap_unordered(exportProject, jobs, chunksize=1)
+
+    failed = 0
+    try:
+        for projectPath, mapfilePath, ok, message, seconds in results:
+            if ok:
+                print 'OK      %s -> %s (%.1fs)' % (projectPath, mapfilePath, seconds)
+            else:
+                failed += 1
+                print 'FAILED  %s: %s' % (projectPath, message)
+
+            sys.stdout.flush()
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    print '%d of %d projects exported.' % (len(jobs) - failed, len(jobs))
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
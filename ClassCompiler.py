@@ -0,0 +1,315 @@
+"""Compilation of categorized, graduated and rule-based renderers into MapServer classes
+
+    MapServer tries the classes of a layer one after the other for every feature, until the
+    expression of one of them matches. Renderers are therefore compiled into as few and as cheap
+    classes as possible:
+
+        - Categories of text and integer attributes are matched against the CLASSITEM of the
+          layer, with plain values or lists (`{a,b,c}`), which are simple string comparisons
+          rather than logical expressions. Categories of real attributes are compared as numbers.
+        - Categories sharing an identical symbol are merged into a single class, and so are
+          adjacent ranges.
+        - The "all other values" category becomes a trailing class without expression, which
+          also takes care of the categories sharing its symbol.
+        - Nested rules are flattened into classes matching the conjunction of the filters of the
+          rule and of its parents, within the intersection of their scale ranges. Conditions and
+          scale ranges shared by all the classes go to the layer instead, and classes which can
+          be reordered without changing which one a feature gets (see:
+          `ExpressionCompiler.excludes()`) are ordered cheapest and most selective first.
+
+    Symbols are only known by keys here (identical symbols have equal keys), so nothing in here
+    depends on QGis or mapscript.
+"""
+
+from collections import OrderedDict
+
+import ExpressionCompiler
+from ExpressionCompiler import formatNumber
+
+
+"""Types of the attribute a renderer classifies features by"""
+FIELD_STRING = 'string'
+FIELD_INTEGER = 'integer'
+FIELD_REAL = 'real'
+
+"""Characters a plain value cannot start with, as they make MapServer read a different expression
+type (logical expression, regex or list)"""
+RESERVED_FIRST = u'(/{'
+
+"""Characters values cannot contain to be part of a list"""
+RESERVED_IN_LIST = u',{}'
+
+"""Smallest estimated selectivity of a class, so that classes matching nothing still get ranked"""
+MIN_SELECTIVITY = 0.001
+
+
+def isPlainValue(value):
+    """Tell whether a value can be matched against the CLASSITEM as is"""
+
+    return value != u'' and value[0] not in RESERVED_FIRST and u'"' not in value
+
+
+def isNumber(value):
+    try:
+        float(value)
+    except ValueError:
+        return False
+
+    return True
+
+
+def valuesExpression(attr, values, fieldType=FIELD_STRING):
+    """Return an expression matching any of `values`, and whether it is matched against CLASSITEM"""
+
+    if fieldType == FIELD_REAL and all(isNumber(v) for v in values):
+        return u'(%s)' % u' OR '.join(u'[%s] = %s' % (attr, v) for v in values), False
+
+    if all(isPlainValue(v) for v in values):
+        if len(values) == 1:
+            return values[0], True
+
+        if not any(c in v for v in values for c in RESERVED_IN_LIST):
+            return u'{%s}' % u','.join(values), True
+
+    return u'(%s)' % u' OR '.join(u'"[%s]" = "%s"' % (attr, v) for v in values), False
+
+
+def compileCategories(attr, categories, fieldType=FIELD_STRING):
+    """Compile the categories of a categorized renderer into classes
+
+        `categories` is the list of `(value, symbolKey)` pairs of the renderer, where an empty
+        value stands for "all other values".
+
+        Returns `(classes, usesClassItem)`, where `classes` is a list of `(expression, indices)`
+        pairs: the expression of the class (None for the trailing catch-all class) and the indices
+        of the categories it stands for, the first one being the one whose symbol to use.
+        `usesClassItem` tells whether the CLASSITEM of the layer must be set to `attr`.
+    """
+
+    catchAll = None
+    groups = OrderedDict()
+    values = OrderedDict()
+    seen = set()
+
+    for i, (value, symbolKey) in enumerate(categories):
+        if value == u'':
+            if catchAll is None:
+                catchAll = i
+            continue
+
+        # Features get the symbol of the first matching category
+        if value in seen:
+            continue
+        seen.add(value)
+
+        groups.setdefault(symbolKey, []).append(i)
+        values.setdefault(symbolKey, []).append(value)
+
+    # Categories looking like all other values do not need a class of their own
+    if catchAll is not None:
+        catchAllKey = categories[catchAll][1]
+        groups.pop(catchAllKey, None)
+        values.pop(catchAllKey, None)
+
+    classes = []
+    usesClassItem = False
+
+    for symbolKey, indices in groups.items():
+        expression, matchesClassItem = valuesExpression(attr, values[symbolKey], fieldType)
+        usesClassItem = usesClassItem or matchesClassItem
+        classes.append((expression, indices))
+
+    if catchAll is not None:
+        classes.append((None, [catchAll]))
+
+    return classes, usesClassItem
+
+
+def compileRanges(attr, ranges):
+    """Compile the ranges of a graduated renderer into classes
+
+        `ranges` is the list of `(lower, upper, symbolKey)` tuples of the renderer. Ranges include
+        their upper bound, and only the first one includes its lower bound as well.
+
+        Returns a list of `(expression, indices)` pairs, as `compileCategories()` does.
+    """
+
+    merged = []
+    for i, (lower, upper, symbolKey) in enumerate(ranges):
+        if len(merged) > 0:
+            last = merged[-1]
+            if last[2] == symbolKey and last[1] == lower:
+                merged[-1] = (last[0], upper, symbolKey, last[3] + [i])
+                continue
+
+        merged.append((lower, upper, symbolKey, [i]))
+
+    return [
+        (
+            u'([%s] %s %s AND [%s] <= %s)' % (
+                attr, u'>=' if indices[0] == 0 else u'>', formatNumber(lower),
+                attr, formatNumber(upper)
+            ),
+            indices
+        )
+        for lower, upper, symbolKey, indices in merged
+    ]
+
+
+def intersectScales(a, b):
+    """Return the intersection of two `(minScale, maxScale)` ranges, None if it is empty
+
+        Scale denominators of 0 stand for no limit, as in QGis.
+    """
+
+    minScale = max(a[0], b[0])
+    maxScale = min(s for s in (a[1], b[1]) if s > 0) if a[1] > 0 or b[1] > 0 else 0
+
+    if maxScale > 0 and minScale >= maxScale:
+        return None
+
+    return minScale, maxScale
+
+
+def coversScales(a, b):
+    """Tell whether scale range `a` includes scale range `b`"""
+
+    return (a[0] <= b[0]) and (a[1] == 0 or 0 < b[1] <= a[1])
+
+
+def flattenRules(rules, conditions, scales, symbols, classes):
+    """Append the classes of `rules` and of their children to `classes`, as `(conditions, scales,
+    symbols)` tuples"""
+
+    # Else rules apply to features no other rule at their level drew, whatever their position
+    for tree, minScale, maxScale, isElse, symbol, children in \
+            [r for r in rules if not r[3]] + [r for r in rules if r[3]]:
+        if ExpressionCompiler.isFalse(tree):
+            continue
+
+        ruleScales = intersectScales(scales, (minScale, maxScale))
+        if ruleScales is None:
+            continue
+
+        # Classes are tried in turn, so an else rule only needs the conditions of its parents
+        ruleConditions = list(conditions)
+        if not isElse:
+            for c in ExpressionCompiler.conjuncts(tree):
+                if c not in ruleConditions:
+                    ruleConditions.append(c)
+
+        ruleSymbols = symbols + [symbol] if symbol is not None else symbols
+
+        # Features matching none of the children only get the symbol of the rule itself
+        flattenRules(children, ruleConditions, ruleScales, ruleSymbols, classes)
+        if symbol is not None:
+            classes.append((ruleConditions, ruleScales, ruleSymbols))
+
+
+def isShadowed(cls, previous):
+    """Tell whether a class can never be reached, because of one of the classes before it"""
+
+    return any(
+        coversScales(p[1], cls[1]) and all(c in cls[0] for c in p[0])
+        for p in previous
+    )
+
+
+def excludesClass(a, b, stringColumns=frozenset()):
+    """Tell whether two classes can never match the same feature at the same scale
+
+        `stringColumns` are as for `ExpressionCompiler.toMapServer()`.
+    """
+
+    (minA, maxA), (minB, maxB) = a[1], b[1]
+    if (maxA > 0 and minB >= maxA) or (maxB > 0 and minA >= maxB):
+        return True
+
+    return ExpressionCompiler.excludes(a[0], b[0], stringColumns)
+
+
+def rank(cls):
+    """Rank of a class: the smaller it is, the earlier the class should be tried"""
+
+    tree = ExpressionCompiler.conjunction(cls[0])
+    return ExpressionCompiler.cost(tree) / \
+            max(ExpressionCompiler.selectivity(tree), MIN_SELECTIVITY)
+
+
+def orderClasses(classes, stringColumns=frozenset()):
+    """Order classes by rank, moving a class before another one only if they exclude each other"""
+
+    excluded = [[excludesClass(a, b, stringColumns) for b in classes] for a in classes]
+    ranks = [rank(c) for c in classes]
+
+    remaining = range(len(classes))
+    ordered = []
+    while len(remaining) > 0:
+        ready = [
+            i for k, i in enumerate(remaining)
+            if all(excluded[j][i] for j in remaining[:k])
+        ]
+        best = min(ready, key=lambda i: (ranks[i], i))
+
+        remaining.remove(best)
+        ordered.append(classes[best])
+
+    return ordered
+
+
+def compileRules(rules, stringColumns=frozenset()):
+    """Compile the rules of a rule-based renderer into classes
+
+        `rules` is the list of the top-level rules of the renderer, as `(tree, minScale, maxScale,
+        isElse, symbol, children)` tuples: the filter of the rule (see: ExpressionCompiler.py,
+        None for no filter), its scale range (0 for no limit), whether it is an else rule, its
+        symbol (None for none) and its own rules, as a list of such tuples.
+
+        Returns `(filter, scales, classes)`, where `filter` is the condition shared by all the
+        classes (None for none) and `scales` their common scale range, both of which apply to the
+        layer, and `classes` is a list of `(tree, minScale, maxScale, symbols)` tuples, in the
+        order MapServer should try them: the expression of the class (None for none), its scale
+        range and the symbols it is drawn with, those of its parents first.
+
+        `stringColumns` are the names of the attributes holding strings, which tell how
+        attributes are compared (see: `ExpressionCompiler.toMapServer()`).
+
+        Features get the first class they match, while QGis draws a feature with each rule it
+        matches: overlapping rules are only rendered the same when they are nested.
+    """
+
+    flat = []
+    flattenRules(rules, [], (0, 0), [], flat)
+
+    classes = []
+    for cls in flat:
+        if not isShadowed(cls, classes):
+            classes.append(cls)
+
+    if len(classes) == 0:
+        return None, (0, 0), []
+
+    # Conditions shared by all the classes are checked once, by the layer
+    common = [c for c in classes[0][0] if all(c in cls[0] for cls in classes[1:])]
+    classes = [([c for c in cls[0] if c not in common], cls[1], cls[2]) for cls in classes]
+
+    classes = orderClasses(classes, stringColumns)
+
+    # So is the scale range covering all the classes
+    mins = [cls[1][0] for cls in classes]
+    maxs = [cls[1][1] for cls in classes]
+    scales = (min(mins), max(maxs) if 0 not in maxs else 0)
+
+    return (
+        ExpressionCompiler.conjunction(common) if len(common) > 0 else None,
+        scales,
+        [
+            (
+                ExpressionCompiler.conjunction(conditions) if len(conditions) > 0 else None,
+                minScale if minScale != scales[0] else 0,
+                maxScale if maxScale != scales[1] else 0,
+                symbols
+            )
+            for conditions, (minScale, maxScale), symbols in classes
+        ]
+    )
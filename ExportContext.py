@@ -0,0 +1,91 @@
+"""Things an export computes once rather than for every layer, style or label
+
+    Serializing a layer needs some global QGis state (the labeling engine settings, the map
+    canvas, ...) and a few lookups that are the same for many layers (font metrics, CRS
+    definitions). An `ExportContext` is created by `MapfileExporter.export()` and handed down to
+    `MapfileExporter.serializeLayer()` and the serializers (see: Serialization.py), which get
+    these from it:
+
+        - the labeling engine, with its settings loaded once;
+        - the render context of the map canvas, and the units of the CRS of the map;
+        - font definitions and sizes, memoized by font and style;
+        - PROJ.4 definitions and authority ids, memoized by CRS.
+
+    The context also carries the profiler of the export (see: Profiler.py).
+"""
+
+from qgis.core import *
+from qgis.utils import iface
+
+from Profiler import NULL_PROFILER
+
+import SerializationUtils
+
+
+class ExportContext(object):
+    """Lazily computed, memoized state shared by the layers of an export"""
+
+    def __init__(self, canvas=None, profiler=NULL_PROFILER):
+        self.canvas = canvas
+        self.profiler = profiler
+
+        self._labelingEngine = None
+        self._renderContext = None
+        self._mapUnits = None
+        self._mapUnitsKnown = False
+        self._fontDefinitions = {}
+        self._crsStrings = {}
+
+    def labelingEngine(self):
+        """Return a `QgsPalLabeling` with the labeling settings of the project loaded"""
+
+        if self._labelingEngine is None:
+            with self.profiler.phase('labels.engine'):
+                self._labelingEngine = QgsPalLabeling()
+                self._labelingEngine.loadEngineSettings()
+
+        return self._labelingEngine
+
+    def renderContext(self):
+        """Return the render context of the map canvas, None without one"""
+
+        if self._renderContext is None and self.canvas is not None:
+            self._renderContext = QgsRenderContext.fromMapSettings(self.canvas.mapSettings())
+
+        return self._renderContext
+
+    def mapUnits(self):
+        """Return the units of the CRS of the map canvas of QGis desktop, None when headless"""
+
+        if not self._mapUnitsKnown:
+            if iface is not None:
+                self._mapUnits = iface.mapCanvas().mapSettings().destinationCrs().mapUnits()
+
+            self._mapUnitsKnown = True
+
+        return self._mapUnits
+
+    def fontDefinition(self, font, style):
+        """Memoized `SerializationUtils.serializeFontDefinition()`"""
+
+        key = (unicode(font.toString()), unicode(style))
+        if key not in self._fontDefinitions:
+            self._fontDefinitions[key] = SerializationUtils.serializeFontDefinition(font, style)
+
+        return self._fontDefinitions[key]
+
+    def crsStrings(self, crs):
+        """Return the PROJ.4 definition and the authority id of a CRS, as unicode strings
+
+            CRSs are told apart by their internal id, CRSs without one are not memoized.
+        """
+
+        key = crs.srsid()
+        if key in self._crsStrings:
+            return self._crsStrings[key]
+
+        strings = (unicode(crs.toProj4()), unicode(crs.authid()))
+        if key != 0:
+            self._crsStrings[key] = strings
+
+        return strings
@@ -0,0 +1,715 @@
+"""Compilation of QGis expressions into MapServer expressions and SQL
+
+    Expressions are handled as trees of tuples, built from QGis expressions by
+    `SerializationUtils.expressionTree()`, so that nothing in here depends on QGis or mapscript:
+
+        ('column', name)
+        ('literal', value)                      value is unicode, int, float, bool or None (NULL)
+        ('and', (operand, ...))
+        ('or', (operand, ...))
+        ('not', operand)
+        ('compare', op, left, right)            op is one of `COMPARISONS`
+        ('match', op, operand, pattern)         op is one of `MATCHES`, pattern is a unicode string
+        ('in', operand, (literal, ...), negated)
+        ('null', operand, negated)
+        ('arithmetic', op, left, right)         op is one of `ARITHMETIC`
+        ('negate', operand)
+        ('concat', (operand, ...), skipNulls)   skipNulls for concat(), which skips NULLs
+        ('function', name, (argument, ...))     name is one of `FUNCTIONS`
+
+    Trees are written as:
+
+        - MapServer logical expressions, for CLASS EXPRESSIONs and layer FILTERs, by
+          `toMapServer()`. Whether values are compared as strings or as numbers follows from the
+          type of the literals and, for columns, from the type of the attributes of the layer;
+        - MapServer string expressions, for label TEXTs, by `toMapServerString()`;
+        - PostgreSQL conditions, for filters pushed down to PostGIS, by `toSql()`.
+
+    Trees are also what renderers are compiled from (see: `ClassCompiler.compileRules()`), which
+    needs to tell how expensive and how selective an expression is (see: `cost()` and
+    `selectivity()`), and whether two conjunctions can ever match the same feature (see:
+    `excludes()`).
+"""
+
+import re
+
+
+"""Comparison operators, and how MapServer writes them"""
+COMPARISONS = {
+    u'=': u'=', u'<>': u'!=', u'<': u'<', u'<=': u'<=', u'>': u'>', u'>=': u'>='
+}
+
+"""Pattern matching operators: SQL patterns (case sensitive or not) and regular expressions"""
+MATCHES = frozenset([u'like', u'ilike', u'regexp'])
+
+"""Arithmetic operators, all of which MapServer knows as they are"""
+ARITHMETIC = frozenset([u'+', u'-', u'*', u'/', u'%', u'^'])
+
+"""Functions of QGis expressions which can be translated, and whether they return strings"""
+FUNCTIONS = {
+    u'upper': True, u'lower': True, u'title': True, u'to_string': True, u'format_number': True,
+    u'length': False
+}
+
+"""Names of the functions translated as they are, in MapServer and in PostgreSQL"""
+MAPSERVER_FUNCTIONS = {u'upper': u'upper', u'lower': u'lower', u'title': u'initcap'}
+SQL_FUNCTIONS = {
+    u'upper': u'upper', u'lower': u'lower', u'title': u'initcap', u'length': u'char_length'
+}
+
+"""Estimated fraction of features matching each kind of comparison, in lack of statistics"""
+SELECTIVITY = {
+    u'=': 0.1, u'<>': 0.9, u'<': 0.33, u'<=': 0.33, u'>': 0.33, u'>=': 0.33,
+    u'like': 0.25, u'ilike': 0.25, u'regexp': 0.25, u'in': 0.1, u'null': 0.1
+}
+
+"""Relative cost of evaluating each kind of node, per feature"""
+COSTS = {
+    u'column': 1.0, u'literal': 0.0, u'compare': 1.0, u'match': 8.0, u'in': 2.0, u'null': 1.0,
+    u'arithmetic': 1.0, u'negate': 0.5, u'not': 0.5, u'and': 0.5, u'or': 0.5, u'concat': 1.0,
+    u'function': 4.0
+}
+
+"""Characters with a meaning in regular expressions"""
+REGEX_SPECIAL = re.compile(r'([\\^$.|?*+()\[\]{}])')
+
+"""Matches the strings that can be written in SQL as numbers as they are"""
+SQL_NUMBER_RX = re.compile(r'^-?[0-9]+(\.[0-9]+)?$')
+
+
+class ExpressionCompileError(ValueError):
+    """Raised for expressions, or parts of them, MapServer has no equivalent for"""
+
+
+TRUE = (u'literal', True)
+
+
+def column(name):
+    return (u'column', name)
+
+
+def literal(value):
+    return (u'literal', value)
+
+
+def conjunction(operands):
+    """Return the conjunction of a list of trees, flattening nested conjunctions"""
+
+    flat = []
+    for operand in operands:
+        for c in conjuncts(operand):
+            if c not in flat:
+                flat.append(c)
+
+    if len(flat) == 0:
+        return TRUE
+    if len(flat) == 1:
+        return flat[0]
+
+    return (u'and', tuple(flat))
+
+
+def conjuncts(tree):
+    """Return the list of trees a tree is the conjunction of (none for TRUE)"""
+
+    if tree is None or tree == TRUE:
+        return []
+    if tree[0] == u'and':
+        return [c for operand in tree[1] for c in conjuncts(operand)]
+
+    return [tree]
+
+
+def operands(tree):
+    """Return the trees a tree is made of"""
+
+    kind = tree[0]
+
+    if kind in (u'and', u'or', u'concat'):
+        return tree[1]
+    if kind in (u'not', u'negate', u'null'):
+        return (tree[1],)
+    if kind in (u'compare', u'arithmetic'):
+        return tree[2:]
+    if kind == u'match':
+        return (tree[2],)
+    if kind == u'in':
+        return (tree[1],) + tuple(tree[2])
+    if kind == u'function':
+        return tree[2]
+
+    return ()
+
+
+def columns(tree):
+    """Return the set of the names of the attributes a tree refers to"""
+
+    if tree[0] == u'column':
+        return set([tree[1]])
+
+    return set(name for operand in operands(tree) for name in columns(operand))
+
+
+def isFalse(tree):
+    """Tell whether a tree never matches (FALSE or NULL)"""
+
+    return tree is not None and tree[0] == u'literal' and tree[1] in (False, None)
+
+
+def isNumber(value):
+    return isinstance(value, (int, long, float)) and not isinstance(value, bool)
+
+
+def formatNumber(value):
+    """Format a number without losing precision"""
+
+    return repr(value) if isinstance(value, float) else u'%s' % value
+
+
+def quoteString(value):
+    return u'"%s"' % value.replace(u'"', u'\\"')
+
+
+def quoteSqlString(value):
+    return u"'%s'" % value.replace(u"'", u"''")
+
+
+def quoteSqlIdentifier(name):
+    return u'"%s"' % name.replace(u'"', u'""')
+
+
+def likeToRegex(pattern):
+    """Translate a SQL LIKE pattern into an anchored regular expression"""
+
+    regex = REGEX_SPECIAL.sub(r'\\\1', pattern)
+    return u'^%s$' % regex.replace(u'%', u'.*').replace(u'_', u'.')
+
+
+def isString(tree, stringColumns):
+    """Tell whether an operand is a string: string literals and string attributes"""
+
+    if tree[0] == u'literal':
+        return isinstance(tree[1], basestring)
+    if tree[0] == u'column':
+        return tree[1] in stringColumns
+    if tree[0] == u'concat':
+        return True
+    if tree[0] == u'function':
+        return FUNCTIONS[tree[1]]
+
+    return False
+
+
+def functionArguments(tree, count):
+    """Return the arguments of a function, checking their number"""
+
+    name, arguments = tree[1:]
+    if len(arguments) != count:
+        raise ExpressionCompileError(
+            '%s() takes %d arguments, %d given' % (name, count, len(arguments))
+        )
+
+    return arguments
+
+
+def integerArgument(tree):
+    if tree[0] != u'literal' or not isNumber(tree[1]) or int(tree[1]) != tree[1]:
+        raise ExpressionCompileError('An integer is expected rather than %r' % (tree,))
+
+    return int(tree[1])
+
+
+def stringValue(tree, stringColumns):
+    """Write a value as a MapServer string expression"""
+
+    kind = tree[0]
+
+    if kind == u'concat':
+        return u'(%s)' % u' + '.join(stringValue(t, stringColumns) for t in tree[1])
+
+    if kind == u'function' and tree[1] in MAPSERVER_FUNCTIONS:
+        value, = functionArguments(tree, 1)
+        return u'%s(%s)' % (MAPSERVER_FUNCTIONS[tree[1]], stringValue(value, stringColumns))
+
+    if kind == u'function' and tree[1] == u'to_string':
+        value, = functionArguments(tree, 1)
+        return stringValue(value, stringColumns)
+
+    if kind == u'function' and tree[1] == u'format_number':
+        value, places = functionArguments(tree, 2)
+        return u'commify(tostring(%s, "%%.%df"))' % (
+            operand(value, False, stringColumns), integerArgument(places)
+        )
+
+    if kind in (u'column', u'literal') or isString(tree, stringColumns):
+        return operand(tree, True, stringColumns)
+
+    return u'tostring(%s, "%%g")' % operand(tree, False, stringColumns)
+
+
+def operand(tree, asString, stringColumns):
+    """Write a value, as a string or as a number"""
+
+    kind = tree[0]
+
+    if kind == u'column':
+        return u'"[%s]"' % tree[1] if asString else u'[%s]' % tree[1]
+
+    if kind == u'literal':
+        value = tree[1]
+        if value is None:
+            raise ExpressionCompileError('NULL can only be tested with IS NULL')
+        if isinstance(value, bool):
+            return u'true' if value else u'false'
+        if asString:
+            return quoteString(value if isinstance(value, basestring) else formatNumber(value))
+        if isNumber(value):
+            return formatNumber(value)
+
+        try:
+            return formatNumber(float(value))
+        except ValueError:
+            raise ExpressionCompileError('%r is not a number' % value)
+
+    if kind in (u'concat', u'function') and isString(tree, stringColumns):
+        if not asString:
+            raise ExpressionCompileError('%s is not a number' % kind)
+        return stringValue(tree, stringColumns)
+
+    if asString:
+        return stringValue(tree, stringColumns)
+
+    if kind == u'function':
+        value, = functionArguments(tree, 1)
+        return u'length(%s)' % stringValue(value, stringColumns)
+
+    return toMapServer(tree, stringColumns)
+
+
+def toMapServer(tree, stringColumns=frozenset()):
+    """Write a tree as a MapServer logical expression
+
+        `stringColumns` are the names of the attributes holding strings, other attributes are
+        compared as numbers. Raises ExpressionCompileError for trees MapServer has no equivalent
+        for.
+    """
+
+    kind = tree[0]
+
+    if kind in (u'and', u'or'):
+        separator = u' AND ' if kind == u'and' else u' OR '
+        return u'(%s)' % separator.join(toMapServer(t, stringColumns) for t in tree[1])
+
+    if kind == u'not':
+        return u'(NOT %s)' % toMapServer(tree[1], stringColumns)
+
+    if kind == u'compare':
+        op, left, right = tree[1:]
+        asString = isString(left, stringColumns) or isString(right, stringColumns)
+        return u'(%s %s %s)' % (
+            operand(left, asString, stringColumns), COMPARISONS[op],
+            operand(right, asString, stringColumns)
+        )
+
+    if kind == u'match':
+        op, value, pattern = tree[1:]
+        regex = pattern if op == u'regexp' else likeToRegex(pattern)
+        return u'(%s %s %s)' % (
+            operand(value, True, stringColumns), u'~*' if op == u'ilike' else u'~',
+            quoteString(regex)
+        )
+
+    if kind == u'in':
+        value, values, negated = tree[1:]
+        asString = any(isString(v, stringColumns) for v in (value,) + tuple(values))
+        items = [operand(v, asString, stringColumns) for v in values]
+
+        # Values are given as a comma separated list, which values cannot contain
+        if asString:
+            items = [i[1:-1] for i in items]
+        if any(u',' in i or u'\\"' in i for i in items):
+            compiled = toMapServer((u'or', tuple(
+                (u'compare', u'=', value, v) for v in values
+            )), stringColumns)
+        else:
+            compiled = u'(%s IN "%s")' % (
+                operand(value, asString, stringColumns), u','.join(items)
+            )
+
+        return u'(NOT %s)' % compiled if negated else compiled
+
+    if kind == u'null':
+        value, negated = tree[1:]
+        if value[0] != u'column':
+            raise ExpressionCompileError('Only attributes can be tested with IS NULL')
+
+        # MapServer reads missing values as empty strings
+        return u'("[%s]" %s "")' % (value[1], u'!=' if negated else u'=')
+
+    if kind == u'arithmetic':
+        op, left, right = tree[1:]
+        return u'(%s %s %s)' % (
+            operand(left, False, stringColumns), op, operand(right, False, stringColumns)
+        )
+
+    if kind == u'negate':
+        return u'(-%s)' % operand(tree[1], False, stringColumns)
+
+    if kind == u'literal' and isinstance(tree[1], bool):
+        return u'(%s)' % operand(tree, False, stringColumns)
+
+    raise ExpressionCompileError('%s cannot be used as a condition' % kind)
+
+
+def toMapServerString(tree, stringColumns=frozenset()):
+    """Write a tree as a MapServer string expression, e.g. `("[name]" + " " + "[ref]")`
+
+        `stringColumns` are as for `toMapServer()`, numbers are written with `tostring()`.
+        Raises ExpressionCompileError for trees MapServer has no equivalent for.
+    """
+
+    text = stringValue(tree, stringColumns)
+    return text if tree[0] == u'concat' else u'(%s)' % text
+
+
+def sqlValues(trees, stringColumns):
+    """Write values compared with each other as PostgreSQL values of the same type
+
+        Strings and numbers are compared as strings, as MapServer does (see: `toMapServer()`):
+        numeric literals are quoted. String literals holding plain numbers are written as
+        numbers instead when compared with numeric attributes or expressions. Raises
+        ExpressionCompileError for other mixes, which PostgreSQL would reject.
+    """
+
+    if stringColumns is None:
+        return [toSql(t) for t in trees]
+
+    typed = [t for t in trees if t != literal(None)]
+    strings = [t for t in typed if isString(t, stringColumns)]
+    numbers = [t for t in typed if not isString(t, stringColumns)]
+
+    if len(strings) == 0 or len(numbers) == 0:
+        return [toSql(t, stringColumns) for t in trees]
+
+    if all(t[0] == u'literal' and isNumber(t[1]) for t in numbers):
+        return [
+            quoteSqlString(formatNumber(t[1])) if t in numbers else toSql(t, stringColumns)
+            for t in trees
+        ]
+
+    if all(t[0] == u'literal' and SQL_NUMBER_RX.match(t[1]) for t in strings):
+        return [t[1] if t in strings else toSql(t, stringColumns) for t in trees]
+
+    raise ExpressionCompileError('Strings cannot be compared with %s' % describe(numbers[0]))
+
+
+def sqlText(tree, stringColumns):
+    """Write a value as a PostgreSQL text value"""
+
+    if stringColumns is None or isString(tree, stringColumns):
+        return toSql(tree, stringColumns)
+
+    return u'CAST(%s AS text)' % toSql(tree, stringColumns)
+
+
+def toSql(tree, stringColumns=None):
+    """Write a tree as a PostgreSQL condition (or value)
+
+        `stringColumns` are the names of the attributes holding strings, as for `toMapServer()`:
+        values of different types are converted as MapServer would, or rejected. Values are
+        written as they are if None, which only suits messages (see: `describe()`).
+        Raises ExpressionCompileError for trees PostgreSQL has no equivalent for.
+    """
+
+    kind = tree[0]
+
+    if kind == u'column':
+        return quoteSqlIdentifier(tree[1])
+
+    if kind == u'literal':
+        value = tree[1]
+        if value is None:
+            return u'NULL'
+        if isinstance(value, bool):
+            return u'TRUE' if value else u'FALSE'
+        if isNumber(value):
+            return formatNumber(value)
+
+        return quoteSqlString(value)
+
+    if kind in (u'and', u'or'):
+        separator = u' AND ' if kind == u'and' else u' OR '
+        return u'(%s)' % separator.join(toSql(t, stringColumns) for t in tree[1])
+
+    if kind == u'not':
+        return u'(NOT %s)' % toSql(tree[1], stringColumns)
+
+    if kind == u'compare':
+        op, left, right = tree[1:]
+        left, right = sqlValues([left, right], stringColumns)
+        return u'(%s %s %s)' % (left, op, right)
+
+    if kind == u'match':
+        op, value, pattern = tree[1:]
+        return u'(%s %s %s)' % (
+            sqlText(value, stringColumns),
+            {u'like': u'LIKE', u'ilike': u'ILIKE', u'regexp': u'~'}[op], quoteSqlString(pattern)
+        )
+
+    if kind == u'in':
+        value, values, negated = tree[1:]
+        written = sqlValues((value,) + tuple(values), stringColumns)
+        return u'(%s %sIN (%s))' % (
+            written[0], u'NOT ' if negated else u'', u', '.join(written[1:])
+        )
+
+    if kind == u'null':
+        value, negated = tree[1:]
+        return u'(%s IS %sNULL)' % (toSql(value, stringColumns), u'NOT ' if negated else u'')
+
+    if kind == u'arithmetic':
+        op, left, right = tree[1:]
+
+        # Divisions of integers give reals in QGis
+        if op == u'/':
+            return u'(%s / %s::float8)' % (
+                toSql(left, stringColumns), toSql(right, stringColumns)
+            )
+
+        return u'(%s %s %s)' % (toSql(left, stringColumns), op, toSql(right, stringColumns))
+
+    if kind == u'negate':
+        return u'(-%s)' % toSql(tree[1], stringColumns)
+
+    if kind == u'concat':
+        values, skipNulls = tree[1:]
+        texts = [sqlText(t, stringColumns) for t in values]
+
+        # `||` gives NULL if any operand is NULL, `concat()` takes NULLs for empty strings
+        if skipNulls:
+            texts = [u"COALESCE(%s, '')" % t for t in texts]
+
+        return u'(%s)' % u' || '.join(texts)
+
+    if kind == u'function' and tree[1] in SQL_FUNCTIONS:
+        value, = functionArguments(tree, 1)
+        return u'%s(%s)' % (SQL_FUNCTIONS[tree[1]], sqlText(value, stringColumns))
+
+    if kind == u'function' and tree[1] == u'to_string':
+        value, = functionArguments(tree, 1)
+        return u'CAST(%s AS text)' % toSql(value, stringColumns)
+
+    raise ExpressionCompileError('%s has no SQL equivalent' % (
+        u'%s()' % tree[1] if kind == u'function' else kind
+    ))
+
+
+def describe(tree):
+    """Write a tree for messages, in a syntax close to the one of QGis expressions"""
+
+    try:
+        return toSql(tree)
+    except ExpressionCompileError:
+        return repr(tree)
+
+
+def cost(tree):
+    """Estimate the cost of evaluating a tree for a feature"""
+
+    kind = tree[0]
+    nodeCost = COSTS.get(kind, 1.0)
+
+    if kind in (u'and', u'or', u'concat'):
+        return nodeCost + sum(cost(t) for t in tree[1])
+    if kind == u'function':
+        return nodeCost + sum(cost(t) for t in tree[2])
+    if kind in (u'compare', u'arithmetic'):
+        return nodeCost + cost(tree[2]) + cost(tree[3])
+    if kind == u'match':
+        return nodeCost + cost(tree[2])
+    if kind == u'in':
+        return nodeCost + cost(tree[1]) + len(tree[2]) / 4.0
+    if kind in (u'not', u'negate', u'null'):
+        return nodeCost + cost(tree[1])
+
+    return nodeCost
+
+
+def selectivity(tree):
+    """Estimate the fraction of features a tree matches"""
+
+    kind = tree[0]
+
+    if kind == u'literal':
+        return 0.0 if isFalse(tree) else 1.0
+    if kind == u'and':
+        return reduce(lambda s, t: s * selectivity(t), tree[1], 1.0)
+    if kind == u'or':
+        return 1.0 - reduce(lambda s, t: s * (1.0 - selectivity(t)), tree[1], 1.0)
+    if kind == u'not':
+        return 1.0 - selectivity(tree[1])
+    if kind in (u'compare', u'match'):
+        return SELECTIVITY.get(tree[1], 0.5)
+    if kind == u'in':
+        s = min(1.0, SELECTIVITY[u'in'] * len(tree[2]))
+        return 1.0 - s if tree[3] else s
+    if kind == u'null':
+        s = SELECTIVITY[u'null']
+        return 1.0 - s if tree[2] else s
+
+    return 0.5
+
+
+def valueKey(value, asString):
+    """Key values are compared by: strings as MapServer writes them, or floats (None if the
+    value is not a number)"""
+
+    if asString:
+        return value if isinstance(value, basestring) else formatNumber(value)
+
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class Domain(object):
+    """Values an attribute can take for a conjunction to match: a set and/or an interval
+
+        Values are keys (see: `valueKey()`). Domains of attributes compared as strings only ever
+        have a set: MapServer compares strings lexicographically, so that numeric intervals do
+        not apply.
+    """
+
+    def __init__(self):
+        self.values = None
+        self.lower = None
+        self.upper = None
+
+    def restrictValues(self, values):
+        values = frozenset(values)
+        self.values = values if self.values is None else self.values & values
+
+    def restrictLower(self, bound, inclusive):
+        # Exclusive bounds are tighter than inclusive ones
+        if self.lower is None or (bound, not inclusive) > (self.lower[0], not self.lower[1]):
+            self.lower = (bound, inclusive)
+
+    def restrictUpper(self, bound, inclusive):
+        if self.upper is None or (bound, inclusive) < self.upper:
+            self.upper = (bound, inclusive)
+
+    def contains(self, value):
+        if self.values is not None and value not in self.values:
+            return False
+
+        if self.lower is not None or self.upper is not None:
+            if not isinstance(value, float):
+                return False
+            if self.lower is not None and (value < self.lower[0] or
+                    (value == self.lower[0] and not self.lower[1])):
+                return False
+            if self.upper is not None and (value > self.upper[0] or
+                    (value == self.upper[0] and not self.upper[1])):
+                return False
+
+        return True
+
+    def isEmpty(self):
+        if self.values is not None:
+            return not any(self.contains(v) for v in self.values)
+
+        if self.lower is not None and self.upper is not None:
+            return self.lower[0] > self.upper[0] or (self.lower[0] == self.upper[0] and
+                    not (self.lower[1] and self.upper[1]))
+
+        return False
+
+
+"""Comparisons of a value with an attribute, seen from the attribute: `1 < a` is `a > 1`"""
+MIRRORED = {u'=': u'=', u'<>': u'<>', u'<': u'>', u'<=': u'>=', u'>': u'<', u'>=': u'<='}
+
+
+def domains(trees, stringColumns=frozenset()):
+    """Return the domains of the attributes constrained by a list of conjuncts
+
+        Attributes are compared as strings or as numbers as by `toMapServer()`, which
+        `stringColumns` are for. Domains are keyed by `(attribute, asString)`, so that string and
+        numeric comparisons of the same attribute are never reasoned about together.
+    """
+
+    result = {}
+
+    for tree in trees:
+        kind = tree[0]
+
+        if kind == u'compare':
+            op, left, right = tree[1:]
+            if right[0] == u'column' and left[0] == u'literal':
+                op, left, right = MIRRORED[op], right, left
+            if left[0] != u'column' or right[0] != u'literal' or right[1] is None or \
+                    isinstance(right[1], bool):
+                continue
+
+            asString = isString(left, stringColumns) or isString(right, stringColumns)
+            bound = valueKey(right[1], asString)
+            if bound is None:
+                continue
+
+            domain = result.setdefault((left[1], asString), Domain())
+
+            if op == u'=':
+                domain.restrictValues([bound])
+            elif asString:
+                continue
+            elif op in (u'>', u'>='):
+                domain.restrictLower(bound, op == u'>=')
+            elif op in (u'<', u'<='):
+                domain.restrictUpper(bound, op == u'<=')
+
+        elif kind == u'in' and tree[1][0] == u'column' and not tree[3]:
+            values = tree[2]
+            if not all(v[0] == u'literal' and v[1] is not None and not isinstance(v[1], bool)
+                    for v in values):
+                continue
+
+            asString = any(isString(v, stringColumns) for v in (tree[1],) + tuple(values))
+            keys = [valueKey(v[1], asString) for v in values]
+            if None in keys:
+                continue
+
+            result.setdefault((tree[1][1], asString), Domain()).restrictValues(keys)
+
+    return result
+
+
+def excludes(a, b, stringColumns=frozenset()):
+    """Tell whether two lists of conjuncts cannot match the same feature
+
+        Only obvious cases are detected: an operand and its negation, and attributes compared with
+        values or intervals which do not overlap. A False result means nothing. `stringColumns`
+        are as for `toMapServer()`.
+    """
+
+    for tree in a:
+        if (u'not', tree) in b:
+            return True
+    for tree in b:
+        if (u'not', tree) in a:
+            return True
+
+    domainsA, domainsB = domains(a, stringColumns), domains(b, stringColumns)
+    for attr in set(domainsA) & set(domainsB):
+        domain = Domain()
+        for d in (domainsA[attr], domainsB[attr]):
+            if d.values is not None:
+                domain.restrictValues(d.values)
+            if d.lower is not None:
+                domain.restrictLower(*d.lower)
+            if d.upper is not None:
+                domain.restrictUpper(*d.upper)
+
+        if domain.isEmpty():
+            return True
+
+    return False
@@ -0,0 +1,202 @@
+"""Generalized copies of vector layers, drawn at the scales they are good enough for
+
+    Layers with a lot of detail (national roads, boundaries, ...) are slow to draw at small
+    scales, where most of their vertices end up in the same pixels. For each tolerance given, a
+    simplified copy of such a layer is written to a shapefile, and the layer is exported as a set
+    of scale-banded layers sharing a GROUP named after it: the full resolution data at large
+    scales, and coarser and coarser copies at smaller scales (see: ScaleBands.py).
+
+    Each band is a layer of its own, with the symbology, labeling and scale range of the original
+    layer, so that it goes through the export like any other layer (cache, worker processes,
+    spatial indexes, ...).
+"""
+
+import os
+import re
+import hashlib
+
+from PyQt4.QtCore import *
+from PyQt4.QtXml import QDomDocument
+from qgis.core import *
+
+from utils import toUTF8
+
+import utils
+import LayerCache
+import ParallelExport
+import ScaleBands
+
+
+"""Custom property of band layers holding the name of their group"""
+GROUP_PROPERTY = u'rt_mapserver_exporter/group'
+
+
+class GeneralizedLegend(object):
+    """A stand-in for a `QgsLegendInterface` that also knows about band layers"""
+
+    def __init__(self, legend, sources):
+        self.legend = legend
+        # Original layers by band layer id
+        self.sources = sources
+
+    def layers(self):
+        return self.legend.layers()
+
+    def isLayerVisible(self, layer):
+        return self.legend.isLayerVisible(self.sources.get(layer.id(), layer))
+
+
+def copyPath(layer, tolerance, copyDir):
+    """Return the path of the copy of a layer simplified with `tolerance`"""
+
+    h = hashlib.sha1()
+    for value in (layer.providerType(), layer.source(), tolerance):
+        h.update(toUTF8(u'%s' % value))
+        h.update(b'\0')
+
+    baseName = re.sub(u'[^\\w\\-]+', u'_', unicode(layer.name()), flags=re.UNICODE)
+    return os.path.join(copyDir, u'%s_%s.shp' % (baseName, h.hexdigest()[:10]))
+
+
+def copyIsCurrent(layer, shapefilePath):
+    """Tell whether a copy is newer than the data files of its layer
+
+        Copies of remote data sources are never considered current.
+    """
+
+    dataFiles = LayerCache.dataFiles(layer)
+    if len(dataFiles) == 0 or not os.path.isfile(shapefilePath):
+        return False
+
+    copyTime = os.path.getmtime(shapefilePath)
+    return all(os.path.getmtime(f) <= copyTime for f in dataFiles if os.path.isfile(f))
+
+
+def writeSimplifiedCopy(layer, tolerance, shapefilePath):
+    """Write the features of a layer, simplified with `tolerance`, to a shapefile
+
+        Features whose geometry cannot be simplified are written as they are.
+    """
+
+    writer = QgsVectorFileWriter(
+        shapefilePath, 'UTF-8', layer.pendingFields(), layer.wkbType(), layer.crs(),
+        'ESRI Shapefile'
+    )
+    if writer.hasError() != QgsVectorFileWriter.NoError:
+        raise IOError(unicode(writer.errorMessage()))
+
+    for feature in layer.getFeatures():
+        geometry = feature.geometry()
+        if geometry is not None:
+            simplified = geometry.simplify(tolerance)
+            if simplified is not None and not simplified.isGeosEmpty():
+                feature.setGeometry(simplified)
+
+        writer.addFeature(feature)
+
+    # The file is only complete once the writer is gone
+    del writer
+
+    return shapefilePath
+
+
+def bandLayer(layer, index, source, providerType):
+    """Clone a layer, including its style and labeling, on top of another data source"""
+
+    doc = QDomDocument()
+    doc.setContent(ParallelExport.layerToXml(layer))
+
+    root = doc.documentElement()
+    for tag, value in (
+        (u'id', u'%s_band%d' % (layer.id(), index)),
+        (u'layername', u'%s_%d' % (layer.name(), index)),
+        (u'datasource', source),
+        (u'provider', providerType)
+    ):
+        element = root.firstChildElement(tag)
+        while element.hasChildNodes():
+            element.removeChild(element.firstChild())
+        element.appendChild(doc.createTextNode(value))
+
+    return ParallelExport.layerFromXml(doc.toString(), layer.type())
+
+
+def generalizeLayer(layer, tolerances, copyDir):
+    """Split a layer into scale-banded layers backed by simplified copies of its data
+
+        Returns the band layers, from the finest to the coarsest.
+    """
+
+    if layer.hasScaleBasedVisibility():
+        minScale, maxScale = layer.minimumScale(), layer.maximumScale()
+    else:
+        minScale, maxScale = -1, -1
+
+    units = utils.unitMap.get(layer.crs().mapUnits(), utils.mapscript.MS_METERS)
+    bands = ScaleBands.scaleBands(tolerances, units, minScale, maxScale)
+
+    if not os.path.isdir(copyDir):
+        os.makedirs(copyDir)
+
+    layers = []
+    for index, (tolerance, low, high) in enumerate(bands):
+        if tolerance == 0:
+            band = bandLayer(layer, index, unicode(layer.source()), layer.providerType())
+        else:
+            shapefilePath = copyPath(layer, tolerance, copyDir)
+            if not copyIsCurrent(layer, shapefilePath):
+                writeSimplifiedCopy(layer, tolerance, shapefilePath)
+
+            band = bandLayer(layer, index, shapefilePath, u'ogr')
+
+        # The scale range of the original layer has been folded into the bands
+        band.toggleScaleBasedVisibility(low >= 0 or high >= 0)
+        band.setMinimumScale(low)
+        band.setMaximumScale(high)
+        band.setCustomProperty(GROUP_PROPERTY, layer.name())
+
+        layers.append(band)
+
+    return layers
+
+
+def generalize(layers, legend, tolerances, copyDir):
+    """Replace the layers listed in `tolerances` by their bands (see: `generalizeLayer()`)
+
+        `tolerances` holds the tolerances of each layer to generalize, by layer name or id, in
+        the units of its CRS.
+
+        Returns the new list of layers, and a legend aware of the band layers.
+    """
+
+    result = []
+    sources = {}
+
+    for layer in layers:
+        layerTolerances = tolerances.get(layer.id(), tolerances.get(layer.name()))
+
+        if not layerTolerances or layer.type() != QgsMapLayer.VectorLayer \
+                or layer.geometryType() not in (QGis.Line, QGis.Polygon):
+            result.append(layer)
+            continue
+
+        try:
+            bands = generalizeLayer(layer, layerTolerances, copyDir)
+        except (IOError, OSError, ValueError) as e:
+            QgsMessageLog.logMessage(
+                u'Unable to generalize layer %s: %s' % (layer.name(), e),
+                u'RT MapServer Exporter'
+            )
+            result.append(layer)
+            continue
+
+        QgsMessageLog.logMessage(
+            u'Layer %s split into %d scale bands' % (layer.name(), len(bands)),
+            u'RT MapServer Exporter'
+        )
+
+        for band in bands:
+            sources[band.id()] = layer
+        result.extend(bands)
+
+    return result, GeneralizedLegend(legend, sources)
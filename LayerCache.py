@@ -0,0 +1,177 @@
+"""Cache of serialized layers, used to speed up re-exporting a project
+
+    Every layer gets a fingerprint covering everything its serialization depends on: data source,
+    CRS, symbology and labeling, scale range and the modification time of its data files, or for
+    remote data sources the extent, sub-layers and fields read from them (see:
+    `metadataVersion()`). The fragment written for a layer (see:
+    `MapfileWriter.MapfileStream.layerFragment()`) is stored in a cache directory under that
+    fingerprint, so unchanged layers are not serialized again by the next export.
+"""
+
+import os
+import json
+import hashlib
+
+from PyQt4.QtCore import *
+from PyQt4.QtXml import QDomDocument
+from qgis.core import *
+
+from utils import toUTF8
+
+import MapfileUtils
+
+
+"""Bump this whenever the serialization of layers changes, to invalidate existing caches"""
+CACHE_VERSION = 6
+
+"""Extension of the cache entries"""
+ENTRY_EXTENSION = u'.json'
+
+
+def dataFiles(layer):
+    """List the local files the data of a layer is read from, along with their sidecars"""
+
+    provider = layer.providerType()
+
+    if provider == 'spatialite':
+        return [unicode(QgsDataSourceURI(layer.source()).database())]
+
+    if provider not in ('ogr', 'gdal'):
+        return []
+
+    filePath = unicode(layer.source()).split(u'|')[0]
+    if not os.path.isfile(filePath):
+        return []
+
+    # Shapefiles come with .dbf, .prj, .qix, ... files having the same base name
+    dirPath, fileName = os.path.split(filePath)
+    baseName = os.path.splitext(fileName)[0] + u'.'
+
+    return sorted(
+        os.path.join(dirPath, name) for name in os.listdir(dirPath or u'.')
+        if name.startswith(baseName)
+    )
+
+
+def metadataVersion(metadata):
+    """Return what stands for the version of data without data files: the extent, sub-layers
+    and fields of a `LayerMetadata.LayerMetadata`, as the serialization of the layer uses them"""
+
+    return (metadata.extent, metadata.subLayers, metadata.subLayerStyles, metadata.fields)
+
+
+def layerFingerprint(layer, extra=()):
+    """Compute the fingerprint of a QGis layer
+
+        `extra` holds the export settings the serialization of the layer depends on, and the
+        version of its data if it has no data files (see: `metadataVersion()`).
+    """
+
+    h = hashlib.sha1()
+
+    def update(value):
+        h.update(toUTF8(u'%s' % value))
+        h.update(b'\0')
+
+    update(CACHE_VERSION)
+    update(layer.name())
+    update(layer.providerType())
+    update(layer.source())
+
+    # Filter
+    if layer.type() == QgsMapLayer.VectorLayer:
+        update(layer.subsetString())
+
+    # CRS
+    update(layer.crs().toProj4())
+    update(layer.crs().authid())
+
+    # Scale range
+    update(layer.hasScaleBasedVisibility())
+    update(layer.minimumScale())
+    update(layer.maximumScale())
+
+    # Symbology, and labeling settings (stored as custom properties)
+    doc = QDomDocument()
+    node = doc.createElement(u'maplayer')
+    doc.appendChild(node)
+    layer.writeSymbology(node, doc, u'')
+    update(doc.toString())
+
+    for key in sorted(layer.customPropertyKeys()):
+        update(key)
+        update(layer.customProperty(key))
+
+    # Data files
+    for filePath in dataFiles(layer):
+        try:
+            st = os.stat(filePath)
+        except OSError:
+            continue
+
+        update(filePath)
+        update(st.st_mtime)
+        update(st.st_size)
+
+    for value in extra:
+        update(value)
+
+    return h.hexdigest()
+
+
+class LayerCache(object):
+    """A directory holding serialized layers, one file per fingerprint
+
+        The directory should only be used by the exports of a single mapfile: entries which are
+        not used by an export are removed by `prune()`.
+    """
+
+    def __init__(self, cachePath):
+        self.cachePath = cachePath
+        self.used = set()
+        self.hits = 0
+        self.misses = 0
+
+        if not os.path.isdir(cachePath):
+            os.makedirs(cachePath)
+
+    def entryPath(self, fingerprint):
+        return os.path.join(self.cachePath, fingerprint + ENTRY_EXTENSION)
+
+    def get(self, fingerprint):
+        """Return the fragment stored under a fingerprint, or None if there is none"""
+
+        self.used.add(fingerprint)
+
+        try:
+            with open(self.entryPath(fingerprint), 'rb') as fin:
+                fragment = json.loads(fin.read().decode('utf-8'))
+        except (IOError, OSError, ValueError):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return fragment
+
+    def put(self, fingerprint, fragment):
+        """Store a fragment under a fingerprint"""
+
+        self.used.add(fingerprint)
+
+        # Write to a temporary file first, so that interrupted exports leave no broken entries.
+        # Its name is unique to the process, as other exports may share the directory.
+        entryPath = self.entryPath(fingerprint)
+        tempPath = entryPath + u'.%d.tmp' % os.getpid()
+
+        with open(tempPath, 'wb') as fout:
+            fout.write(json.dumps(fragment).encode('utf-8'))
+
+        MapfileUtils.replaceFile(tempPath, entryPath)
+
+    def prune(self):
+        """Remove the entries that were not used since the cache was opened"""
+
+        for fileName in os.listdir(self.cachePath):
+            fingerprint, ext = os.path.splitext(fileName)
+            if ext == ENTRY_EXTENSION and fingerprint not in self.used:
+                os.remove(os.path.join(self.cachePath, fileName))
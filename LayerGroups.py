@@ -0,0 +1,252 @@
+"""Consolidation of adjacent look-alike layers into a single tiled layer
+
+    Projects often hold runs of layers that only differ by their data file: raster tiles, or
+    shapefiles split by region, all with the same schema and style. MapServer opens every file of
+    every such layer on each request. Instead, each run is exported as a single layer:
+
+        - Shapefiles are listed in a tile index, a polygon shapefile holding the extent and the
+          path (`TILE_ITEM`) of every tile, which the layer refers to with TILEINDEX. MapServer
+          only opens the tiles intersecting the extent of a request.
+        - Rasters are mosaicked into a GDAL VRT, or listed in a tile index like shapefiles when
+          the GDAL Python bindings cannot build VRTs.
+
+    Only adjacent layers (in legend order) are merged, so that the drawing order is kept.
+"""
+
+import os
+import re
+
+from PyQt4.QtCore import *
+from PyQt4.QtXml import QDomDocument
+from qgis.core import *
+
+from utils import toUTF8
+
+
+"""Attribute of the tile index holding the paths of the tiles"""
+TILE_ITEM = 'location'
+
+
+def styleXml(layer):
+    doc = QDomDocument()
+    node = doc.createElement(u'maplayer')
+    doc.appendChild(node)
+    layer.writeSymbology(node, doc, u'')
+
+    return unicode(doc.toString())
+
+
+def layerFile(layer):
+    """Return the path of the data file of a shapefile or GDAL raster layer, or None"""
+
+    if layer.providerType() not in ('ogr', 'gdal'):
+        return None
+
+    filePath = unicode(layer.source()).split(u'|')[0]
+    if not os.path.isfile(filePath):
+        return None
+
+    if layer.providerType() == 'ogr' and not filePath.lower().endswith(u'.shp'):
+        return None
+
+    return filePath
+
+
+def groupKey(layer, visible):
+    """Return a value equal for layers that can share a tiled layer, or None if `layer` cannot"""
+
+    if layerFile(layer) is None:
+        return None
+
+    if layer.type() == QgsMapLayer.VectorLayer:
+        schema = (
+            u'vector', layer.wkbType(),
+            tuple((unicode(f.name()), unicode(f.typeName())) for f in layer.pendingFields()),
+            unicode(layer.subsetString())
+        )
+    elif layer.type() == QgsMapLayer.RasterLayer:
+        provider = layer.dataProvider()
+        schema = (
+            u'raster',
+            tuple(provider.dataType(band) for band in range(1, layer.bandCount() + 1))
+        )
+    else:
+        return None
+
+    properties = tuple(
+        (unicode(key), unicode(layer.customProperty(key)))
+        for key in sorted(layer.customPropertyKeys())
+    )
+
+    return schema + (
+        unicode(layer.crs().toProj4()), styleXml(layer), properties, visible,
+        layer.hasScaleBasedVisibility(), layer.minimumScale(), layer.maximumScale()
+    )
+
+
+def findGroups(layers, legend, minSize):
+    """Split layers into runs of adjacent layers that can share a tiled layer
+
+        Runs of less than `minSize` layers are split into single layers.
+    """
+
+    groups = []
+    run, runKey = [], None
+
+    def flush():
+        if len(run) >= minSize and runKey is not None:
+            groups.append(list(run))
+        else:
+            groups.extend([l] for l in run)
+
+    for layer in layers:
+        key = groupKey(layer, legend.isLayerVisible(layer))
+
+        if key is None or key != runKey:
+            flush()
+            run, runKey = [], key
+
+        run.append(layer)
+
+    flush()
+
+    return groups
+
+
+def groupName(group):
+    """Name a group after the common prefix of the names of its layers"""
+
+    names = [unicode(l.name()) for l in group]
+    prefix = re.sub(u'[\\s_\\-.]+$', u'', os.path.commonprefix(names))
+
+    return prefix if prefix != u'' else names[0]
+
+
+def groupExtent(group):
+    extent = QgsRectangle(group[0].extent())
+    for layer in group[1:]:
+        extent.combineExtentWith(layer.extent())
+
+    return extent
+
+
+def writeTileIndex(group, tileIndexPath):
+    """Write a tile index shapefile listing the data files of a group of layers"""
+
+    fields = QgsFields()
+    fields.append(QgsField(TILE_ITEM, QVariant.String, 'String', 254))
+
+    writer = QgsVectorFileWriter(
+        tileIndexPath, 'UTF-8', fields, QGis.WKBPolygon, group[0].crs(), 'ESRI Shapefile'
+    )
+    if writer.hasError() != QgsVectorFileWriter.NoError:
+        raise IOError(unicode(writer.errorMessage()))
+
+    for layer in group:
+        feature = QgsFeature(fields)
+        feature.setGeometry(QgsGeometry.fromRect(layer.extent()))
+        feature.setAttribute(TILE_ITEM, layerFile(layer))
+        writer.addFeature(feature)
+
+    # The file is only complete once the writer is gone
+    del writer
+
+    return tileIndexPath
+
+
+def writeVrt(group, vrtPath):
+    """Mosaic the rasters of a group of layers into a VRT, returns None if this is not possible"""
+
+    try:
+        from osgeo import gdal
+    except ImportError:
+        return None
+
+    if not hasattr(gdal, 'BuildVRT'):
+        return None
+
+    vrt = gdal.BuildVRT(toUTF8(vrtPath), [toUTF8(layerFile(l)) for l in group])
+    if vrt is None:
+        raise IOError(u'Unable to build %s' % vrtPath)
+
+    # The file is only complete once the dataset is closed
+    vrt = None
+
+    return vrtPath
+
+
+def consolidate(layers, legend, minSize, tileIndexDir):
+    """Group layers and write the datasets their tiled layers refer to
+
+        Returns a list of `(group, tileIndexPath)` pairs, where `tileIndexPath` is None for
+        single layers. Groups whose dataset cannot be written are split into single layers.
+    """
+
+    units = []
+    names = set()
+
+    for group in findGroups(layers, legend, minSize):
+        if len(group) == 1:
+            units.append((group, None))
+            continue
+
+        if not os.path.isdir(tileIndexDir):
+            os.makedirs(tileIndexDir)
+
+        # Dataset names must be unique, even if group names are not
+        baseName = re.sub(u'[^\\w\\-]+', u'_', groupName(group), flags=re.UNICODE)
+        name, i = baseName, 1
+        while name in names:
+            name, i = u'%s_%d' % (baseName, i), i + 1
+        names.add(name)
+
+        try:
+            if group[0].type() == QgsMapLayer.RasterLayer:
+                tileIndexPath = writeVrt(group, os.path.join(tileIndexDir, name + u'.vrt'))
+                if tileIndexPath is None:
+                    tileIndexPath = writeTileIndex(group, os.path.join(tileIndexDir, name + u'.shp'))
+            else:
+                tileIndexPath = writeTileIndex(group, os.path.join(tileIndexDir, name + u'.shp'))
+
+        except (IOError, OSError, RuntimeError) as e:
+            QgsMessageLog.logMessage(
+                u'Unable to consolidate layers %s: %s' % (
+                    u', '.join(l.name() for l in group), e
+                ),
+                u'RT MapServer Exporter'
+            )
+            units.extend(([l], None) for l in group)
+            continue
+
+        QgsMessageLog.logMessage(
+            u'Layers %s consolidated into %s' % (
+                u', '.join(l.name() for l in group), tileIndexPath
+            ),
+            u'RT MapServer Exporter'
+        )
+        units.append((group, tileIndexPath))
+
+    return units
+
+
+def useTileIndex(msLayer, group, tileIndexPath):
+    """Turn the layer serialized from the first layer of a group into the group's tiled layer"""
+
+    msLayer.name = toUTF8(groupName(group))
+    msLayer.setMetaData('ows_title', msLayer.name)
+
+    extent = groupExtent(group)
+    msLayer.extent.minx = extent.xMinimum()
+    msLayer.extent.miny = extent.yMinimum()
+    msLayer.extent.maxx = extent.xMaximum()
+    msLayer.extent.maxy = extent.yMaximum()
+    msLayer.setMetaData('ows_extent',
+            '%s %s %s %s' % (extent.xMinimum(),extent.yMinimum(),extent.xMaximum(),extent.yMaximum())
+    )
+
+    if tileIndexPath.lower().endswith(u'.vrt'):
+        msLayer.data = toUTF8(tileIndexPath)
+    else:
+        msLayer.data = None
+        msLayer.tileindex = toUTF8(tileIndexPath)
+        msLayer.tileitem = TILE_ITEM
@@ -0,0 +1,231 @@
+"""Metadata of layers gathered ahead of their serialization
+
+    Reading the extent, sub-layers or fields of a layer may take a round-trip to its data source:
+    the PostGIS provider may scan a whole table to compute its extent, the WMS and WFS providers
+    query their server. `prefetch()` gathers the metadata of all the layers of an export on a pool
+    of threads before serialization starts, so that these round-trips overlap instead of adding
+    up. Data providers are not thread-safe, and database connections may only be used from the
+    thread that opened them: each thread builds a layer of its own from the data source of the
+    layer it reads, and only plain values leave it.
+
+    The metadata read from data providers can also be kept in a cache directory (see:
+    `LayerCache.LayerCache`), keyed by the data source of each layer and the version of its data:
+    the modification time and size of its data files. Remote data sources have no such version,
+    their entries expire after `MAX_AGE` seconds instead. Unlike the layer cache, the directory
+    may be shared by the exports of several mapfiles.
+"""
+
+import os
+import time
+import hashlib
+from multiprocessing.pool import ThreadPool
+
+from PyQt4.QtCore import *
+from qgis.core import *
+
+from utils import toUTF8
+
+import LayerCache
+
+
+"""Bump this whenever the cached metadata changes, to invalidate existing caches"""
+METADATA_VERSION = 1
+
+"""Seconds after which the cached metadata of remote data sources is read again"""
+MAX_AGE = 24 * 60 * 60
+
+
+class LayerMetadata(object):
+    """The metadata of a layer the export depends on
+
+        Only plain values are held, so that metadata can be cached and handed to worker
+        processes (see: ParallelExport.py).
+    """
+
+    def __init__(self, extent, proj4, authid, postgisSrid, subLayers=(), subLayerStyles=(),
+            fields=()):
+        # `(xmin, ymin, xmax, ymax)`
+        self.extent = tuple(extent)
+        self.proj4 = proj4
+        self.authid = authid
+        self.postgisSrid = postgisSrid
+        self.subLayers = list(subLayers)
+        self.subLayerStyles = list(subLayerStyles)
+        # `(name, comment)` pairs
+        self.fields = [tuple(f) for f in fields]
+
+
+def readProviderMetadata(layer):
+    """Read the metadata of a layer that comes from its data provider, as a JSON-able dict"""
+
+    extent = layer.extent()
+    metadata = {
+        'extent': [extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum()],
+        'subLayers': [],
+        'subLayerStyles': [],
+        'fields': []
+    }
+
+    provider = layer.dataProvider()
+
+    if layer.providerType() == 'wms':
+        metadata['subLayers'] = [unicode(s) for s in provider.subLayers()]
+        metadata['subLayerStyles'] = [unicode(s) for s in provider.subLayerStyles()]
+
+    if layer.type() == QgsMapLayer.VectorLayer:
+        metadata['fields'] = [
+            [unicode(f.name()), unicode(f.comment())] for f in provider.fields()
+        ]
+
+    return metadata
+
+
+def fromProviderMetadata(layer, metadata, context=None):
+    """Complete the metadata read from the provider of a layer with its CRS
+
+        CRS definitions are looked up in `context` if given (see: ExportContext.py).
+    """
+
+    crs = layer.crs()
+    if context is not None:
+        proj4, authid = context.crsStrings(crs)
+    else:
+        proj4, authid = unicode(crs.toProj4()), unicode(crs.authid())
+
+    return LayerMetadata(
+        metadata['extent'], proj4, authid, crs.postgisSrid(),
+        metadata['subLayers'], metadata['subLayerStyles'], metadata['fields']
+    )
+
+
+def readMetadata(layer, context=None):
+    """Read the metadata of a layer right away"""
+
+    return fromProviderMetadata(layer, readProviderMetadata(layer), context)
+
+
+def sourceKey(layer):
+    """Return the cache key of the metadata of a layer, and whether its data source is remote
+
+        The key covers the data source of the layer and, for local data, the modification time
+        and size of its data files.
+    """
+
+    h = hashlib.sha1()
+
+    def update(value):
+        h.update(toUTF8(u'%s' % value))
+        h.update(b'\0')
+
+    update(METADATA_VERSION)
+    update(layer.providerType())
+    update(layer.source())
+
+    dataFiles = LayerCache.dataFiles(layer)
+    for filePath in dataFiles:
+        try:
+            st = os.stat(filePath)
+        except OSError:
+            continue
+
+        update(filePath)
+        update(st.st_mtime)
+        update(st.st_size)
+
+    return h.hexdigest(), len(dataFiles) == 0
+
+
+def sourceOf(layer):
+    """Return what a layer of the same data can be built from in another thread"""
+
+    subset = layer.subsetString() if layer.type() == QgsMapLayer.VectorLayer else u''
+    return (layer.type(), unicode(layer.source()), unicode(layer.providerType()), unicode(subset))
+
+
+def readSourceMetadataJob(source):
+    """Read the provider metadata of a data source (see: `sourceOf()`) in a worker thread
+
+        The layer, and so the data provider, is built by the thread and never shared. Returns
+        `(metadata, error)`.
+    """
+
+    layerType, uri, providerType, subset = source
+
+    try:
+        if layerType == QgsMapLayer.VectorLayer:
+            layer = QgsVectorLayer(uri, u'metadata', providerType)
+            if subset != u'':
+                layer.setSubsetString(subset)
+        else:
+            layer = QgsRasterLayer(uri, u'metadata', providerType)
+
+        if not layer.isValid():
+            return None, ValueError('invalid data source')
+
+        return readProviderMetadata(layer), None
+    except Exception as e:
+        return None, e
+
+
+def prefetch(layers, threads=4, cachePath=u'', maxAge=MAX_AGE, context=None):
+    """Gather the metadata of layers on a pool of `threads` threads
+
+        `layers` are only used by the calling thread, which must own them: the threads read from
+        layers they build from the same data sources (see: `readSourceMetadataJob()`).
+
+        If `cachePath` is set, metadata is looked up in and added to the cache in that directory.
+        CRS definitions are looked up in `context` if given (see: ExportContext.py).
+
+        Returns a dict of `LayerMetadata` by layer id. Layers whose metadata cannot be read are
+        left out, and read again when they are serialized.
+    """
+
+    cache = LayerCache.LayerCache(cachePath) if cachePath else None
+
+    found = {}
+    missing = []
+    seen = set()
+    for layer in layers:
+        if layer.id() in seen:
+            continue
+        seen.add(layer.id())
+
+        if cache is not None:
+            key, remote = sourceKey(layer)
+            entry = cache.get(key)
+
+            if entry is not None and (not remote or time.time() - entry['time'] <= maxAge):
+                found[layer.id()] = entry['metadata']
+                continue
+
+        missing.append(layer)
+
+    if len(missing) > 0:
+        # Layers are read from the calling thread only, the workers get their data sources
+        sources = [sourceOf(layer) for layer in missing]
+
+        pool = ThreadPool(max(1, min(threads, len(missing))))
+        try:
+            results = pool.map(readSourceMetadataJob, sources, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+        for layer, (metadata, error) in zip(missing, results):
+            if error is not None:
+                QgsMessageLog.logMessage(
+                    u'Unable to read the metadata of layer %s: %s' % (layer.name(), error),
+                    u'RT MapServer Exporter'
+                )
+                continue
+
+            found[layer.id()] = metadata
+
+            if cache is not None:
+                cache.put(sourceKey(layer)[0], {'time': time.time(), 'metadata': metadata})
+
+    # The CRS of a layer is part of the project rather than of the data, so it is never cached
+    return dict(
+        (layer.id(), fromProviderMetadata(layer, found[layer.id()], context))
+        for layer in layers if layer.id() in found
+    )
@@ -1,5 +1,4 @@
-import re
-import codecs
+import os
 
 from PyQt4.QtCore import *
 from PyQt4.QtGui import *
@@ -10,10 +9,29 @@ from utils import *
 from utils import toUTF8
 
 import Serialization
+import SerializationUtils
+import ExpressionCompiler
+import MapfileUtils
+import MapfileMinifier
+import MapfileWriter
+import LayerCache
+import ParallelExport
+import Profiler
+import PgConnections
+import SpatialIndex
+import LayerGroups
+import RasterOverviews
+import LayerMetadata
+import Generalization
+import ExportContext
 
 DEFAULT_WIDTH = 600
 DEFAULT_HEIGHT= 600
 
+"""Available backends: mapscript itself and the streaming pure Python writer"""
+BACKEND_MAPSCRIPT = 'mapscript'
+BACKEND_PYTHON = 'python'
+
 def export(
     name = u'',
     width = DEFAULT_WIDTH,
@@ -38,10 +56,122 @@ def export(
     useSLD = True,
     layers = [],
     legend = None,
-    canvas = None
+    canvas = None,
+    backend = BACKEND_MAPSCRIPT,
+    cachePath = u'',
+    jobs = 1,
+    profiler = None,
+    pgServiceFile = u'',
+    buildSpatialIndexes = False,
+    consolidateLayers = 0,
+    buildOverviews = False,
+    overviewResampling = RasterOverviews.DEFAULT_RESAMPLING,
+    prefetchThreads = 0,
+    metadataCachePath = u'',
+    generalizeLayers = {},
+    sharedSymbolset = False,
+    minify = False,
+    narrowPostgisColumns = False
 ):
+    """Export a set of QGis layers into a MapServer mapfile
+
+        With the `BACKEND_PYTHON` backend the map is built from lightweight Python objects (see:
+        MapfileWriter.py) and every layer is written to the mapfile as soon as it is serialized,
+        so memory use does not grow with the size of the project. This backend does not need
+        mapscript, but it cannot apply SLD styles either.
+
+        If `cachePath` is set, the serialized layers are cached in that directory (see:
+        LayerCache.py) and layers which did not change since the previous export are copied from
+        the cache rather than serialized again. The cache needs the `BACKEND_PYTHON` backend, and
+        the directory should not be shared with the exports of other mapfiles.
+
+        If `jobs` is greater than 1, layers are serialized in that many worker processes (see:
+        ParallelExport.py). This needs the `BACKEND_PYTHON` backend too, and should only be used
+        by headless exports.
+
+        If `profiler` is set (see: Profiler.py), the time spent in each phase of the export is
+        recorded into it, in total and per layer.
+
+        PostGIS layers get normalized connection strings and CLOSE_CONNECTION=DEFER, so that
+        MapServer can reuse connections across layers (see: PgConnections.py). If `pgServiceFile`
+        is set, connections matching one of its entries refer to the entry by name instead.
+
+        If `buildSpatialIndexes` is set, a quadtree index (.qix) is written next to every
+        shapefile that has none or an outdated one (see: SpatialIndex.py).
+
+        If `consolidateLayers` is set, runs of at least that many adjacent shapefile or raster
+        layers with the same schema and style are exported as a single layer, backed by a tile
+        index or a VRT written to a directory next to the mapfile (see: LayerGroups.py).
+
+        If `buildOverviews` is set, overviews are built with `overviewResampling` for every
+        raster that has none or outdated ones, in `jobs` worker processes (see:
+        RasterOverviews.py).
+
+        If `prefetchThreads` is set, the metadata of all layers (extent, CRS, WMS sub-layers,
+        fields) is gathered on that many threads before serialization starts, so that slow data
+        sources are queried concurrently (see: LayerMetadata.py). If `metadataCachePath` is set as
+        well, the metadata read from data providers is cached in that directory, which may be
+        shared with the exports of other mapfiles.
+
+        `generalizeLayers` maps the names (or ids) of line and polygon layers to lists of
+        tolerances, in the units of their CRS. Each of these layers is exported as a GROUP of
+        scale-banded layers: its full resolution data at large scales, then copies simplified with
+        each tolerance at smaller scales, written to a directory next to the mapfile (see:
+        Generalization.py).
+
+        If `sharedSymbolset` is set, symbols are not written to the mapfile but merged into
+        a symbol set file shared by all the mapfiles exported to the same directory, and the
+        list of fonts in use (fonts.txt) is merged with theirs rather than replaced (see:
+        `MapfileUtils.mergeSymbolset()`). This needs the `BACKEND_PYTHON` backend.
+
+        If `minify` is set, keywords and blocks restating MapServer defaults are dropped from the
+        mapfile, along with indentation and comments (see: MapfileMinifier.py). The time MapServer
+        takes to parse the mapfile before and after is logged, if mapscript is available.
+
+        If `narrowPostgisColumns` is set, PostGIS layers with a key column fetch only the columns
+        the map uses (classes, data-defined symbology, labels, filters) through a subquery, and
+        queries (GetFeatureInfo, WFS) return only those attributes. It has no effect on maps with
+        a template, as templates may show any attribute.
+
+        Returns True if the mapfile was written successfully, False otherwise.
+    """
+
+    if profiler is None:
+        profiler = Profiler.NULL_PROFILER
+
+    streaming = (backend == BACKEND_PYTHON)
+    ms = MapfileWriter if streaming else mapscript
+
+    if streaming and useSLD:
+        QgsMessageLog.logMessage(
+            u'SLD styles need mapscript, using the Python-based style exporter instead.',
+            u'RT MapServer Exporter'
+        )
+        useSLD = False
+
+    if cachePath and not streaming:
+        QgsMessageLog.logMessage(
+            u'The layer cache needs the Python backend, exporting all layers.',
+            u'RT MapServer Exporter'
+        )
+        cachePath = u''
+
+    if jobs > 1 and not streaming:
+        QgsMessageLog.logMessage(
+            u'Parallel export needs the Python backend, exporting layers one by one.',
+            u'RT MapServer Exporter'
+        )
+        jobs = 1
+
+    if sharedSymbolset and not streaming:
+        QgsMessageLog.logMessage(
+            u'The shared symbol set needs the Python backend, writing symbols to the mapfile.',
+            u'RT MapServer Exporter'
+        )
+        sharedSymbolset = False
+
     # Create a new msMap
-    msMap = mapscript.mapObj()
+    msMap = ms.mapObj()
     msMap.name = name
 
     # map size
@@ -99,238 +229,619 @@ def export(
     msMap.legend.keysizex=20
     msMap.legend.keysizey=20
     
+    # Write the map header right away when streaming
+    if streaming:
+        symbolsetPath = None
+        if sharedSymbolset:
+            symbolsetPath = unicode(
+                QFileInfo(mapfilePath).dir().filePath(MapfileUtils.SHARED_SYMBOLSET_NAME)
+            )
+
+        stream = MapfileWriter.MapfileStream(
+            unicode(mapfilePath), msMap, fontsetPath, symbolsetPath
+        )
+        try:
+            with profiler.phase('header'):
+                stream.begin()
+        except IOError as e:
+            utils.warn(u'Unable to write mapfile %s: %s' % (mapfilePath, e))
+            return False
+
+    if cachePath:
+        cache = LayerCache.LayerCache(unicode(cachePath))
+
+    pgServices = {}
+    if pgServiceFile:
+        try:
+            pgServices = PgConnections.readServiceFile(unicode(pgServiceFile))
+        except IOError as e:
+            utils.warn(u'Unable to read PostgreSQL service file %s: %s' % (pgServiceFile, e))
+
+    connections = PgConnections.PgConnections(pgServices)
+
+    # Layers left to the worker processes, along with their fingerprints and cached fragments
+    parallel = (jobs > 1)
+    pending = []
+
+    # Shapefiles whose index is known to be current
+    indexedShapefiles = set()
+
+    if buildOverviews:
+        with profiler.phase('overviews'):
+            buildRasterOverviews(layers, overviewResampling, jobs)
+
+    if generalizeLayers:
+        fileInfo = QFileInfo(mapfilePath)
+        copyDir = unicode(fileInfo.dir().filePath(fileInfo.completeBaseName() + u'_generalized'))
+
+        with profiler.phase('generalize'):
+            layers, legend = Generalization.generalize(layers, legend, generalizeLayers, copyDir)
+
+    # Labeling engine, font metrics, CRS definitions, ... shared by all layers
+    context = ExportContext.ExportContext(canvas, profiler)
+
+    # Metadata of the layers, by layer id
+    metadata = {}
+    if prefetchThreads > 0:
+        with profiler.phase('prefetch'):
+            metadata = LayerMetadata.prefetch(
+                layers, prefetchThreads, unicode(metadataCachePath) if metadataCachePath else u'',
+                context=context
+            )
+
+    # Layers to export, along with the tile index of the groups of layers exported as one
+    units = [([layer], None) for layer in layers]
+    if consolidateLayers > 1:
+        fileInfo = QFileInfo(mapfilePath)
+        tileIndexDir = unicode(fileInfo.dir().filePath(fileInfo.completeBaseName() + u'_tiles'))
+
+        with profiler.phase('tileindex'):
+            units = LayerGroups.consolidate(layers, legend, consolidateLayers, tileIndexDir)
+
+            if buildSpatialIndexes:
+                for group, tileIndexPath in units:
+                    if tileIndexPath is not None and tileIndexPath.lower().endswith(u'.shp'):
+                        indexShapefile(tileIndexPath, u'tile index %s' % tileIndexPath)
 
     # Iterate through layers
-    for layer in layers:
+    for group, tileIndexPath in units:
+        layer = group[0]
 
         # Check if layer is a supported type... seems return None if type is not supported (e.g. csv)
         if (utils.getLayerType(layer) == None):
-            QMessageBox.warning(
-                None, 
-                'RT MapServer Exporter',
-                'Skipped not supported layer: %s' % layer.name()
-            )
+            utils.warn('Skipped not supported layer: %s' % layer.name())
             continue
         
         # Bail out if the layer is accessed through OGR virtual file system drivers
         if unicode(layer.source()).startswith('/vsi'):
-            QMessageBox.warning(
-                None,
-                'RT MapServer Exporter',
-                'Layers inside compressed archives are not supported.'
-            )
+            utils.warn('Layers inside compressed archives are not supported.')
             continue
 
-        # Create a layer object
-        msLayer = mapscript.layerObj(msMap)
-        msLayer.name = toUTF8(layer.name())
-        msLayer.type = utils.getLayerType(layer)
-        msLayer.status =  utils.onOffMap[legend.isLayerVisible(layer)]
-
-        # Layer extent and scale-based visibility
-        extent = layer.extent()
-        msLayer.extent.minx = extent.xMinimum()
-        msLayer.extent.miny = extent.yMinimum()
-        msLayer.extent.maxx = extent.xMaximum()
-        msLayer.extent.maxy = extent.yMaximum()
-
-        if layer.hasScaleBasedVisibility():
-            msLayer.minscaledenom = layer.minimumScale()
-            msLayer.maxscaledenom = layer.maximumScale()
-
-        # Layer projection
-        msLayer.setProjection(toUTF8(layer.crs().toProj4()))
-
-
-        msLayer.setMetaData('ows_title', msLayer.name)
-        msLayer.setMetaData('ows_srs', toUTF8(layer.crs().authid()))
-        msLayer.setMetaData('gml_include_items', 'all')
-        msLayer.setMetaData('ows_include_items', 'all')
-        msLayer.setMetaData('wms_bbox_extended', 'true')
-        msLayer.setMetaData('wms_getfeatureinfo_formatlist', 'OGRGML')
-        msLayer.setMetaData('ows_extent',
-                '%s %s %s %s' % (extent.xMinimum(),extent.yMinimum(),extent.xMaximum(),extent.yMaximum())
+        with profiler.layer(layer.name()):
+
+            if buildSpatialIndexes:
+                with profiler.phase('qix'):
+                    for l in group:
+                        buildSpatialIndex(l, indexedShapefiles)
+
+            # Reuse the layer as written by the previous export if it did not change since.
+            # Groups of layers are always exported again, along with their tile index.
+            fingerprint = fragment = None
+            if cachePath and tileIndexPath is None:
+                with profiler.phase('cache'):
+                    # Remote data has no files whose modification time tells its version: the
+                    # metadata the layer is serialized from stands for it
+                    version = None
+                    if len(LayerCache.dataFiles(layer)) == 0:
+                        if layer.id() not in metadata:
+                            metadata[layer.id()] = LayerMetadata.readMetadata(layer, context)
+                        version = LayerCache.metadataVersion(metadata[layer.id()])
+
+                    fingerprint = LayerCache.layerFingerprint(layer, (
+                        legend.isLayerVisible(layer), useSLD, fontsetPath != '',
+                        canvas.mapSettings().mapUnits() if canvas is not None else None,
+                        sorted((k, sorted(v.items())) for k, v in pgServices.items()),
+                        narrowPostgisColumns and not templatePath, version
+                    ))
+                    fragment = cache.get(fingerprint)
+
+            if parallel and tileIndexPath is None:
+                pending.append((layer, fingerprint, fragment))
+                continue
+
+            if fragment is None:
+                msLayer = serializeLayer(
+                    msMap, layer, legend, useSLD, fontsetPath != '', canvas, profiler,
+                    connections, metadata.get(layer.id()), context,
+                    narrowPostgisColumns and not templatePath
+                )
+                if tileIndexPath is not None:
+                    LayerGroups.useTileIndex(msLayer, group, tileIndexPath)
+
+                if not streaming:
+                    continue
+
+                # The layer is complete, write it out and forget about it
+                with profiler.phase('write'):
+                    fragment = stream.layerFragment(msLayer)
+                    msMap.removeLayer(msLayer.index)
+
+                if fingerprint is not None:
+                    with profiler.phase('cache'):
+                        cache.put(fingerprint, fragment)
+
+            # Keep the place of the group among the layers left to the workers
+            if parallel:
+                pending.append((layer, None, fragment))
+                continue
+
+            with profiler.phase('write'):
+                stream.writeFragment(fragment)
+
+    # Fragments come back from the workers in the order of the layers
+    if parallel:
+        fragments = ParallelExport.serializeLayers(
+            [l for l, fingerprint, fragment in pending if fragment is None],
+            legend, useSLD, fontsetPath != '', jobs, pgServices, metadata,
+            narrowPostgisColumns and not templatePath
         )
 
-        # Layer connection
-        if layer.providerType() == 'postgres':
-            msLayer.setConnectionType(mapscript.MS_POSTGIS, '')
+        for layer, fingerprint, fragment in pending:
+            with profiler.layer(layer.name()):
+                if fragment is None:
+                    with profiler.phase('workers'):
+                        fragment = next(fragments)
 
-            uri = QgsDataSourceURI(layer.source())
-            msLayer.connection = toUTF8(uri.connectionInfo())
+                    if fingerprint is not None:
+                        with profiler.phase('cache'):
+                            cache.put(fingerprint, fragment)
 
-            data = u'%s FROM %s' % (uri.geometryColumn(), uri.quotedTablename())
+                with profiler.phase('write'):
+                    stream.writeFragment(fragment)
 
-            if uri.keyColumn() != '':
-                data += u' USING UNIQUE %s' % uri.keyColumn()
-                # ++
-                msLayer.setMetaData('gml_featureid', toUTF8(uri.keyColumn()))
+    if len(connections.layers) > 0:
+        QgsMessageLog.logMessage(connections.summary(), u'RT MapServer Exporter')
 
-            data += u' USING srid=%s' % layer.crs().postgisSrid()
+    # When streaming, fonts have already been taken care of while writing
+    if streaming:
+        with profiler.phase('end'):
+            stream.end()
 
-            if uri.sql() != '':
-                data += u' FILTER (%s)' % uri.sql()
+        if cachePath:
+            cache.prune()
+            QgsMessageLog.logMessage(
+                u'Layer cache: %d layers reused, %d layers exported' % (cache.hits, cache.misses),
+                u'RT MapServer Exporter'
+            )
 
-            msLayer.data = toUTF8(data)
+        if createFontFile:
+            fontListPath = unicode(QFileInfo(mapfilePath).dir().filePath(u'fonts.txt'))
+            if sharedSymbolset:
+                MapfileUtils.mergeFontList(fontListPath, stream.fonts)
+            else:
+                MapfileUtils.writeFontList(fontListPath, stream.fonts)
 
-        elif layer.providerType() == 'wms':
-            msLayer.setConnectionType(mapscript.MS_WMS, '')
-            uri = QUrl('http://www.fake.eu/?' + layer.source())
-            msLayer.connection = toUTF8(uri.queryItemValue('url'))
+        if minify:
+            minifyMapfile(mapfilePath, profiler)
 
-            # loop thru wms sub layers
-            wmsNames = []
-            wmsStyles = []
-            wmsLayerNames = layer.dataProvider().subLayers()
-            wmsLayerStyles = layer.dataProvider().subLayerStyles()
-            
-            for index in range(len(wmsLayerNames)):
-                wmsNames.append(toUTF8(wmsLayerNames[index]))
-                wmsStyles.append(toUTF8(wmsLayerStyles[index]))
+        return True
 
-            # output SRSs
-            srsList = []
-            srsList.append(toUTF8(layer.crs().authid()))
+    # Save the map file
+    try:
+        with profiler.phase('save'):
+            saved = msMap.save(mapfilePath.encode('utf8'))
 
-            # Create necessary wms metadata
-            msLayer.setMetaData('ows_name', ','.join(wmsNames))
-            msLayer.setMetaData('wmsServer_version', '1.1.1')
-            msLayer.setMetaData('ows_srs', ' '.join(srsList))
-            msLayer.setMetaData('wmsFormat', ','.join(wmsStyles))
+        if mapscript.MS_SUCCESS != saved:
+            return False
+    except:
+        utils.warn(u'Unsupported unicode filename: %s' % mapfilePath)
+        return False
 
-        elif layer.providerType() == 'wfs':
-            msLayer.setConnectionType(mapscript.MS_WMS, '')
-            uri = QgsDataSourceURI(layer.source())
-            msLayer.connection = toUTF8(uri.uri())
+    # Most of the following code does not use mapscript because it asserts
+    # paths you supply exists, but this requirement is usually not met on
+    # the QGIS client used to generate the mapfile.
+    #
+    # The font alias rewrite, the collection of used fonts and the FONTSET
+    # insertion are all done in a single streaming pass over the saved file.
+    mesg = 'Reload Map file %s to manipulate it' % mapfilePath
+    QgsMessageLog.logMessage(mesg, 'RT MapServer Exporter')
 
-            # Output SRSs
-            srsList = []
-            srsList.append(toUTF8(layer.crs().authid()))
+    # create the file containing the list of font aliases used in the
+    # mapfile
+    fontListPath = unicode(QFileInfo(mapfilePath).dir().filePath(u'fonts.txt')) \
+            if createFontFile else None
+
+    with profiler.phase('postprocess'):
+        fonts, fontsetAdded = MapfileUtils.postProcessMapfile(
+            unicode(mapfilePath),
+            fontsetPath,
+            fontListPath
+        )
 
-            # Create necessary WMS metadata
-            msLayer.setMetaData('ows_name', msLayer.name)
-            msLayer.setMetaData('ows_srs', ' '.join(srsList))
+    if (fontsetPath != '') and not fontsetAdded:
+        QgsMessageLog.logMessage(
+            u'"FONTSET" keyword not added to the mapfile: unable to locate the "MAP" keyword...',
+            u'RT MapServer Exporter'
+        )
 
-        elif layer.providerType() == 'spatialite':
-            msLayer.setConnectionType(mapscript.MS_OGR, '')
-            uri = QgsDataSourceURI(layer.source())
-            msLayer.connection = toUTF8(uri.database())
-            msLayer.data = toUTF8(uri.table())
+    if minify:
+        minifyMapfile(mapfilePath, profiler)
 
-        elif layer.providerType() == 'ogr':
-            msLayer.data = toUTF8(layer.source().split('|')[0])
+    return True
 
-        else:
-            msLayer.data = toUTF8(layer.source())
 
+def minifyMapfile(mapfilePath, profiler=Profiler.NULL_PROFILER):
+    """Minify a saved mapfile (see: MapfileMinifier.py), logging its parse time before and after
 
-        # Set layer style
-        if layer.type() == QgsMapLayer.RasterLayer:
-            if hasattr(layer, 'renderer'):    # QGis >= 1.9
-                opacity = int(round(100 * layer.renderer().opacity()))
-            else:
-                opacity = int(100 * layer.getTransparency() / 255.0)
-            msLayer.opacity = opacity
+        Parse times are measured by loading the mapfile with mapscript, so they are only logged
+        when mapscript is available and the files the mapfile refers to can be found.
+    """
 
-        else:
-            # This is a supported vector layer.
-            #
-            # In this case we use our custom style serializers (see: Serialization.py) here as the
-            # differences between the SLD implementation in MapServer and QGis makes it impossible
-            # to transfer complex styles using SLD.
-            #
-            # Please note that we only emit font definitions in the label style serializer
-            # if a fontset path is supplied. Otherwise we fall back to the default font.
-            # (Font size is set under all circumstances, though.) 
-
-            if useSLD:
-                Serialization.SLDSerializer(layer, msLayer, msMap)
-            else:
-                if canvas is not None:
-                    rctx = QgsRenderContext.fromMapSettings(canvas.mapSettings())
-                else:
-                    rctx = None
+    def parseTime():
+        if mapscript is MapfileWriter:
+            return None
 
-                Serialization.VectorLayerStyleSerializer(rctx, layer, msLayer, msMap)
+        try:
+            return MapfileMinifier.parseTime(toUTF8(mapfilePath), mapscript.mapObj)
+        except Exception as e:
+            QgsMessageLog.logMessage(
+                u'Unable to measure the parse time of %s: %s' % (mapfilePath, e),
+                u'RT MapServer Exporter'
+            )
+            return None
 
-            Serialization.LabelStyleSerializer(layer, msLayer, msMap, fontsetPath != '')
+    before = parseTime()
 
-    # Save the map file
     try:
-        if mapscript.MS_SUCCESS != msMap.save(mapfilePath.encode('utf8')):
-            return
-    except:
-        QMessageBox.warning(
-            None,
-            'RT MapServer Exporter',
-            'Unsupported unicode filename: %s' % mapfilePath
+        with profiler.phase('minify'):
+            sizeBefore, sizeAfter = MapfileMinifier.minifyMapfile(unicode(mapfilePath))
+    except (IOError, OSError, ValueError) as e:
+        QgsMessageLog.logMessage(
+            u'Unable to minify %s: %s' % (mapfilePath, e), u'RT MapServer Exporter'
         )
         return
 
-    # Most of the following code does not use mapscript because it asserts
-    # paths you supply exists, but this requirement is usually not met on
-    # the QGIS client used to generate the mapfile.
+    QgsMessageLog.logMessage(
+        u'Mapfile minified from %d to %d bytes' % (sizeBefore, sizeAfter),
+        u'RT MapServer Exporter'
+    )
+
+    after = parseTime() if before is not None else None
+    if after is not None:
+        QgsMessageLog.logMessage(
+            u'Mapfile parse time: %.2f ms before minification, %.2f ms after' % (
+                before * 1000, after * 1000
+            ),
+            u'RT MapServer Exporter'
+        )
 
-    # Get the mapfile content as string so we can manipulate on it
-    mesg = 'Reload Map file %s to manipulate it' % mapfilePath
-    QgsMessageLog.logMessage(mesg, 'RT MapServer Exporter')
-    fin = codecs.open(mapfilePath, 'r', 'utf-8')
-    parts = []
-    line = fin.readline()
-    while line != "":
-        line = line.rstrip('\n')
-        parts.append(line)
-        line = fin.readline()
-    fin.close()
-    
-    partsContentChanged = False
-
-    # retrieve the list of used font aliases searching for FONT keywords
-    fonts = []
-    searchFontRx = re.compile(u'^\\s*FONT\\s+')
-
-    for line in filter(searchFontRx.search, parts):
-        # get the font alias, remove quotes around it
-        fontName = re.sub(searchFontRx, '', line)[1:-1]
-        # remove spaces within the font name
-        fontAlias = fontName.replace(' ', '')
-
-        # append the font alias to the font list
-        if fontAlias not in fonts:
-            fonts.append(fontAlias)
-
-            # update the font alias in the mapfile
-            # XXX: the following lines cannot be removed since the SLD file
-            # could refer a font whose name contains spaces. When SLD specs
-            # are clear on how to handle fonts than we'll think whether
-            # remove it or not.
-            replaceFontRx = re.compile(u"^(\\s*FONT\\s+\")%s(\".*)$" % QRegExp.escape(fontName))
-            parts = [ replaceFontRx.sub(u"\g<1>%s\g<2>" % fontAlias, part) for part in parts ]
-            partsContentChanged = True
 
-    # create the file containing the list of font aliases used in the
-    # mapfile
-    if createFontFile: 
-        fontPath = QFileInfo(mapfilePath).dir().filePath(u'fonts.txt')
-        with open(unicode(fontPath), 'w') as fout:
-            for fontAlias in fonts:
-                fout.write(fontAlias + '\n')
-
-    # add the FONTSET keyword with the associated path
-    if fontsetPath != '':
-        # get the index of the first instance of MAP string in the list
-        pos = parts.index(filter(lambda x: re.compile("^MAP(\r\n|\r|\n)*$").match(x), parts)[0])
-        if pos >= 0:
-            parts.insert(pos + 1, u'  FONTSET "%s"' % fontsetPath)
-            partsContentChanged = True
+def serializeLayer(msMap, layer, legend, useSLD, emitFontDefinitions, canvas=None,
+        profiler=Profiler.NULL_PROFILER, connections=None, metadata=None, context=None,
+        narrowColumns=False):
+    """Serialize a supported QGis layer into a new layer of `msMap`
+
+        `metadata` is the prefetched metadata of the layer (see: LayerMetadata.py), it is read
+        from the layer if not given.
+
+        `context` holds what the layers of an export share (see: ExportContext.py), layers
+        serialized on their own get a context of their own.
+
+        If `narrowColumns` is set, PostGIS layers only fetch and publish the attributes the map
+        uses (see: `serializePostgisData()`).
+    """
+
+    if context is None:
+        context = ExportContext.ExportContext(canvas, profiler)
+
+    # Create a layer object
+    msLayer = SerializationUtils.backendFor(msMap).layerObj(msMap)
+    msLayer.name = toUTF8(layer.name())
+    msLayer.type = utils.getLayerType(layer)
+    msLayer.status =  utils.onOffMap[legend.isLayerVisible(layer)]
+
+    # Scale bands of a generalized layer (see: Generalization.py)
+    group = layer.customProperty(Generalization.GROUP_PROPERTY, u'')
+    if group:
+        msLayer.group = toUTF8(group)
+        msLayer.setMetaData('wms_group_title', msLayer.group)
+
+    # Layer extent and scale-based visibility
+    if metadata is None:
+        with profiler.phase('extent'):
+            metadata = LayerMetadata.readMetadata(layer, context)
+
+    extent = metadata.extent
+    msLayer.extent.minx, msLayer.extent.miny, msLayer.extent.maxx, msLayer.extent.maxy = extent
+
+    if layer.hasScaleBasedVisibility():
+        msLayer.minscaledenom = layer.minimumScale()
+        msLayer.maxscaledenom = layer.maximumScale()
+
+    # Layer projection
+    msLayer.setProjection(toUTF8(metadata.proj4))
+
+
+    msLayer.setMetaData('ows_title', msLayer.name)
+    msLayer.setMetaData('ows_srs', toUTF8(metadata.authid))
+    msLayer.setMetaData('gml_include_items', 'all')
+    msLayer.setMetaData('ows_include_items', 'all')
+    msLayer.setMetaData('wms_bbox_extended', 'true')
+    msLayer.setMetaData('wms_getfeatureinfo_formatlist', 'OGRGML')
+    msLayer.setMetaData('ows_extent',
+            '%s %s %s %s' % extent
+    )
+
+    # Layer connection
+    if layer.providerType() == 'postgres':
+        msLayer.setConnectionType(mapscript.MS_POSTGIS, '')
+
+        uri = QgsDataSourceURI(layer.source())
+
+        # Identical connection strings let MapServer reuse connections
+        connection = unicode(uri.connectionInfo())
+        if connections is not None:
+            connection = connections.normalize(connection)
+
+        msLayer.connection = toUTF8(connection)
+        msLayer.addProcessing(PgConnections.CLOSE_CONNECTION_DEFER)
+
+        if uri.keyColumn() != '':
+            msLayer.setMetaData('gml_featureid', toUTF8(uri.keyColumn()))
+
+        # DATA is written once filters are known, which may be pushed down to the database
+
+    elif layer.providerType() == 'wms':
+        msLayer.setConnectionType(mapscript.MS_WMS, '')
+        uri = QUrl('http://www.fake.eu/?' + layer.source())
+        msLayer.connection = toUTF8(uri.queryItemValue('url'))
+
+        # loop thru wms sub layers
+        wmsNames = []
+        wmsStyles = []
+        wmsLayerNames = metadata.subLayers
+        wmsLayerStyles = metadata.subLayerStyles
+        
+        for index in range(len(wmsLayerNames)):
+            wmsNames.append(toUTF8(wmsLayerNames[index]))
+            wmsStyles.append(toUTF8(wmsLayerStyles[index]))
+
+        # output SRSs
+        srsList = []
+        srsList.append(toUTF8(metadata.authid))
+
+        # Create necessary wms metadata
+        msLayer.setMetaData('ows_name', ','.join(wmsNames))
+        msLayer.setMetaData('wmsServer_version', '1.1.1')
+        msLayer.setMetaData('ows_srs', ' '.join(srsList))
+        msLayer.setMetaData('wmsFormat', ','.join(wmsStyles))
+
+    elif layer.providerType() == 'wfs':
+        msLayer.setConnectionType(mapscript.MS_WMS, '')
+        uri = QgsDataSourceURI(layer.source())
+        msLayer.connection = toUTF8(uri.uri())
+
+        # Output SRSs
+        srsList = []
+        srsList.append(toUTF8(metadata.authid))
+
+        # Create necessary WMS metadata
+        msLayer.setMetaData('ows_name', msLayer.name)
+        msLayer.setMetaData('ows_srs', ' '.join(srsList))
+
+    elif layer.providerType() == 'spatialite':
+        msLayer.setConnectionType(mapscript.MS_OGR, '')
+        uri = QgsDataSourceURI(layer.source())
+        msLayer.connection = toUTF8(uri.database())
+        msLayer.data = toUTF8(uri.table())
+
+    elif layer.providerType() == 'ogr':
+        msLayer.data = toUTF8(layer.source().split('|')[0])
+
+    else:
+        msLayer.data = toUTF8(layer.source())
+
+
+    # Set layer style
+    if layer.type() == QgsMapLayer.RasterLayer:
+        if hasattr(layer, 'renderer'):    # QGis >= 1.9
+            opacity = int(round(100 * layer.renderer().opacity()))
         else:
-            QgsMessageLog.logMessage(
-                u'"FONTSET" keyword not added to the mapfile: unable to locate the "MAP" keyword...',
-                u'RT MapServer Exporter'
+            opacity = int(100 * layer.getTransparency() / 255.0)
+        msLayer.opacity = opacity
+
+    else:
+        # This is a supported vector layer.
+        #
+        # In this case we use our custom style serializers (see: Serialization.py) here as the
+        # differences between the SLD implementation in MapServer and QGis makes it impossible
+        # to transfer complex styles using SLD.
+        #
+        # Please note that we only emit font definitions in the label style serializer
+        # if a fontset path is supplied. Otherwise we fall back to the default font.
+        # (Font size is set under all circumstances, though.) 
+
+        with profiler.phase('style'):
+            # Scale bands always get the symbology of the original layer as is
+            conditions = None
+            if useSLD and not group:
+                Serialization.SLDSerializer(layer, msLayer, msMap, context)
+            else:
+                conditions = Serialization.VectorLayerStyleSerializer(
+                    layer, msLayer, msMap, context
+                ).layerFilter
+
+        with profiler.phase('filter'):
+            layerFilter = Serialization.LayerFilterSerializer(
+                layer, msLayer, msMap, conditions, context
+            )
+
+        if layer.providerType() == 'postgres':
+            serializePostgisData(
+                layer, msLayer, metadata.postgisSrid, layerFilter, narrowColumns
             )
 
-    # if mapfile content changed, store the file again at the same path
-    if partsContentChanged:
-        with codecs.open(mapfilePath, 'w', 'utf-8') as fout:
-            for part in parts:
-                fout.write(part + '\n')
+        with profiler.phase('labels'):
+            Serialization.LabelStyleSerializer(
+                layer, msLayer, msMap, emitFontDefinitions, context
+            )
+
+    return msLayer
+
+
+def postgisColumns(layer, layerFilter):
+    """Return the attributes of a PostGIS layer the map refers to, None if it may need them all
+
+        These are the attributes used by the renderer (classes and data-defined symbology), by
+        the labels and by the MapServer FILTER of the layer (see:
+        `Serialization.LayerFilterSerializer`).
+    """
+
+    labels = SerializationUtils.labelAttributes(layer)
+    if labels is None:
+        return None
+
+    names = set(unicode(name) for name in layer.rendererV2().usedAttributes())
+    if QgsFeatureRequest.AllAttributes in names:
+        return None
+
+    # Attributes joined or computed by QGis are not in the table
+    fields = layer.dataProvider().fields()
+    return sorted(
+        name for name in names | labels | layerFilter.columns
+        if fields.indexFromName(name) >= 0
+    )
+
+
+def postgisData(uri, srid, sql=None, columns=None):
+    """Return the DATA of a PostGIS layer, with `sql` as the condition rows must meet
+
+        When the names of the `columns` the map uses are given, and the layer has a key column,
+        only those are fetched, through a subquery.
+    """
+
+    geometry, key = unicode(uri.geometryColumn()), unicode(uri.keyColumn())
+
+    if columns is not None and key != u'':
+        selected = [key, geometry] + [c for c in columns if c not in (key, geometry)]
+        return u'%s FROM (SELECT %s FROM %s%s) AS t USING UNIQUE %s USING srid=%s' % (
+            geometry, u', '.join(ExpressionCompiler.quoteSqlIdentifier(c) for c in selected),
+            uri.quotedTablename(), u' WHERE %s' % sql if sql else u'', key, srid
+        )
+
+    data = u'%s FROM %s' % (geometry, uri.quotedTablename())
+
+    if key != u'':
+        data += u' USING UNIQUE %s' % key
+
+    data += u' USING srid=%s' % srid
+
+    if sql:
+        data += u' FILTER (%s)' % sql
+
+    return data
+
+
+def serializePostgisData(layer, msLayer, srid, layerFilter, narrowColumns=False):
+    """Set the DATA of a PostGIS layer
+
+        If `narrowColumns` is set and the layer has a key column, only the attributes the map
+        uses are fetched, and queries (GetFeatureInfo, WFS) return the same attributes. Otherwise
+        all the columns of the table are fetched and published.
+    """
+
+    uri = QgsDataSourceURI(layer.source())
+    columns = None
+    if narrowColumns and uri.keyColumn() != '':
+        columns = postgisColumns(layer, layerFilter)
+
+    msLayer.data = toUTF8(postgisData(uri, srid, layerFilter.sql, columns))
+
+    if columns is not None:
+        key, geometry = unicode(uri.keyColumn()), unicode(uri.geometryColumn())
+        items = u','.join([key] + [c for c in columns if c not in (key, geometry)])
+        msLayer.setMetaData('gml_include_items', toUTF8(items))
+        msLayer.setMetaData('ows_include_items', toUTF8(items))
+
+
+def buildSpatialIndex(layer, indexedShapefiles):
+    """Write the quadtree index of a shapefile layer, unless it is current already"""
+
+    if layer.providerType() != 'ogr':
+        return
+
+    shapefilePath = unicode(layer.source()).split('|')[0]
+    if not shapefilePath.lower().endswith('.shp') or shapefilePath in indexedShapefiles:
+        return
+
+    indexedShapefiles.add(shapefilePath)
+
+    if SpatialIndex.indexIsCurrent(shapefilePath):
+        return
+
+    indexShapefile(shapefilePath, u'layer %s' % layer.name())
+
+
+def indexShapefile(shapefilePath, name):
+    """Write the quadtree index of a shapefile, logging failures rather than raising them
+
+        `name` is what the shapefile is called in the log, e.g. the layer it is the data of.
+    """
+
+    start = QTime.currentTime()
+
+    try:
+        SpatialIndex.indexShapefile(shapefilePath)
+    except (IOError, OSError, ValueError) as e:
+        QgsMessageLog.logMessage(
+            u'Unable to build the spatial index of %s: %s' % (shapefilePath, e),
+            u'RT MapServer Exporter'
+        )
+        return
+
+    QgsMessageLog.logMessage(
+        u'Spatial index of %s built in %.2fs' % (
+            name, start.msecsTo(QTime.currentTime()) / 1000.0
+        ),
+        u'RT MapServer Exporter'
+    )
+
+
+def buildRasterOverviews(layers, resampling, jobs):
+    """Build the missing overviews of the raster files of a set of layers"""
+
+    if not RasterOverviews.isAvailable():
+        QgsMessageLog.logMessage(
+            u'The GDAL Python bindings are needed to build raster overviews.',
+            u'RT MapServer Exporter'
+        )
+        return
+
+    rasterPaths = []
+    for layer in layers:
+        if layer.type() != QgsMapLayer.RasterLayer or layer.providerType() != 'gdal':
+            continue
+
+        rasterPath = unicode(layer.source())
+        if os.path.isfile(rasterPath) and rasterPath not in rasterPaths:
+            rasterPaths.append(rasterPath)
+
+    try:
+        results = RasterOverviews.buildAllOverviews(
+            [toUTF8(p) for p in rasterPaths], resampling, jobs
+        )
+
+        for rasterPath, built, seconds, error in results:
+            if error is not None:
+                message = u'Unable to build the overviews of %s: %s' % (
+                    rasterPath.decode('utf-8'), error
+                )
+            elif built:
+                message = u'Overviews of %s built in %.2fs' % (rasterPath.decode('utf-8'), seconds)
+            else:
+                continue
+
+            QgsMessageLog.logMessage(message, u'RT MapServer Exporter')
+
+    except ValueError as e:
+        utils.warn(unicode(e))
@@ -0,0 +1,269 @@
+"""Minification of exported mapfiles
+
+    In CGI and FastCGI deployments MapServer parses the whole mapfile on every request, and
+    mapfiles saved by mapscript restate a lot of defaults: full LEGEND, SCALEBAR, QUERYMAP and
+    REFERENCE blocks, built-in OUTPUTFORMATs, default label and style settings, ... Minifying a
+    mapfile drops what MapServer would do anyway, so that the rendered maps stay the same:
+
+        - indentation, blank lines and comments (including those after END) are dropped;
+        - keywords set to their default value are dropped (see: `DEFAULTS`);
+        - blocks left empty are dropped where an empty block means the same as no block (see:
+          `DROP_WHEN_EMPTY`), and so are REFERENCE blocks without an IMAGE and OUTPUTFORMATs
+          declaring a built-in format as it is.
+
+    Only mapfiles written by mapscript or MapfileWriter.py are expected, which have one keyword
+    or block per line. The contents of PROJECTION, METADATA, ... blocks are kept as they are.
+
+    `parseTime()` measures how long loading a mapfile takes, to check the benefit.
+
+    Nothing in here depends on QGis or mapscript.
+"""
+
+import os
+import time
+import codecs
+
+import MapfileUtils
+
+
+"""Keywords opening a block when they stand alone on their line"""
+BLOCKS = frozenset([
+    u'MAP', u'LAYER', u'CLASS', u'STYLE', u'LABEL', u'LEADER', u'LEGEND', u'SCALEBAR',
+    u'QUERYMAP', u'REFERENCE', u'WEB', u'OUTPUTFORMAT', u'SYMBOLSET', u'SYMBOL', u'FEATURE',
+    u'JOIN', u'GRID', u'CLUSTER', u'COMPOSITE', u'SCALETOKEN', u'PROJECTION', u'METADATA',
+    u'VALIDATION', u'POINTS', u'PATTERN', u'VALUES'
+])
+
+"""Blocks holding data rather than keywords, whose lines are kept verbatim"""
+DATA_BLOCKS = frozenset([
+    u'PROJECTION', u'METADATA', u'VALIDATION', u'POINTS', u'PATTERN', u'VALUES'
+])
+
+"""Default values of keywords, by block (see: initMap(), initLayer(), ... in MapServer)
+
+    Only defaults shared by MapServer 6 and 7 are listed."""
+DEFAULTS = {
+    u'MAP': {
+        u'ANGLE': u'0', u'DEBUG': u'OFF', u'DEFRESOLUTION': u'72', u'IMAGECOLOR': u'255 255 255',
+        u'RESOLUTION': u'72', u'SIZE': u'-1 -1', u'STATUS': u'ON', u'UNITS': u'METERS'
+    },
+    u'LAYER': {
+        u'DEBUG': u'OFF', u'LABELCACHE': u'ON', u'LABELMAXSCALEDENOM': u'-1',
+        u'LABELMINSCALEDENOM': u'-1', u'MAXFEATURES': u'-1', u'MAXSCALEDENOM': u'-1',
+        u'MINSCALEDENOM': u'-1', u'OPACITY': u'100', u'POSTLABELCACHE': u'FALSE',
+        u'SIZEUNITS': u'PIXELS', u'STATUS': u'OFF', u'SYMBOLSCALEDENOM': u'-1',
+        u'TOLERANCEUNITS': u'PIXELS', u'TRANSFORM': u'TRUE', u'UNITS': u'METERS'
+    },
+    u'CLASS': {
+        u'DEBUG': u'OFF', u'MAXSCALEDENOM': u'-1', u'MINSCALEDENOM': u'-1', u'STATUS': u'ON'
+    },
+    u'STYLE': {
+        u'ANGLE': u'0', u'GAP': u'0', u'LINECAP': u'ROUND', u'LINEJOIN': u'ROUND',
+        u'LINEJOINMAXSIZE': u'3', u'MAXSCALEDENOM': u'-1', u'MAXSIZE': u'500',
+        u'MAXWIDTH': u'32', u'MINSCALEDENOM': u'-1', u'MINSIZE': u'0', u'MINWIDTH': u'0',
+        u'OFFSET': u'0 0', u'OPACITY': u'100', u'POLAROFFSET': u'0 0', u'SIZE': u'-1',
+        u'WIDTH': u'1'
+    },
+    u'LABEL': {
+        u'ANGLE': u'0', u'BUFFER': u'0', u'FORCE': u'FALSE', u'MAXLENGTH': u'0',
+        u'MAXOVERLAPANGLE': u'22.5', u'MAXSCALEDENOM': u'-1', u'MAXSIZE': u'256',
+        u'MINDISTANCE': u'-1', u'MINFEATURESIZE': u'-1', u'MINSCALEDENOM': u'-1',
+        u'MINSIZE': u'4', u'OFFSET': u'0 0', u'OUTLINEWIDTH': u'1', u'PARTIALS': u'TRUE',
+        u'POSITION': u'CC', u'PRIORITY': u'1', u'REPEATDISTANCE': u'0', u'SHADOWSIZE': u'1 1',
+        u'SIZE': u'MEDIUM', u'TYPE': u'BITMAP'
+    },
+    u'LEGEND': {
+        u'IMAGECOLOR': u'255 255 255', u'KEYSIZE': u'20 10', u'KEYSPACING': u'5 5',
+        u'POSITION': u'LL', u'POSTLABELCACHE': u'FALSE', u'STATUS': u'OFF'
+    },
+    u'SCALEBAR': {
+        u'ALIGN': u'CENTER', u'COLOR': u'0 0 0', u'IMAGECOLOR': u'255 255 255',
+        u'INTERVALS': u'4', u'POSITION': u'LL', u'POSTLABELCACHE': u'FALSE', u'SIZE': u'200 3',
+        u'STATUS': u'OFF', u'STYLE': u'0', u'UNITS': u'MILES'
+    },
+    u'REFERENCE': {
+        u'COLOR': u'255 0 0', u'EXTENT': u'-1 -1 -1 -1', u'MARKERSIZE': u'0',
+        u'MAXBOXSIZE': u'0', u'MINBOXSIZE': u'3', u'STATUS': u'OFF'
+    },
+    u'QUERYMAP': {
+        u'COLOR': u'255 255 0', u'SIZE': u'-1 -1', u'STATUS': u'OFF', u'STYLE': u'HILITE'
+    },
+    u'WEB': {
+        u'BROWSEFORMAT': u'"text/html"', u'LEGENDFORMAT': u'"text/html"',
+        u'MAXSCALEDENOM': u'-1', u'MINSCALEDENOM': u'-1', u'QUERYFORMAT': u'"text/html"'
+    },
+    u'SYMBOL': {
+        u'ANCHORPOINT': u'0.5 0.5', u'FILLED': u'FALSE'
+    }
+}
+
+"""Blocks which may be dropped when left empty, as `(parent, block)` pairs (None for any parent)"""
+DROP_WHEN_EMPTY = frozenset([
+    (u'MAP', u'LEGEND'), (u'MAP', u'SCALEBAR'), (u'MAP', u'QUERYMAP'), (u'MAP', u'WEB'),
+    (u'LEGEND', u'LABEL'), (u'SCALEBAR', u'LABEL'), (None, u'METADATA'), (None, u'VALIDATION')
+])
+
+"""Built-in output formats (see: msCreateDefaultOutputFormat() in MapServer), by name"""
+BUILTIN_OUTPUT_FORMATS = {
+    u'png': {
+        u'NAME': u'png', u'DRIVER': u'AGG/PNG', u'MIMETYPE': u'image/png',
+        u'EXTENSION': u'png', u'IMAGEMODE': u'RGB', u'TRANSPARENT': u'FALSE'
+    },
+    u'jpeg': {
+        u'NAME': u'jpeg', u'DRIVER': u'AGG/JPEG', u'MIMETYPE': u'image/jpeg',
+        u'EXTENSION': u'jpg', u'IMAGEMODE': u'RGB', u'TRANSPARENT': u'FALSE'
+    }
+}
+
+"""Synonyms of the boolean values, as written by different versions of MapServer"""
+BOOLEANS = {u'ON': u'TRUE', u'OFF': u'FALSE'}
+
+"""Number of times a mapfile is loaded by `parseTime()`"""
+PARSE_REPEAT = 20
+
+
+class Block(object):
+    """A block being minified: its name, the name of its parent and its lines so far"""
+
+    def __init__(self, name, parent):
+        self.name = name
+        self.parent = parent
+        self.lines = []
+        self.keywords = {}
+
+
+def sameToken(a, b):
+    a, b = a.upper(), b.upper()
+    if BOOLEANS.get(a, a) == BOOLEANS.get(b, b):
+        return True
+
+    try:
+        return float(a) == float(b)
+    except ValueError:
+        return False
+
+
+def sameValue(value, default):
+    """Tell whether a keyword value is the same as a default value, e.g. '0.000000' and '0'"""
+
+    tokens, defaultTokens = value.split(), default.split()
+    return len(tokens) == len(defaultTokens) \
+            and all(sameToken(a, b) for a, b in zip(tokens, defaultTokens))
+
+
+def unquote(value):
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in u'"\'':
+        return value[1:-1]
+
+    return value
+
+
+def isBuiltinOutputFormat(keywords):
+    """Tell whether an OUTPUTFORMAT block declares a built-in format as it is"""
+
+    builtin = BUILTIN_OUTPUT_FORMATS.get(unquote(keywords.get(u'NAME', u'')).lower())
+    if builtin is None or set(keywords.keys()) != set(builtin.keys()):
+        return False
+
+    return all(sameValue(unquote(keywords[k]), builtin[k]) for k in builtin)
+
+
+def isDropped(block):
+    """Tell whether a closed block can be left out altogether"""
+
+    if len(block.lines) == 0 and (
+        (block.parent, block.name) in DROP_WHEN_EMPTY or (None, block.name) in DROP_WHEN_EMPTY
+    ):
+        return True
+
+    # A reference map cannot be drawn without an image
+    if block.name == u'REFERENCE' and block.parent == u'MAP':
+        return u'IMAGE' not in block.keywords
+
+    if block.name == u'OUTPUTFORMAT':
+        return isBuiltinOutputFormat(block.keywords)
+
+    return False
+
+
+def minifyLines(lines):
+    """Minify the lines of a mapfile, return the minified lines (without line endings)
+
+        Raises ValueError if blocks are not balanced, which means the mapfile is not one we know
+        how to minify.
+    """
+
+    stack = [Block(None, None)]
+
+    for line in lines:
+        line = line.strip()
+        if line == u'' or line[0] == u'#':
+            continue
+
+        block = stack[-1]
+        parts = line.split(None, 1)
+        keyword = parts[0].upper()
+
+        if keyword == u'END' and (len(parts) == 1 or parts[1][0] == u'#'):
+            if len(stack) == 1:
+                raise ValueError('END without a block')
+
+            stack.pop()
+            if not isDropped(block):
+                stack[-1].lines.append(block.name)
+                stack[-1].lines.extend(block.lines)
+                stack[-1].lines.append(u'END')
+            continue
+
+        if block.name in DATA_BLOCKS:
+            block.lines.append(line)
+            continue
+
+        if len(parts) == 1 and keyword in BLOCKS:
+            stack.append(Block(keyword, block.name))
+            continue
+
+        value = parts[1] if len(parts) > 1 else u''
+        block.keywords[keyword] = value
+
+        default = DEFAULTS.get(block.name, {}).get(keyword)
+        if default is not None and sameValue(value, default):
+            continue
+
+        block.lines.append(line)
+
+    if len(stack) > 1:
+        raise ValueError('Unterminated %s block' % stack[-1].name)
+
+    return stack[0].lines
+
+
+def minifyMapfile(mapfilePath):
+    """Minify a mapfile in place, return its size before and after, in bytes"""
+
+    with codecs.open(mapfilePath, 'r', 'utf-8') as fin:
+        lines = minifyLines(fin)
+
+    sizeBefore = os.path.getsize(mapfilePath)
+
+    # Write to a temporary file first, so that the mapfile is never left half-written
+    tempPath = mapfilePath + u'.%d.tmp' % os.getpid()
+    with codecs.open(tempPath, 'w', 'utf-8') as fout:
+        for line in lines:
+            fout.write(line)
+            fout.write(u'\n')
+
+    MapfileUtils.replaceFile(tempPath, mapfilePath)
+
+    return sizeBefore, os.path.getsize(mapfilePath)
+
+
+def parseTime(mapfilePath, mapObj, repeat=PARSE_REPEAT):
+    """Return the average time, in seconds, `mapObj` (e.g. `mapscript.mapObj`) takes to load a
+    mapfile"""
+
+    start = time.time()
+    for i in range(repeat):
+        mapObj(mapfilePath)
+
+    return (time.time() - start) / repeat
@@ -0,0 +1,226 @@
+"""Helpers operating on the text of mapfiles
+
+    Nothing in here depends on QGis or mapscript, so these can be used (and tested) on hosts
+    that only have the generated mapfiles at hand.
+"""
+
+import os
+import re
+import codecs
+from contextlib import contextmanager
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+
+"""Matches FONT keywords, capturing the font name between the quotes"""
+FONT_RX = re.compile(u'^(\\s*FONT\\s+")([^"]*)(".*)$')
+
+"""Matches the line opening the MAP block"""
+MAP_RX = re.compile(u'^MAP(\r\n|\r|\n)*$')
+
+"""Matches the NAME of a symbol in a symbol set written by `writeSymbolset()`"""
+SYMBOL_NAME_RX = re.compile(u'^    NAME (["\'])(.*)\\1$')
+
+"""Name of the symbol set shared by the mapfiles exported to the same directory"""
+SHARED_SYMBOLSET_NAME = u'symbols.sym'
+
+
+def fontAlias(fontName):
+    """Convert a font name into the alias used in the mapfile and the fontset"""
+
+    return fontName.replace(' ', '')
+
+
+def writeFontList(fontListPath, fonts):
+    """Write the list of font aliases used in a mapfile, one alias per line"""
+
+    with codecs.open(fontListPath, 'w', 'utf-8') as fout:
+        for alias in fonts:
+            fout.write(alias + u'\n')
+
+
+def postProcessMapfile(mapfilePath, fontsetPath=u'', fontListPath=None):
+    """Rewrite a mapfile saved by mapscript in a single streaming pass
+
+        The following is done while copying the mapfile line by line:
+
+            - Font names in FONT keywords are replaced by their aliases (i.e. without spaces).
+              This cannot be done any earlier since SLD styles may refer to fonts whose names
+              contain spaces.
+            - The aliases of all fonts in use are collected, and written to `fontListPath` (one
+              alias per line, in order of appearance) if it is set.
+            - A FONTSET keyword pointing to `fontsetPath` is inserted right after the line opening
+              the MAP block if `fontsetPath` is set.
+
+        Only the current line is kept in memory, so this scales to mapfiles of any size. The
+        mapfile is only replaced if its contents actually changed.
+
+        Returns a `(fonts, fontsetAdded)` tuple, where `fonts` is the list of font aliases and
+        `fontsetAdded` tells whether the FONTSET keyword could be inserted.
+    """
+
+    if isinstance(fontsetPath, bytes):
+        fontsetPath = fontsetPath.decode('utf-8')
+
+    fonts = []
+    seenFonts = set()
+    fontsetAdded = False
+    changed = False
+
+    tempPath = mapfilePath + u'.tmp'
+
+    with codecs.open(mapfilePath, 'r', 'utf-8') as fin:
+        with codecs.open(tempPath, 'w', 'utf-8') as fout:
+            for line in fin:
+                line = line.rstrip(u'\n')
+
+                m = FONT_RX.match(line)
+                if m is not None:
+                    alias = fontAlias(m.group(2))
+
+                    if alias not in seenFonts:
+                        seenFonts.add(alias)
+                        fonts.append(alias)
+
+                    if alias != m.group(2):
+                        line = m.group(1) + alias + m.group(3)
+                        changed = True
+
+                fout.write(line + u'\n')
+
+                if (fontsetPath != '') and (not fontsetAdded) and MAP_RX.match(line):
+                    fout.write(u'  FONTSET "%s"\n' % fontsetPath)
+                    fontsetAdded = changed = True
+
+    if changed:
+        replaceFile(tempPath, mapfilePath)
+    else:
+        os.remove(tempPath)
+
+    if fontListPath is not None:
+        writeFontList(fontListPath, fonts)
+
+    return (fonts, fontsetAdded)
+
+
+@contextmanager
+def fileLock(path):
+    """Hold an exclusive lock on `path` + '.lock', so that concurrent exports take turns"""
+
+    with open(path + u'.lock', 'a') as lockFile:
+        if fcntl is not None:
+            fcntl.flock(lockFile.fileno(), fcntl.LOCK_EX)
+        else:
+            msvcrt.locking(lockFile.fileno(), msvcrt.LK_LOCK, 1)
+
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lockFile.fileno(), fcntl.LOCK_UN)
+            else:
+                msvcrt.locking(lockFile.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def replaceFile(tempPath, path):
+    """Move a temporary file over `path`, replacing it if it exists"""
+
+    # `os.rename()` does not overwrite existing files on Windows
+    if os.name == 'nt' and os.path.exists(path):
+        os.remove(path)
+    os.rename(tempPath, path)
+
+
+def readSymbolset(symbolsetPath):
+    """Read a symbol set written by `writeSymbolset()` into an ordered name -> text dict"""
+
+    symbols = OrderedDict()
+    if not os.path.isfile(symbolsetPath):
+        return symbols
+
+    name, block = None, None
+    with codecs.open(symbolsetPath, 'r', 'utf-8') as fin:
+        for line in fin:
+            if line == u'  SYMBOL\n':
+                name, block = None, [line]
+                continue
+
+            if block is None:
+                continue
+
+            block.append(line)
+
+            m = SYMBOL_NAME_RX.match(line.rstrip(u'\n'))
+            if m is not None and name is None:
+                name = m.group(2).replace(u'\\"', u'"')
+
+            if line == u'  END # SYMBOL\n':
+                if name is not None:
+                    symbols[name] = u''.join(block)
+                name, block = None, None
+
+    return symbols
+
+
+def writeSymbolset(symbolsetPath, symbols):
+    """Write SYMBOL blocks (as rendered by `MapfileWriter.MapfileStream`) to a symbol set file"""
+
+    tempPath = symbolsetPath + u'.%d.tmp' % os.getpid()
+
+    with codecs.open(tempPath, 'w', 'utf-8') as fout:
+        fout.write(u'SYMBOLSET\n')
+        for text in symbols.values():
+            fout.write(text)
+        fout.write(u'END # SYMBOLSET\n')
+
+    replaceFile(tempPath, symbolsetPath)
+
+
+def mergeSymbolset(symbolsetPath, symbols):
+    """Add symbols to a symbol set shared by several mapfiles
+
+        Symbols are expected to be named after their definition (see:
+        `SerializationUtils.internSymbol()`), so symbols already in the set are kept as they are.
+        Symbols are sorted by name, so that the file does not depend on the order of the exports.
+        The file is only rewritten if symbols were added.
+
+        Returns the number of symbols added.
+    """
+
+    with fileLock(symbolsetPath):
+        existing = readSymbolset(symbolsetPath)
+
+        added = [name for name in symbols if name not in existing]
+        if len(added) == 0:
+            return 0
+
+        for name in added:
+            existing[name] = symbols[name]
+
+        writeSymbolset(
+            symbolsetPath, OrderedDict((name, existing[name]) for name in sorted(existing))
+        )
+
+    return len(added)
+
+
+def mergeFontList(fontListPath, fonts):
+    """Add font aliases to a font list shared by several mapfiles (see: `writeFontList()`)"""
+
+    with fileLock(fontListPath):
+        existing = []
+        if os.path.isfile(fontListPath):
+            with codecs.open(fontListPath, 'r', 'utf-8') as fin:
+                existing = [line.rstrip(u'\n') for line in fin if line.strip() != u'']
+
+        added = [alias for alias in fonts if alias not in existing]
+        if len(added) > 0:
+            tempPath = fontListPath + u'.%d.tmp' % os.getpid()
+            writeFontList(tempPath, existing + added)
+            replaceFile(tempPath, fontListPath)
@@ -0,0 +1,1026 @@
+"""A pure Python, streaming mapfile backend
+
+    This module mimics the subset of the mapscript API used by the exporter (`mapObj`, `layerObj`,
+    `classObj`, `styleObj`, `labelObj`, `symbolObj`, ... and the `MS_*` constants) with lightweight
+    Python objects, so that the serializers in Serialization.py can run unchanged on top of it.
+
+    Instead of building the whole map in memory and saving it at the end, `MapfileStream` writes
+    the map header first, then every layer as soon as it has been serialized (after which the
+    layer can be dropped), and finally the symbols collected along the way. Peak memory therefore
+    does not depend on the size of the project.
+
+    Constants have the same values as their mapscript counterparts, so that they can be mixed
+    freely. Nothing here requires mapscript to be importable.
+"""
+
+import os
+import io
+import codecs
+from collections import OrderedDict
+
+import MapfileUtils
+
+# --------------------------------------------------------------------------------------------------
+# Constants (values as in mapserver.h)
+# --------------------------------------------------------------------------------------------------
+
+MS_VERSION_MAJOR = 7
+MS_VERSION_MINOR = 0
+
+MS_SUCCESS, MS_FAILURE = 0, 1
+MS_FALSE, MS_TRUE = 0, 1
+MS_OFF, MS_ON, MS_DEFAULT = 0, 1, 2
+
+(MS_INCHES, MS_FEET, MS_MILES, MS_METERS, MS_KILOMETERS, MS_DD, MS_PIXELS, MS_PERCENTAGES,
+ MS_NAUTICALMILES) = range(9)
+
+(MS_LAYER_POINT, MS_LAYER_LINE, MS_LAYER_POLYGON, MS_LAYER_RASTER, MS_LAYER_ANNOTATION,
+ MS_LAYER_QUERY, MS_LAYER_CIRCLE, MS_LAYER_TILEINDEX, MS_LAYER_CHART) = range(9)
+
+(MS_INLINE, MS_SHAPEFILE, MS_TILED_SHAPEFILE, MS_UNUSED_2, MS_OGR, MS_UNUSED_1, MS_POSTGIS,
+ MS_WMS, MS_ORACLESPATIAL, MS_WFS, MS_GRATICULE, MS_MYSQL, MS_RASTER, MS_PLUGIN,
+ MS_UNION) = range(15)
+
+(MS_SYMBOL_SIMPLE, MS_SYMBOL_VECTOR, MS_SYMBOL_ELLIPSE, MS_SYMBOL_PIXMAP, MS_SYMBOL_TRUETYPE,
+ MS_SYMBOL_HATCH, MS_SYMBOL_SVG) = range(1000, 1007)
+
+MS_TRUETYPE, MS_BITMAP = 0, 1
+
+(MS_UL, MS_LR, MS_UR, MS_LL, MS_CR, MS_CL, MS_UC, MS_LC, MS_CC, MS_AUTO, MS_XY, MS_FOLLOW,
+ MS_AUTO2, MS_NONE) = range(101, 115)
+
+(MS_CJC_NONE, MS_CJC_BEVEL, MS_CJC_BUTT, MS_CJC_MITER, MS_CJC_ROUND, MS_CJC_SQUARE,
+ MS_CJC_TRIANGLE) = range(7)
+
+(MS_LABEL_BINDING_SIZE, MS_LABEL_BINDING_ANGLE, MS_LABEL_BINDING_COLOR,
+ MS_LABEL_BINDING_OUTLINECOLOR, MS_LABEL_BINDING_FONT, MS_LABEL_BINDING_PRIORITY,
+ MS_LABEL_BINDING_POSITION, MS_LABEL_BINDING_SHADOWSIZEX, MS_LABEL_BINDING_SHADOWSIZEY) = range(9)
+
+
+"""Constant -> mapfile keyword maps"""
+UNIT_NAMES = {
+    MS_INCHES: 'INCHES', MS_FEET: 'FEET', MS_MILES: 'MILES', MS_METERS: 'METERS',
+    MS_KILOMETERS: 'KILOMETERS', MS_DD: 'DD', MS_PIXELS: 'PIXELS',
+    MS_PERCENTAGES: 'PERCENTAGES', MS_NAUTICALMILES: 'NAUTICALMILES'
+}
+
+LAYER_TYPE_NAMES = {
+    MS_LAYER_POINT: 'POINT', MS_LAYER_LINE: 'LINE', MS_LAYER_POLYGON: 'POLYGON',
+    MS_LAYER_RASTER: 'RASTER', MS_LAYER_ANNOTATION: 'ANNOTATION', MS_LAYER_QUERY: 'QUERY',
+    MS_LAYER_CIRCLE: 'CIRCLE', MS_LAYER_TILEINDEX: 'TILEINDEX', MS_LAYER_CHART: 'CHART'
+}
+
+CONNECTION_TYPE_NAMES = {
+    MS_INLINE: 'INLINE', MS_OGR: 'OGR', MS_POSTGIS: 'POSTGIS', MS_WMS: 'WMS',
+    MS_ORACLESPATIAL: 'ORACLESPATIAL', MS_WFS: 'WFS', MS_GRATICULE: 'GRATICULE',
+    MS_MYSQL: 'MYSQL', MS_PLUGIN: 'PLUGIN', MS_UNION: 'UNION'
+}
+
+SYMBOL_TYPE_NAMES = {
+    MS_SYMBOL_SIMPLE: 'SIMPLE', MS_SYMBOL_VECTOR: 'VECTOR', MS_SYMBOL_ELLIPSE: 'ELLIPSE',
+    MS_SYMBOL_PIXMAP: 'PIXMAP', MS_SYMBOL_TRUETYPE: 'TRUETYPE', MS_SYMBOL_HATCH: 'HATCH',
+    MS_SYMBOL_SVG: 'SVG'
+}
+
+POSITION_NAMES = {
+    MS_UL: 'UL', MS_LR: 'LR', MS_UR: 'UR', MS_LL: 'LL', MS_CR: 'CR', MS_CL: 'CL', MS_UC: 'UC',
+    MS_LC: 'LC', MS_CC: 'CC', MS_AUTO: 'AUTO', MS_XY: 'XY', MS_FOLLOW: 'FOLLOW'
+}
+
+CAP_JOIN_NAMES = {
+    MS_CJC_NONE: 'NONE', MS_CJC_BEVEL: 'BEVEL', MS_CJC_BUTT: 'BUTT', MS_CJC_MITER: 'MITER',
+    MS_CJC_ROUND: 'ROUND', MS_CJC_SQUARE: 'SQUARE', MS_CJC_TRIANGLE: 'TRIANGLE'
+}
+
+LABEL_BINDING_NAMES = {
+    MS_LABEL_BINDING_SIZE: 'SIZE', MS_LABEL_BINDING_ANGLE: 'ANGLE',
+    MS_LABEL_BINDING_COLOR: 'COLOR', MS_LABEL_BINDING_OUTLINECOLOR: 'OUTLINECOLOR',
+    MS_LABEL_BINDING_FONT: 'FONT', MS_LABEL_BINDING_PRIORITY: 'PRIORITY',
+    MS_LABEL_BINDING_POSITION: 'POSITION'
+}
+
+"""Output formats we know how to declare, by image type"""
+OUTPUT_FORMAT_DRIVERS = {
+    'png':  ('AGG/PNG', 'image/png', 'png', 'RGB'),
+    'gif':  ('GD/GIF', 'image/gif', 'gif', 'PC256'),
+    'jpeg': ('AGG/JPEG', 'image/jpeg', 'jpg', 'RGB'),
+    'svg':  ('CAIRO/SVG', 'image/svg+xml', 'svg', 'RGB'),
+    'gtiff': ('GDAL/GTiff', 'image/tiff', 'tif', 'RGB')
+}
+
+
+# --------------------------------------------------------------------------------------------------
+# Formatting helpers
+# --------------------------------------------------------------------------------------------------
+
+def toText(s):
+    """Convert a (possibly UTF-8 encoded) string to unicode"""
+
+    return s.decode('utf-8') if isinstance(s, bytes) else u'%s' % s
+
+
+def quote(s):
+    """Quote a string the way MapServer's mapfile writer does"""
+
+    s = toText(s)
+    if u'"' not in s:
+        return u'"%s"' % s
+    if u"'" not in s:
+        return u"'%s'" % s
+
+    return u'"%s"' % s.replace(u'"', u'\\"')
+
+
+def number(n):
+    """Format a number for the mapfile"""
+
+    return u'%d' % n if isinstance(n, int) else u'%.15g' % n
+
+
+def expression(s):
+    """Format an expression: logical expressions, regexes and lists are written verbatim"""
+
+    s = toText(s)
+    return s if s[:1] in (u'(', u'/', u'{') else quote(s)
+
+
+def onOff(flag):
+    return u'ON' if flag else u'OFF'
+
+
+def trueFalse(flag):
+    return u'TRUE' if flag else u'FALSE'
+
+
+# --------------------------------------------------------------------------------------------------
+# Lightweight mapscript-compatible objects
+# --------------------------------------------------------------------------------------------------
+
+class MapfileObject(object):
+    """Base class of all objects of this backend
+
+        As with SWIG objects, arbitrary attributes may be set on instances.
+    """
+    pass
+
+
+class colorObj(MapfileObject):
+    def __init__(self, red=0, green=0, blue=0, alpha=255):
+        self.setRGB(red, green, blue, alpha)
+
+    def setRGB(self, red, green, blue, alpha=255):
+        self.red, self.green, self.blue, self.alpha = red, green, blue, alpha
+        return MS_SUCCESS
+
+    def toMapfile(self):
+        if self.alpha == 255:
+            return u'%d %d %d' % (self.red, self.green, self.blue)
+
+        return u'"#%02x%02x%02x%02x"' % (self.red, self.green, self.blue, self.alpha)
+
+
+class pointObj(MapfileObject):
+    def __init__(self, x=0, y=0):
+        self.x, self.y = x, y
+
+
+class lineObj(MapfileObject):
+    def __init__(self):
+        self.points = []
+
+    @property
+    def numpoints(self):
+        return len(self.points)
+
+    def add(self, p):
+        self.points.append(p)
+        return MS_SUCCESS
+
+    def get(self, i):
+        return self.points[i]
+
+
+class rectObj(MapfileObject):
+    def __init__(self, minx=-1.0, miny=-1.0, maxx=-1.0, maxy=-1.0):
+        self.minx, self.miny, self.maxx, self.maxy = minx, miny, maxx, maxy
+
+    def isSet(self):
+        return not (self.minx == -1 and self.miny == -1 and self.maxx == -1 and self.maxy == -1)
+
+    def toMapfile(self):
+        return u' '.join(number(float(v)) for v in (self.minx, self.miny, self.maxx, self.maxy))
+
+
+class hashTableObj(MapfileObject):
+    """An insertion-ordered key -> value table (used for METADATA, VALIDATION and such)"""
+
+    def __init__(self):
+        self.items = OrderedDict()
+
+    @property
+    def numitems(self):
+        return len(self.items)
+
+    def set(self, key, value):
+        self.items[key] = value
+        return MS_SUCCESS
+
+    def get(self, key, default=None):
+        return self.items.get(key, default)
+
+    def remove(self, key):
+        self.items.pop(key, None)
+        return MS_SUCCESS
+
+
+class symbolObj(MapfileObject):
+    def __init__(self, name=''):
+        self.name = name
+        self.type = MS_SYMBOL_SIMPLE
+        self.filled = MS_FALSE
+        self.inmapfile = MS_FALSE
+        self.font = None
+        self.character = None
+        self.imagepath = None
+        self.anchorpointx = 0.5
+        self.anchorpointy = 0.5
+        self.points = []
+
+    def setPoints(self, line):
+        self.points = [(p.x, p.y) for p in line.points]
+        return len(self.points)
+
+    def getPoints(self):
+        line = lineObj()
+        for x, y in self.points:
+            line.add(pointObj(x, y))
+
+        return line
+
+    def setImagepath(self, imagepath):
+        self.imagepath = imagepath
+        return MS_SUCCESS
+
+
+class symbolSetObj(MapfileObject):
+    def __init__(self, filename=None):
+        # Like in MapServer, index 0 is taken by the default symbol
+        self.symbols = [symbolObj('default')]
+        self.filename = filename
+
+    @property
+    def numsymbols(self):
+        return len(self.symbols)
+
+    def appendSymbol(self, symbol):
+        self.symbols.append(symbol)
+        return len(self.symbols) - 1
+
+    def getSymbol(self, i):
+        return self.symbols[i]
+
+    def getSymbolByName(self, name):
+        for symbol in self.symbols:
+            if symbol.name == name:
+                return symbol
+
+        return None
+
+
+class styleObj(MapfileObject):
+    def __init__(self, parent_class=None):
+        self.color = None
+        self.outlinecolor = None
+        self.symbolname = None
+        self.size = -1
+        self.width = 1
+        self.angle = 0
+        self.gap = 0
+        self.opacity = 100
+        self.offsetx = 0
+        self.offsety = 0
+        self.linecap = MS_CJC_ROUND
+        self.linejoin = MS_CJC_ROUND
+        self.pattern = []
+
+        if parent_class is not None:
+            parent_class.insertStyle(self)
+
+
+class labelObj(MapfileObject):
+    def __init__(self):
+        self.type = MS_TRUETYPE
+        self.encoding = None
+        self.font = None
+        self.size = -1
+        self.minsize = 4
+        self.maxsize = 256
+        self.color = colorObj(0, 0, 0)
+        self.outlinecolor = None
+        self.position = MS_CC
+        self.offsetx = 0
+        self.offsety = 0
+        self.angle = 0
+        self.wrap = None
+        self.partials = MS_TRUE
+        self.force = MS_FALSE
+        self.priority = 1
+        self.buffer = 0
+        self.minfeaturesize = -1
+        self.bindings = OrderedDict()
+
+    def setBinding(self, binding, item):
+        self.bindings[binding] = item
+        return MS_SUCCESS
+
+    def getBinding(self, binding):
+        return self.bindings.get(binding)
+
+
+class classObj(MapfileObject):
+    def __init__(self, layer=None):
+        self.name = ''
+        self.group = None
+        self.expression = None
+        self.text = None
+        self.minscaledenom = -1
+        self.maxscaledenom = -1
+        self.styles = []
+        self.labels = []
+
+        if layer is not None:
+            layer.insertClass(self)
+
+    @property
+    def numstyles(self):
+        return len(self.styles)
+
+    @property
+    def numlabels(self):
+        return len(self.labels)
+
+    def setExpression(self, expression):
+        self.expression = expression
+        return MS_SUCCESS
+
+    def setText(self, text):
+        self.text = text
+        return MS_SUCCESS
+
+    def insertStyle(self, style, index=-1):
+        if index < 0:
+            self.styles.append(style)
+        else:
+            self.styles.insert(index, style)
+
+        return self.styles.index(style)
+
+    def getStyle(self, i):
+        return self.styles[i]
+
+    def addLabel(self, label):
+        self.labels.append(label)
+        return MS_SUCCESS
+
+    def getLabel(self, i):
+        return self.labels[i]
+
+
+class layerObj(MapfileObject):
+    def __init__(self, map=None):
+        self.name = ''
+        self.group = None
+        self.type = MS_LAYER_POINT
+        self.status = MS_OFF
+        self.extent = rectObj()
+        self.minscaledenom = -1
+        self.maxscaledenom = -1
+        self.labelminscaledenom = -1
+        self.labelmaxscaledenom = -1
+        self.projection = ''
+        self.metadata = hashTableObj()
+        self.connectiontype = MS_SHAPEFILE
+        self.connection = None
+        self.data = None
+        self.tileindex = None
+        self.tileitem = 'location'
+        self.filter = None
+        self.classitem = None
+        self.labelitem = None
+        self.opacity = 100
+        self.sizeunits = MS_PIXELS
+        self.processing = []
+        self.classes = []
+        self.index = -1
+
+        if map is not None:
+            map.insertLayer(self)
+
+    @property
+    def numclasses(self):
+        return len(self.classes)
+
+    def setProjection(self, proj4):
+        self.projection = proj4
+        return MS_SUCCESS
+
+    def setMetaData(self, key, value):
+        return self.metadata.set(key, value)
+
+    def getMetaData(self, key):
+        return self.metadata.get(key)
+
+    def setConnectionType(self, connectiontype, library=''):
+        self.connectiontype = connectiontype
+        return MS_SUCCESS
+
+    def setFilter(self, filter):
+        self.filter = filter
+        return MS_SUCCESS
+
+    def addProcessing(self, directive):
+        self.processing.append(directive)
+
+    def insertClass(self, msClass, index=-1):
+        if index < 0:
+            self.classes.append(msClass)
+        else:
+            self.classes.insert(index, msClass)
+
+        return self.classes.index(msClass)
+
+    def getClass(self, i):
+        return self.classes[i]
+
+    def applySLD(self, sld, layerName):
+        # Parsing SLD needs MapServer itself
+        return MS_FAILURE
+
+
+class outputFormatObj(MapfileObject):
+    def __init__(self, name):
+        self.name = name
+        self.transparent = MS_OFF
+
+
+class legendObj(MapfileObject):
+    def __init__(self):
+        self.keysizex = 20
+        self.keysizey = 10
+
+
+class webObj(MapfileObject):
+    def __init__(self):
+        self.imagepath = ''
+        self.imageurl = ''
+        self.temppath = ''
+        self.template = ''
+        self.header = ''
+        self.footer = ''
+        self.validation = hashTableObj()
+        self.metadata = hashTableObj()
+
+
+class mapObj(MapfileObject):
+    def __init__(self, filename=None):
+        self.name = 'MS'
+        self.width = -1
+        self.height = -1
+        self.units = MS_METERS
+        self.extent = rectObj()
+        self.projection = ''
+        self.shapepath = ''
+        self.fontset = ''
+        self.imagecolor = colorObj(255, 255, 255)
+        self.imagetype = None
+        self.outputformats = {}
+        self.web = webObj()
+        self.legend = legendObj()
+        self.symbolset = symbolSetObj()
+        self.layers = []
+
+    @property
+    def numlayers(self):
+        return len(self.layers)
+
+    def setSize(self, width, height):
+        self.width, self.height = width, height
+        return MS_SUCCESS
+
+    def setProjection(self, proj4):
+        self.projection = proj4
+        return MS_SUCCESS
+
+    def setImageType(self, imagetype):
+        self.imagetype = imagetype
+        self.getOutputFormatByName(imagetype)
+
+    def getOutputFormatByName(self, name):
+        return self.outputformats.setdefault(name, outputFormatObj(name))
+
+    def setMetaData(self, key, value):
+        return self.web.metadata.set(key, value)
+
+    def getMetaData(self, key):
+        return self.web.metadata.get(key)
+
+    def insertLayer(self, layer, index=-1):
+        if index < 0:
+            self.layers.append(layer)
+        else:
+            self.layers.insert(index, layer)
+
+        for i, l in enumerate(self.layers):
+            l.index = i
+
+        return layer.index
+
+    def getLayer(self, i):
+        return self.layers[i]
+
+    def getLayerByName(self, name):
+        for layer in self.layers:
+            if layer.name == name:
+                return layer
+
+        return None
+
+    def removeLayer(self, i):
+        layer = self.layers.pop(i)
+        for j, l in enumerate(self.layers):
+            l.index = j
+
+        return layer
+
+    def save(self, filename):
+        """Write the whole map at once"""
+
+        try:
+            stream = MapfileStream(filename, self)
+            stream.begin()
+            while self.numlayers > 0:
+                stream.writeLayer(self.getLayer(0))
+            stream.end()
+        except IOError:
+            return MS_FAILURE
+
+        return MS_SUCCESS
+
+
+# --------------------------------------------------------------------------------------------------
+# The writer
+# --------------------------------------------------------------------------------------------------
+
+class MapfileStream(object):
+    """Write a mapObj to a mapfile incrementally
+
+        Call `begin()` once all map level properties have been set, `writeLayer()` for every layer
+        as soon as it is complete and `end()` when done. Symbols are written at the end of the
+        map, as MapServer only resolves symbol names once the whole mapfile has been read.
+
+        Font names are replaced by their aliases on the fly (see: `MapfileUtils.fontAlias()`) and
+        the aliases used are collected in `fonts`.
+
+        Layers can also be rendered to self-contained fragments with `layerFragment()`, to be
+        written later (or by another export) with `writeFragment()`.
+
+        If `symbolsetPath` is set, symbols are merged into that symbol set file rather than
+        written to the mapfile, which refers to it with SYMBOLSET instead. Mapfiles exported to
+        the same directory can share a single symbol set this way (see:
+        `MapfileUtils.mergeSymbolset()`).
+    """
+
+    def __init__(self, filename, msMap, fontsetPath='', symbolsetPath=None):
+        self.filename = filename
+        self.msMap = msMap
+        self.fontsetPath = fontsetPath
+        self.symbolsetPath = symbolsetPath
+        self.fonts = []
+        self.fout = None
+        self.depth = 0
+        self.fragmentSymbols = OrderedDict()
+        self.symbolDefinitions = {}
+
+    # Low level output
+
+    def line(self, text):
+        self.fout.write(u'  ' * self.depth + text + u'\n')
+
+    def keyword(self, keyword, value):
+        self.line(u'%s %s' % (keyword, value))
+
+    def open(self, block):
+        self.line(block)
+        self.depth += 1
+
+    def close(self, block):
+        self.depth -= 1
+        self.line(u'END # %s' % block)
+
+    def font(self, name):
+        alias = MapfileUtils.fontAlias(toText(name))
+        if alias not in self.fonts:
+            self.fonts.append(alias)
+
+        self.keyword(u'FONT', quote(alias))
+
+    def projection(self, proj4):
+        self.open(u'PROJECTION')
+        for token in toText(proj4).split():
+            self.line(quote(token.lstrip(u'+')))
+        self.close(u'PROJECTION')
+
+    def hashTable(self, block, table):
+        if table.numitems == 0:
+            return
+
+        self.open(block)
+        for key, value in table.items.items():
+            self.line(u'%s %s' % (quote(key), quote(value)))
+        self.close(block)
+
+    # Objects
+
+    def begin(self):
+        """Open the output file and write everything but layers and symbols"""
+
+        m = self.msMap
+        self.fout = codecs.open(self.filename, 'w', 'utf-8')
+
+        self.open(u'MAP')
+
+        if self.fontsetPath:
+            self.keyword(u'FONTSET', quote(self.fontsetPath))
+
+        self.keyword(u'NAME', quote(m.name))
+
+        if m.width > 0 and m.height > 0:
+            self.keyword(u'SIZE', u'%d %d' % (m.width, m.height))
+
+        self.keyword(u'UNITS', UNIT_NAMES[m.units])
+
+        if m.extent.isSet():
+            self.keyword(u'EXTENT', m.extent.toMapfile())
+
+        if m.shapepath:
+            self.keyword(u'SHAPEPATH', quote(m.shapepath))
+
+        if self.symbolsetPath:
+            # MapServer resolves the path relative to the mapfile
+            self.keyword(u'SYMBOLSET', quote(os.path.relpath(
+                self.symbolsetPath, os.path.dirname(os.path.abspath(self.filename))
+            )))
+        elif m.symbolset.filename:
+            self.keyword(u'SYMBOLSET', quote(m.symbolset.filename))
+
+        self.keyword(u'IMAGECOLOR', m.imagecolor.toMapfile())
+
+        if m.imagetype:
+            self.keyword(u'IMAGETYPE', toText(m.imagetype))
+
+        if m.projection:
+            self.projection(m.projection)
+
+        for name, outputformat in m.outputformats.items():
+            self.outputFormat(outputformat)
+
+        self.webSection(m.web)
+
+        self.open(u'LEGEND')
+        self.keyword(u'KEYSIZE', u'%d %d' % (m.legend.keysizex, m.legend.keysizey))
+        self.close(u'LEGEND')
+
+    def outputFormat(self, outputformat):
+        # Built-in formats only need to be declared if they differ from the defaults
+        name = toText(outputformat.name)
+        if not outputformat.transparent or name.lower() not in OUTPUT_FORMAT_DRIVERS:
+            return
+
+        driver, mimetype, extension, imagemode = OUTPUT_FORMAT_DRIVERS[name.lower()]
+
+        self.open(u'OUTPUTFORMAT')
+        self.keyword(u'NAME', quote(name))
+        self.keyword(u'DRIVER', quote(driver))
+        self.keyword(u'MIMETYPE', quote(mimetype))
+        self.keyword(u'EXTENSION', quote(extension))
+        self.keyword(u'IMAGEMODE', imagemode if imagemode == u'PC256' else u'RGBA')
+        self.keyword(u'TRANSPARENT', onOff(True))
+        self.close(u'OUTPUTFORMAT')
+
+    def webSection(self, web):
+        self.open(u'WEB')
+
+        for keyword, value in [
+            (u'IMAGEPATH', web.imagepath), (u'IMAGEURL', web.imageurl),
+            (u'TEMPPATH', web.temppath), (u'TEMPLATE', web.template),
+            (u'HEADER', web.header), (u'FOOTER', web.footer)
+        ]:
+            if value:
+                self.keyword(keyword, quote(value))
+
+        self.hashTable(u'METADATA', web.metadata)
+        self.hashTable(u'VALIDATION', web.validation)
+
+        self.close(u'WEB')
+
+    def writeLayer(self, layer):
+        """Write a layer and remove it from the map"""
+
+        self.writeFragment(self.layerFragment(layer))
+
+        if layer.index >= 0 and layer in self.msMap.layers:
+            self.msMap.removeLayer(layer.index)
+
+    def layerFragment(self, layer):
+        """Render a layer without writing it
+
+            Returns a dictionary holding the text of the LAYER block (`layer`), the SYMBOL blocks
+            of the symbols its styles refer to as `(name, text)` pairs (`symbols`) and the aliases
+            of the fonts it uses (`fonts`). The dictionary only contains strings and lists, so it
+            can be stored as JSON.
+        """
+
+        fout, depth, fonts = self.fout, self.depth, self.fonts
+        self.depth = 1
+        self.fonts = []
+
+        try:
+            self.fout = io.StringIO()
+            self.writeLayerBlock(layer)
+            text = self.fout.getvalue()
+
+            symbols = []
+            for name in symbolNames(layer):
+                symbol = self.msMap.symbolset.getSymbolByName(name)
+                if symbol is None or not symbol.inmapfile:
+                    continue
+
+                self.fout = io.StringIO()
+                self.writeSymbol(symbol)
+                symbols.append((name, self.fout.getvalue()))
+
+            return {'layer': text, 'symbols': symbols, 'fonts': self.fonts}
+        finally:
+            self.fout, self.depth, self.fonts = fout, depth, fonts
+
+    def writeFragment(self, fragment):
+        """Write a layer rendered by `layerFragment()`
+
+            Its symbols are kept aside and written by `end()`. Fragments rendered from different
+            maps (e.g. by worker processes, see: ParallelExport.py) may use the same name for
+            different symbols or different names for the same symbol, so symbols are renamed as
+            needed for each definition to be written once, under a single name.
+        """
+
+        text = fragment['layer']
+
+        for name, symbolText in fragment['symbols']:
+            name = toText(name)
+            definition = symbolText.replace(u'NAME %s\n' % quote(name), u'', 1)
+
+            if definition in self.symbolDefinitions:
+                newName = self.symbolDefinitions[definition]
+            else:
+                newName = name
+                n = 1
+                while newName in self.fragmentSymbols:
+                    newName = u'%s-%d' % (name, n)
+                    n += 1
+
+                self.symbolDefinitions[definition] = newName
+                self.fragmentSymbols[newName] = symbolText.replace(
+                    u'NAME %s\n' % quote(name), u'NAME %s\n' % quote(newName), 1
+                )
+
+            if newName != name:
+                text = text.replace(
+                    u'SYMBOL %s\n' % quote(name), u'SYMBOL %s\n' % quote(newName)
+                )
+
+        self.fout.write(text)
+
+        for alias in fragment['fonts']:
+            if alias not in self.fonts:
+                self.fonts.append(alias)
+
+    def writeLayerBlock(self, layer):
+        self.open(u'LAYER')
+
+        self.keyword(u'NAME', quote(layer.name))
+        if layer.group:
+            self.keyword(u'GROUP', quote(layer.group))
+
+        self.keyword(u'TYPE', LAYER_TYPE_NAMES[layer.type])
+        self.keyword(u'STATUS', u'DEFAULT' if layer.status == MS_DEFAULT else onOff(layer.status))
+
+        if layer.extent.isSet():
+            self.keyword(u'EXTENT', layer.extent.toMapfile())
+
+        for keyword, value in [
+            (u'MINSCALEDENOM', layer.minscaledenom), (u'MAXSCALEDENOM', layer.maxscaledenom),
+            (u'LABELMINSCALEDENOM', layer.labelminscaledenom),
+            (u'LABELMAXSCALEDENOM', layer.labelmaxscaledenom)
+        ]:
+            if value >= 0:
+                self.keyword(keyword, number(value))
+
+        if layer.projection:
+            self.projection(layer.projection)
+
+        self.hashTable(u'METADATA', layer.metadata)
+
+        if layer.connectiontype in CONNECTION_TYPE_NAMES:
+            self.keyword(u'CONNECTIONTYPE', CONNECTION_TYPE_NAMES[layer.connectiontype])
+        if layer.connection:
+            self.keyword(u'CONNECTION', quote(layer.connection))
+        if layer.data:
+            self.keyword(u'DATA', quote(layer.data))
+        if layer.tileindex:
+            self.keyword(u'TILEINDEX', quote(layer.tileindex))
+            self.keyword(u'TILEITEM', quote(layer.tileitem))
+
+        for directive in layer.processing:
+            self.keyword(u'PROCESSING', quote(directive))
+
+        if layer.filter:
+            self.keyword(u'FILTER', expression(layer.filter))
+        if layer.classitem:
+            self.keyword(u'CLASSITEM', quote(layer.classitem))
+        if layer.labelitem:
+            self.keyword(u'LABELITEM', quote(layer.labelitem))
+
+        if layer.opacity != 100:
+            self.keyword(u'OPACITY', number(layer.opacity))
+
+        self.keyword(u'SIZEUNITS', UNIT_NAMES[layer.sizeunits])
+
+        for msClass in layer.classes:
+            self.writeClass(msClass)
+
+        self.close(u'LAYER')
+
+    def writeClass(self, msClass):
+        self.open(u'CLASS')
+
+        if msClass.name:
+            self.keyword(u'NAME', quote(msClass.name))
+        if msClass.group:
+            self.keyword(u'GROUP', quote(msClass.group))
+        if msClass.expression:
+            self.keyword(u'EXPRESSION', expression(msClass.expression))
+        if msClass.text:
+            self.keyword(u'TEXT', expression(msClass.text))
+        if msClass.minscaledenom >= 0:
+            self.keyword(u'MINSCALEDENOM', number(msClass.minscaledenom))
+        if msClass.maxscaledenom >= 0:
+            self.keyword(u'MAXSCALEDENOM', number(msClass.maxscaledenom))
+
+        for style in msClass.styles:
+            self.writeStyle(style)
+
+        for label in msClass.labels:
+            self.writeLabel(label)
+
+        self.close(u'CLASS')
+
+    def writeStyle(self, style):
+        self.open(u'STYLE')
+
+        if style.symbolname:
+            self.keyword(u'SYMBOL', quote(style.symbolname))
+        if style.color is not None:
+            self.keyword(u'COLOR', style.color.toMapfile())
+        if style.outlinecolor is not None:
+            self.keyword(u'OUTLINECOLOR', style.outlinecolor.toMapfile())
+        if style.size >= 0:
+            self.keyword(u'SIZE', number(style.size))
+
+        self.keyword(u'WIDTH', number(style.width))
+
+        if style.angle != 0:
+            self.keyword(u'ANGLE', number(style.angle))
+        if style.gap != 0:
+            self.keyword(u'GAP', number(style.gap))
+        if style.opacity != 100:
+            self.keyword(u'OPACITY', number(style.opacity))
+        if style.offsetx != 0 or style.offsety != 0:
+            self.keyword(u'OFFSET', u'%s %s' % (number(style.offsetx), number(style.offsety)))
+
+        self.keyword(u'LINECAP', CAP_JOIN_NAMES[style.linecap])
+        self.keyword(u'LINEJOIN', CAP_JOIN_NAMES[style.linejoin])
+
+        if len(style.pattern) > 0:
+            self.keyword(u'PATTERN', u'%s END' % u' '.join(number(p) for p in style.pattern))
+
+        self.close(u'STYLE')
+
+    def writeLabel(self, label):
+        self.open(u'LABEL')
+
+        # MapServer 7 ignores TYPE, but earlier versions only use fonts with TRUETYPE labels
+        self.keyword(u'TYPE', u'TRUETYPE' if label.type == MS_TRUETYPE else u'BITMAP')
+
+        if label.encoding:
+            self.keyword(u'ENCODING', quote(label.encoding))
+        if label.font:
+            self.font(label.font)
+
+        bindings = dict((LABEL_BINDING_NAMES[b], item) for b, item in label.bindings.items())
+
+        for keyword, value in [
+            (u'SIZE', number(label.size) if label.size >= 0 else None),
+            (u'ANGLE', number(label.angle)),
+            (u'COLOR', label.color.toMapfile() if label.color is not None else None),
+            (u'OUTLINECOLOR',
+                label.outlinecolor.toMapfile() if label.outlinecolor is not None else None)
+        ]:
+            if keyword in bindings:
+                self.keyword(keyword, u'[%s]' % toText(bindings[keyword]))
+            elif value is not None:
+                self.keyword(keyword, value)
+
+        self.keyword(u'MINSIZE', number(label.minsize))
+        self.keyword(u'MAXSIZE', number(label.maxsize))
+        self.keyword(u'POSITION', POSITION_NAMES.get(label.position, u'AUTO'))
+        self.keyword(u'OFFSET', u'%s %s' % (number(label.offsetx), number(label.offsety)))
+
+        if label.wrap:
+            self.keyword(u'WRAP', quote(label.wrap))
+
+        self.keyword(u'PARTIALS', trueFalse(label.partials))
+        self.keyword(u'FORCE', trueFalse(label.force))
+        self.keyword(u'PRIORITY', number(label.priority))
+        self.keyword(u'BUFFER', number(label.buffer))
+
+        if label.minfeaturesize >= 0:
+            self.keyword(u'MINFEATURESIZE', number(label.minfeaturesize))
+
+        self.close(u'LABEL')
+
+    def writeSymbol(self, symbol):
+        self.open(u'SYMBOL')
+
+        self.keyword(u'NAME', quote(symbol.name))
+        self.keyword(u'TYPE', SYMBOL_TYPE_NAMES[symbol.type])
+
+        if symbol.filled:
+            self.keyword(u'FILLED', trueFalse(True))
+        if symbol.font:
+            self.font(symbol.font)
+        if symbol.character:
+            self.keyword(u'CHARACTER', quote(symbol.character))
+        if symbol.imagepath:
+            self.keyword(u'IMAGE', quote(symbol.imagepath))
+            self.keyword(u'ANCHORPOINT', u'%s %s' % (
+                number(symbol.anchorpointx), number(symbol.anchorpointy)
+            ))
+
+        if len(symbol.points) > 0:
+            self.open(u'POINTS')
+            for x, y in symbol.points:
+                self.line(u'%s %s' % (number(x), number(y)))
+            self.close(u'POINTS')
+
+        self.close(u'SYMBOL')
+
+    def end(self):
+        """Write the symbols and close the output file"""
+
+        # Index 0 is the default symbol MapServer provides by itself. Symbols of the layers
+        # written so far are taken from their fragments, as they may have been renamed.
+        symbols = OrderedDict()
+        fout = self.fout
+
+        try:
+            for symbol in self.msMap.symbolset.symbols[1:]:
+                if symbol.inmapfile and toText(symbol.name) not in self.fragmentSymbols:
+                    self.fout = io.StringIO()
+                    self.writeSymbol(symbol)
+                    symbols[toText(symbol.name)] = self.fout.getvalue()
+        finally:
+            self.fout = fout
+
+        symbols.update(self.fragmentSymbols)
+
+        if self.symbolsetPath:
+            MapfileUtils.mergeSymbolset(self.symbolsetPath, symbols)
+        else:
+            for text in symbols.values():
+                self.fout.write(text)
+
+        self.close(u'MAP')
+
+        self.fout.close()
+        self.fout = None
+
+
+def symbolNames(layer):
+    """List the names of the symbols the styles of a layer refer to, in order of appearance"""
+
+    names = []
+    for msClass in layer.classes:
+        for style in msClass.styles:
+            if style.symbolname and style.symbolname not in names:
+                names.append(style.symbolname)
+
+    return names
@@ -0,0 +1,142 @@
+"""Serialization of layers in a pool of worker processes
+
+    QGis layers cannot be passed between processes, so each layer is handed to a worker as the
+    XML QGis saves it to projects with. The worker rebuilds the layer, serializes it into a map
+    of its own (see: `MapfileExporter.serializeLayer()`) and sends back the mapfile text fragment
+    of the layer (see: `MapfileWriter.MapfileStream.layerFragment()`). Fragments are returned in
+    the order of the layers, and symbol names are reconciled when they are written to the
+    mapfile (see: `MapfileWriter.MapfileStream.writeFragment()`).
+
+    This needs the `BACKEND_PYTHON` backend and is meant for headless exports (see:
+    BatchExporter.py), as forking the process of QGis desktop is not safe.
+"""
+
+import locale
+import multiprocessing
+
+from PyQt4.QtCore import *
+from PyQt4.QtXml import QDomDocument
+from qgis.core import *
+
+import MapfileWriter
+import PgConnections
+import ExportContext
+
+
+class FixedLegend(object):
+    """A stand-in for `QgsLegendInterface` for a single layer whose visibility is known"""
+
+    def __init__(self, visible):
+        self.visible = visible
+
+    def isLayerVisible(self, layer):
+        return self.visible
+
+
+def initWorker(qgisPrefix):
+    """Make sure QGis is up and running in a worker process
+
+        On platforms where workers are forked, QGis is inherited from the parent process.
+    """
+
+    if QCoreApplication.instance() is not None:
+        return
+
+    # The currently applied locale affects how numbers are formatted
+    locale.setlocale(locale.LC_ALL, 'C')
+
+    QgsApplication.setPrefixPath(qgisPrefix, True)
+
+    # Keep a reference to the application around for the lifetime of the worker
+    initWorker.app = QgsApplication([], False)
+    initWorker.app.initQgis()
+
+
+def layerToXml(layer):
+    """Save a layer, including its style and labeling, to a string"""
+
+    doc = QDomDocument()
+    node = doc.createElement(u'maplayer')
+    doc.appendChild(node)
+    layer.writeLayerXML(node, doc)
+
+    return unicode(doc.toString())
+
+
+def layerFromXml(xml, layerType):
+    """Rebuild a layer saved with `layerToXml()`"""
+
+    doc = QDomDocument()
+    doc.setContent(xml)
+
+    if layerType == QgsMapLayer.RasterLayer:
+        layer = QgsRasterLayer()
+    else:
+        layer = QgsVectorLayer()
+
+    layer.readLayerXML(doc.documentElement())
+
+    return layer
+
+
+def serializeLayerJob(job):
+    """Serialize a single layer in a worker process and return its fragment
+
+        The layers a worker serializes share an export context (see: ExportContext.py), as the
+        pool of workers only lives as long as a single export.
+    """
+
+    import MapfileExporter
+
+    xml, layerType, visible, useSLD, emitFontDefinitions, pgServices, metadata, narrowColumns = job
+    layer = layerFromXml(xml, layerType)
+
+    if serializeLayerJob.context is None:
+        serializeLayerJob.context = ExportContext.ExportContext()
+
+    msMap = MapfileWriter.mapObj()
+    msLayer = MapfileExporter.serializeLayer(
+        msMap, layer, FixedLegend(visible), useSLD, emitFontDefinitions,
+        connections=PgConnections.PgConnections(pgServices), metadata=metadata,
+        context=serializeLayerJob.context, narrowColumns=narrowColumns
+    )
+
+    return MapfileWriter.MapfileStream(None, msMap).layerFragment(msLayer)
+
+serializeLayerJob.context = None
+
+
+def serializeLayers(layers, legend, useSLD, emitFontDefinitions, jobs, pgServices=None,
+        metadata=None, narrowColumns=False):
+    """Serialize layers in a pool of `jobs` worker processes
+
+        `pgServices` are the PostgreSQL service entries connections are matched against (see:
+        `PgConnections.PgConnections`). `metadata` holds the prefetched metadata of the layers by
+        layer id (see: `LayerMetadata.prefetch()`), so that workers do not read it again.
+        `narrowColumns` is handed to `MapfileExporter.serializeLayer()`.
+
+        Yields the fragments of the layers as they become available, in the order of `layers`.
+    """
+
+    if len(layers) == 0:
+        return
+
+    layerJobs = [
+        (layerToXml(layer), layer.type(), legend.isLayerVisible(layer), useSLD,
+            emitFontDefinitions, pgServices, (metadata or {}).get(layer.id()), narrowColumns)
+        for layer in layers
+    ]
+
+    pool = multiprocessing.Pool(
+        processes = max(1, min(jobs, len(layerJobs))),
+        initializer = initWorker,
+        initargs = (unicode(QgsApplication.prefixPath()),)
+    )
+
+    try:
+        # Export times vary wildly between layers, so hand them out one by one
+        for fragment in pool.imap(serializeLayerJob, layerJobs, chunksize=1):
+            yield fragment
+    finally:
+        pool.terminate()
+        pool.join()
@@ -0,0 +1,154 @@
+"""Normalization of PostGIS connection strings
+
+    MapServer keeps PostGIS connections open across layers (and with FastCGI across requests)
+    when they use the exact same CONNECTION string and CLOSE_CONNECTION=DEFER is set. QGis
+    builds connection strings per layer, with parameters in varying order and quoting, so layers
+    sharing a database often end up with different strings. `PgConnections` turns them into
+    canonical strings and optionally replaces their parameters with a pg_service.conf entry.
+
+    Nothing in here depends on QGis or mapscript.
+"""
+
+import re
+import codecs
+from collections import OrderedDict
+
+
+"""Order of the parameters in normalized connection strings, others follow alphabetically"""
+PARAMETER_ORDER = ['service', 'host', 'hostaddr', 'port', 'dbname', 'user', 'password', 'sslmode']
+
+"""Default values of parameters, which are left out of normalized connection strings"""
+PARAMETER_DEFAULTS = {'port': '5432'}
+
+"""Parameters a connection string is matched against pg_service.conf entries by"""
+SERVICE_KEYS = ['host', 'hostaddr', 'port', 'dbname', 'user']
+
+"""Processing directive keeping connections open for reuse"""
+CLOSE_CONNECTION_DEFER = 'CLOSE_CONNECTION=DEFER'
+
+CONNINFO_RX = re.compile(r"\s*(\w+)\s*=\s*(?:'((?:[^'\\]|\\.)*)'|(\S*))")
+
+
+def parseConnectionInfo(conninfo):
+    """Parse a libpq connection string into an ordered dictionary of parameters"""
+
+    params = OrderedDict()
+    pos = 0
+    conninfo = conninfo.strip()
+
+    while pos < len(conninfo):
+        m = CONNINFO_RX.match(conninfo, pos)
+        if m is None:
+            raise ValueError('Invalid connection string: %s' % conninfo)
+
+        key, quoted, plain = m.groups()
+        if quoted is not None:
+            value = re.sub(r'\\(.)', r'\1', quoted)
+        else:
+            value = plain
+
+        params[key] = value
+        pos = m.end()
+
+    return params
+
+
+def quoteValue(value):
+    if value != '' and re.match(r"^[^\s'\\]+$", value):
+        return value
+
+    return "'%s'" % value.replace('\\', '\\\\').replace("'", "\\'")
+
+
+def formatConnectionInfo(params):
+    """Format parameters into a normalized libpq connection string"""
+
+    def order(key):
+        if key in PARAMETER_ORDER:
+            return (PARAMETER_ORDER.index(key), key)
+        return (len(PARAMETER_ORDER), key)
+
+    return ' '.join(
+        '%s=%s' % (key, quoteValue(params[key])) for key in sorted(params, key=order)
+        if params[key] != '' and PARAMETER_DEFAULTS.get(key) != params[key]
+    )
+
+
+def readServiceFile(serviceFilePath):
+    """Read the entries of a pg_service.conf file into a dictionary of parameter dictionaries"""
+
+    services = OrderedDict()
+    service = None
+
+    with codecs.open(serviceFilePath, 'r', 'utf-8') as fin:
+        for line in fin:
+            line = line.strip()
+            if line == '' or line.startswith('#'):
+                continue
+
+            if line.startswith('[') and line.endswith(']'):
+                service = services.setdefault(line[1:-1].strip(), {})
+            elif '=' in line and service is not None:
+                key, value = line.split('=', 1)
+                service[key.strip()] = value.strip()
+
+    return services
+
+
+class PgConnections(object):
+    """Normalize the connection strings of the PostGIS layers of an export
+
+        If `services` (see: `readServiceFile()`) is given, connections matching one of its entries
+        refer to the entry rather than repeating its parameters. MapServer must then be able to
+        find the same service file (e.g. by setting PGSERVICEFILE in its environment).
+    """
+
+    def __init__(self, services=None):
+        self.services = services or {}
+        self.layers = {}
+
+    def findService(self, params):
+        """Return the name of the service entry matching a set of parameters, or None
+
+            An entry matches if it agrees on the parameters identifying the database and its
+            user, and does not contradict any other parameter (e.g. the password).
+        """
+
+        def value(d, key):
+            return d.get(key, PARAMETER_DEFAULTS.get(key))
+
+        for name, service in self.services.items():
+            if not any(k in service for k in SERVICE_KEYS):
+                continue
+
+            if all(value(params, k) == value(service, k) for k in SERVICE_KEYS) and \
+                    all(params.get(k, v) == v for k, v in service.items()):
+                return name
+
+        return None
+
+    def normalize(self, conninfo):
+        """Return the normalized form of a connection string and count the layer using it"""
+
+        params = parseConnectionInfo(conninfo)
+
+        if 'service' not in params:
+            name = self.findService(params)
+            if name is not None:
+                service = self.services[name]
+                params = OrderedDict(
+                    [('service', name)] +
+                    [(k, v) for k, v in params.items() if k not in service]
+                )
+
+        connection = formatConnectionInfo(params)
+        self.layers[connection] = self.layers.get(connection, 0) + 1
+
+        return connection
+
+    def summary(self):
+        """Describe how many layers share how many connections"""
+
+        return u'%d PostGIS layers use %d distinct connections' % (
+            sum(self.layers.values()), len(self.layers)
+        )
@@ -0,0 +1,117 @@
+"""Timing of the phases of an export
+
+    A `Profiler` records the wall time spent in, and the number of calls of, each phase of an
+    export, both in total and per layer:
+
+        profiler = Profiler.Profiler()
+        MapfileExporter.export(..., profiler=profiler)
+        profiler.dump('export-profile.json')
+
+    Phases are timed with the `phase()` context manager, and everything timed within `layer()`
+    is also attributed to that layer. Phases may be nested, in which case the time of the outer
+    phase includes the time of the inner ones. A callback can be passed to the profiler to follow
+    phases as they complete.
+
+    Nothing in here depends on QGis or mapscript.
+"""
+
+import time
+import json
+import codecs
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class Profiler(object):
+    """Collect the wall time and call count of export phases
+
+        `callback`, if set, is called as `callback(phase, layer, seconds)` at the end of each
+        phase, where `layer` is the name of the layer being exported or None.
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.phases = OrderedDict()
+        self.layers = OrderedDict()
+        self.currentLayer = None
+
+    @contextmanager
+    def phase(self, name):
+        """Time a phase of the export"""
+
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record(name, time.time() - start)
+
+    @contextmanager
+    def layer(self, name):
+        """Attribute everything timed within to a layer, which is timed as the `layer` phase"""
+
+        previousLayer = self.currentLayer
+        self.currentLayer = name
+
+        try:
+            with self.phase('layer'):
+                yield
+        finally:
+            self.currentLayer = previousLayer
+
+    def record(self, name, seconds):
+        """Add a measurement of a phase, taken by other means than `phase()`"""
+
+        totals = [self.phases]
+        if self.currentLayer is not None:
+            totals.append(self.layers.setdefault(self.currentLayer, OrderedDict()))
+
+        for phases in totals:
+            entry = phases.setdefault(name, {'seconds': 0.0, 'calls': 0})
+            entry['seconds'] += seconds
+            entry['calls'] += 1
+
+        if self.callback is not None:
+            self.callback(name, self.currentLayer, seconds)
+
+    def report(self):
+        """Return the measurements as a dictionary of `phases` and `layers`
+
+            Layers are listed in the order they were exported in, phases in the order they first
+            completed in.
+        """
+
+        return OrderedDict([('phases', self.phases), ('layers', self.layers)])
+
+    def dump(self, filePath):
+        """Write the measurements to a JSON file"""
+
+        with codecs.open(filePath, 'w', 'utf-8') as fout:
+            fout.write(json.dumps(self.report(), indent=2, ensure_ascii=False))
+            fout.write(u'\n')
+
+
+class NullContext(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+class NullProfiler(object):
+    """A profiler that does not measure anything, used when profiling is off"""
+
+    context = NullContext()
+
+    def phase(self, name):
+        return self.context
+
+    def layer(self, name):
+        return self.context
+
+    def record(self, name, seconds):
+        pass
+
+
+"""The profiler used when none is given"""
+NULL_PROFILER = NullProfiler()
@@ -0,0 +1,117 @@
+"""Overview pyramids for the rasters of an export
+
+    When a request covers a large part of a raster, GDAL reads the overview closest to the
+    requested resolution, if there is one, instead of decimating the full resolution data. Rasters
+    without overviews get external ones (a .ovr file next to the raster, the raster itself is
+    left untouched), built the way `gdaladdo` does. Rasters whose overviews are current are
+    skipped, and rasters are processed in parallel in a pool of worker processes.
+
+    This only needs the GDAL Python bindings, not QGis.
+"""
+
+import os
+import time
+import multiprocessing
+
+try:
+    from osgeo import gdal
+except ImportError:
+    gdal = None
+
+
+"""Resampling methods accepted by GDAL for overviews"""
+RESAMPLING_METHODS = [
+    'NEAREST', 'AVERAGE', 'GAUSS', 'CUBIC', 'CUBICSPLINE', 'LANCZOS', 'AVERAGE_MAGPHASE', 'MODE'
+]
+
+"""Default resampling method"""
+DEFAULT_RESAMPLING = 'AVERAGE'
+
+"""Overviews are added until the larger side of the smallest one fits this size, like `gdaladdo`"""
+MIN_OVERVIEW_SIZE = 256
+
+
+def isAvailable():
+    return gdal is not None
+
+
+def overviewLevels(width, height, minSize=MIN_OVERVIEW_SIZE):
+    """Return the decimation factors of the overviews of a raster: 2, 4, 8, ..."""
+
+    levels = []
+    factor = 2
+    while max(width, height) // (factor // 2) > minSize:
+        levels.append(factor)
+        factor *= 2
+
+    return levels
+
+
+def overviewsAreCurrent(rasterPath, dataset):
+    """Tell whether a raster has overviews, external ones being newer than the raster itself"""
+
+    if dataset.RasterCount == 0 or dataset.GetRasterBand(1).GetOverviewCount() == 0:
+        return False
+
+    ovrPath = rasterPath + '.ovr'
+    if os.path.isfile(ovrPath):
+        return os.path.getmtime(ovrPath) >= os.path.getmtime(rasterPath)
+
+    # Internal overviews are as current as the raster they are part of
+    return True
+
+
+def buildOverviews(job):
+    """Build the overviews of a single raster if needed
+
+        Returns a `(rasterPath, built, seconds, error)` tuple, where `error` is None on success.
+    """
+
+    rasterPath, resampling = job
+    start = time.time()
+
+    dataset = gdal.Open(rasterPath, gdal.GA_ReadOnly)
+    if dataset is None:
+        return (rasterPath, False, 0, gdal.GetLastErrorMsg() or 'Unable to open raster')
+
+    try:
+        if overviewsAreCurrent(rasterPath, dataset):
+            return (rasterPath, False, 0, None)
+
+        levels = overviewLevels(dataset.RasterXSize, dataset.RasterYSize)
+        if len(levels) == 0:
+            return (rasterPath, False, 0, None)
+
+        # Opened read only, so the overviews go to an external .ovr file
+        if dataset.BuildOverviews(resampling, levels) != 0:
+            return (rasterPath, False, 0, gdal.GetLastErrorMsg() or 'Unable to build overviews')
+
+    finally:
+        dataset = None
+
+    return (rasterPath, True, time.time() - start, None)
+
+
+def buildAllOverviews(rasterPaths, resampling=DEFAULT_RESAMPLING, jobs=1):
+    """Build the missing overviews of a set of rasters with `jobs` worker processes
+
+        Yields the results of `buildOverviews()` as they come.
+    """
+
+    if resampling.upper() not in RESAMPLING_METHODS:
+        raise ValueError('Unknown resampling method: %s' % resampling)
+
+    overviewJobs = [(p, resampling.upper()) for p in rasterPaths]
+
+    if jobs <= 1 or len(overviewJobs) <= 1:
+        for job in overviewJobs:
+            yield buildOverviews(job)
+        return
+
+    pool = multiprocessing.Pool(processes = min(jobs, len(overviewJobs)))
+    try:
+        for result in pool.imap_unordered(buildOverviews, overviewJobs, chunksize=1):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+
+"""Per-layer render times of exported mapfiles
+
+    Usage:
+        python2 RenderProfiler.py [-s SCALES] [-g N] [-r N] [-o report.json] mapfile.map
+
+    Loads a mapfile with mapscript and renders a grid of N x N extents, spread over the extent of
+    the map, at each of the given scale denominators. Layers are timed one at a time by turning
+    all the others off, and the time it takes to draw the map with no layers at all is taken off
+    each measurement. The most expensive layers, and layer/scale pairs, are printed along with
+    the number of classes and styles of each layer:
+
+        python2 RenderProfiler.py -s 5000,50000,500000 -g 3 test/test.map
+
+    Layers outside of their scale range are measured as well, which tells how cheap skipping
+    them is. Mapfiles written by `MapfileExporter.export()` can be profiled as they are, as long
+    as the files they refer to (data, FONTSET, SYMBOLSET, ...) can be found.
+
+    Everything but `profileMap()` and `main()` is independent of mapscript.
+"""
+
+import os
+import sys
+import json
+import time
+import codecs
+from collections import OrderedDict
+from optparse import OptionParser
+
+# Allow running this file directly from the plugin directory
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from MapfileWriter import MS_OFF, MS_ON
+from ScaleBands import INCHES_PER_UNIT, DEFAULT_RESOLUTION
+
+
+"""Default scale denominators to render at"""
+DEFAULT_SCALES = [1000, 10000, 100000, 1000000]
+
+"""Default number of rows and columns of extents rendered at each scale"""
+DEFAULT_GRID = 3
+
+"""Default number of times each extent is rendered, the fastest time is kept"""
+DEFAULT_REPEAT = 3
+
+"""Image size used for mapfiles without a SIZE, in pixels"""
+DEFAULT_SIZE = (512, 512)
+
+"""Default number of entries of the printed rankings"""
+DEFAULT_TOP = 10
+
+
+def scaleExtent(x, y, scale, width, height, units, resolution=DEFAULT_RESOLUTION):
+    """Return the extent of an image of `width` x `height` pixels centered on `(x, y)` at `scale`
+
+        The extent is the one MapServer computes `scale` from (see: msCalculateScale() in
+        mapscale.c), as a `(minx, miny, maxx, maxy)` tuple.
+    """
+
+    if units not in INCHES_PER_UNIT:
+        raise ValueError('Unsupported map units: %s' % units)
+
+    unitsPerPixel = float(scale) / (resolution * INCHES_PER_UNIT[units])
+    halfWidth = unitsPerPixel * (width - 1) / 2.0
+    halfHeight = unitsPerPixel * (height - 1) / 2.0
+
+    return (x - halfWidth, y - halfHeight, x + halfWidth, y + halfHeight)
+
+
+def gridExtents(extent, scale, grid, width, height, units, resolution=DEFAULT_RESOLUTION):
+    """Return the extents rendered at `scale`: `grid` x `grid` extents centered on the cells of a
+    regular grid over `extent`, row by row"""
+
+    minx, miny, maxx, maxy = extent
+    cellWidth = (maxx - minx) / float(grid)
+    cellHeight = (maxy - miny) / float(grid)
+
+    return [
+        scaleExtent(
+            minx + (col + 0.5) * cellWidth, maxy - (row + 0.5) * cellHeight,
+            scale, width, height, units, resolution
+        )
+        for row in range(grid)
+        for col in range(grid)
+    ]
+
+
+def layerCounts(msLayer):
+    """Return the number of classes and styles of a layer"""
+
+    styles = sum(msLayer.getClass(i).numstyles for i in range(msLayer.numclasses))
+    return msLayer.numclasses, styles
+
+
+class RenderProfile(object):
+    """Render times of the layers of a map, by scale"""
+
+    def __init__(self):
+        self.layers = OrderedDict()
+        self.times = OrderedDict()
+
+    def addLayer(self, name, classes, styles):
+        self.layers[name] = {'classes': classes, 'styles': styles}
+        self.times[name] = OrderedDict()
+
+    def record(self, layer, scale, seconds):
+        """Add the time it took to render an extent of `layer` at `scale`"""
+
+        entry = self.times[layer].setdefault(scale, {'seconds': 0.0, 'renders': 0})
+        entry['seconds'] += seconds
+        entry['renders'] += 1
+
+    def rankedLayers(self):
+        """Return `(layer, seconds)` pairs, from the most to the least expensive layer
+
+            `seconds` is the average time a layer takes to render an extent, over all scales.
+        """
+
+        totals = []
+        for layer, scales in self.times.items():
+            renders = sum(e['renders'] for e in scales.values())
+            seconds = sum(e['seconds'] for e in scales.values())
+            totals.append((layer, seconds / renders if renders else 0.0))
+
+        return sorted(totals, key=lambda t: -t[1])
+
+    def rankedScales(self):
+        """Return `(layer, scale, seconds)` tuples, from the most to the least expensive
+
+            `seconds` is the average time a layer takes to render an extent at `scale`.
+        """
+
+        entries = [
+            (layer, scale, e['seconds'] / e['renders'])
+            for layer, scales in self.times.items()
+            for scale, e in scales.items()
+            if e['renders'] > 0
+        ]
+
+        return sorted(entries, key=lambda t: -t[2])
+
+    def report(self):
+        """Return the measurements and rankings as a dictionary"""
+
+        return OrderedDict([
+            ('layers', OrderedDict(
+                (layer, OrderedDict([
+                    ('seconds', seconds),
+                    ('classes', self.layers[layer]['classes']),
+                    ('styles', self.layers[layer]['styles']),
+                    ('scales', OrderedDict(
+                        (str(scale), e['seconds'] / e['renders'])
+                        for scale, e in self.times[layer].items()
+                    ))
+                ]))
+                for layer, seconds in self.rankedLayers()
+            )),
+            ('scales', [
+                OrderedDict([('layer', layer), ('scale', scale), ('seconds', seconds)])
+                for layer, scale, seconds in self.rankedScales()
+            ])
+        ])
+
+    def dump(self, filePath):
+        """Write the report to a JSON file"""
+
+        with codecs.open(filePath, 'w', 'utf-8') as fout:
+            fout.write(json.dumps(self.report(), indent=2, ensure_ascii=False))
+            fout.write(u'\n')
+
+    def format(self, top=DEFAULT_TOP):
+        """Return the rankings as text, limited to `top` entries each"""
+
+        lines = [u'Most expensive layers (ms per render, classes, styles):']
+        for layer, seconds in self.rankedLayers()[:top]:
+            lines.append(u'  %10.2f  %4d  %4d  %s' % (
+                seconds * 1000, self.layers[layer]['classes'], self.layers[layer]['styles'],
+                layer
+            ))
+
+        lines.append(u'Most expensive layers and scales (ms per render, scale):')
+        for layer, scale, seconds in self.rankedScales()[:top]:
+            lines.append(u'  %10.2f  1:%-10s  %s' % (seconds * 1000, scale, layer))
+
+        return u'\n'.join(lines)
+
+
+def renderTime(msMap, extent, repeat):
+    """Return the fastest of `repeat` renderings of an extent of a map"""
+
+    msMap.setExtent(*extent)
+
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        msMap.draw()
+        seconds = time.time() - start
+
+        if best is None or seconds < best:
+            best = seconds
+
+    return best
+
+
+def profileMap(msMap, scales=DEFAULT_SCALES, grid=DEFAULT_GRID, repeat=DEFAULT_REPEAT):
+    """Time the layers of a `mapscript.mapObj` one by one, return a `RenderProfile`"""
+
+    if msMap.width <= 0 or msMap.height <= 0:
+        msMap.setSize(*DEFAULT_SIZE)
+
+    mapExtent = (msMap.extent.minx, msMap.extent.miny, msMap.extent.maxx, msMap.extent.maxy)
+    layers = [msMap.getLayer(i) for i in range(msMap.numlayers)]
+    statuses = [l.status for l in layers]
+
+    profile = RenderProfile()
+    for msLayer in layers:
+        profile.addLayer(msLayer.name, *layerCounts(msLayer))
+
+    try:
+        for msLayer in layers:
+            msLayer.status = MS_OFF
+
+        for scale in scales:
+            extents = gridExtents(
+                mapExtent, scale, grid, msMap.width, msMap.height, msMap.units,
+                msMap.resolution
+            )
+
+            for extent in extents:
+                # What drawing any map takes: the image itself, the labels, ...
+                baseline = renderTime(msMap, extent, repeat)
+
+                for msLayer in layers:
+                    msLayer.status = MS_ON
+                    try:
+                        seconds = renderTime(msMap, extent, repeat)
+                    finally:
+                        msLayer.status = MS_OFF
+
+                    profile.record(msLayer.name, scale, max(0.0, seconds - baseline))
+    finally:
+        for msLayer, status in zip(layers, statuses):
+            msLayer.status = status
+
+    return profile
+
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog [options] MAPFILE')
+    parser.add_option('-s', '--scales', metavar='LIST',
+            default=','.join(str(s) for s in DEFAULT_SCALES),
+            help='comma-separated scale denominators to render at [default: %default]')
+    parser.add_option('-g', '--grid', type='int', default=DEFAULT_GRID, metavar='N',
+            help='render N x N extents at each scale [default: %default]')
+    parser.add_option('-r', '--repeat', type='int', default=DEFAULT_REPEAT, metavar='N',
+            help='render each extent N times and keep the fastest [default: %default]')
+    parser.add_option('-t', '--top', type='int', default=DEFAULT_TOP, metavar='N',
+            help='number of entries of the printed rankings [default: %default]')
+    parser.add_option('-o', '--output', metavar='FILE',
+            help='also write the full report to a JSON file')
+
+    opts, args = parser.parse_args(argv)
+
+    if len(args) != 1:
+        parser.error('A single mapfile is expected.')
+
+    try:
+        scales = [
+            int(s) if s.strip().isdigit() else float(s)
+            for s in opts.scales.split(',') if s.strip() != ''
+        ]
+    except ValueError:
+        parser.error('Invalid scale denominators: %s' % opts.scales)
+
+    import mapscript
+
+    # Paths in the mapfile are relative to it
+    mapfilePath = os.path.abspath(args[0])
+    msMap = mapscript.mapObj(mapfilePath)
+
+    profile = profileMap(msMap, scales, opts.grid, opts.repeat)
+
+    print profile.format(opts.top).encode('utf-8')
+
+    if opts.output:
+        profile.dump(opts.output)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
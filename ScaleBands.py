@@ -0,0 +1,72 @@
+"""Scale ranges of the generalized copies of a layer
+
+    A copy of a layer simplified with a given tolerance looks the same as the original as long as
+    the tolerance is smaller than a pixel. Every copy is therefore drawn from the scale at which
+    its tolerance shrinks to `TOLERANCE_PIXELS` pixels, up to the scale at which the next, coarser
+    copy takes over. Scales are computed the way MapServer does (see: msCalculateScale() in
+    mapscale.c), so that the bands can be used as MINSCALEDENOM / MAXSCALEDENOM right away.
+
+    Nothing in here depends on QGis or mapscript.
+"""
+
+from MapfileWriter import MS_INCHES, MS_FEET, MS_MILES, MS_METERS, MS_KILOMETERS, MS_DD, \
+        MS_NAUTICALMILES
+
+
+"""Inches per map unit, as in mapscale.c"""
+INCHES_PER_UNIT = {
+    MS_INCHES: 1.0,
+    MS_FEET: 12.0,
+    MS_MILES: 63360.0,
+    MS_METERS: 39.3701,
+    MS_KILOMETERS: 39370.1,
+    MS_DD: 4374754.0,
+    MS_NAUTICALMILES: 72913.3858
+}
+
+"""Default resolution of MapServer, in pixels per inch"""
+DEFAULT_RESOLUTION = 72.0
+
+"""Size, in pixels, below which the detail dropped by a simplification goes unnoticed"""
+TOLERANCE_PIXELS = 1.0
+
+
+def toleranceScale(tolerance, units, resolution=DEFAULT_RESOLUTION):
+    """Return the scale denominator from which a tolerance, in map units, is small enough"""
+
+    if units not in INCHES_PER_UNIT:
+        raise ValueError('Unsupported map units: %s' % units)
+
+    return tolerance * INCHES_PER_UNIT[units] * resolution / TOLERANCE_PIXELS
+
+
+def scaleBands(tolerances, units, minScale=-1, maxScale=-1, resolution=DEFAULT_RESOLUTION):
+    """Split the scale range of a layer between its full resolution data and simplified copies
+
+        `tolerances` are those of the simplified copies, in map units. `minScale` and `maxScale`
+        restrict the bands to the scale range of the layer itself, -1 meaning no limit.
+
+        Returns a list of `(tolerance, minscaledenom, maxscaledenom)` tuples, from the finest to
+        the coarsest, where a tolerance of 0 stands for the full resolution data and -1 for no
+        limit. Bands outside of the scale range of the layer are left out.
+    """
+
+    tolerances = sorted(set(t for t in tolerances if t > 0))
+    scales = [toleranceScale(t, units, resolution) for t in tolerances]
+
+    lows = [-1] + scales
+    highs = scales + [-1]
+
+    bands = []
+    for tolerance, low, high in zip([0] + tolerances, lows, highs):
+        if minScale >= 0 and (low < 0 or low < minScale):
+            low = minScale
+        if maxScale >= 0 and (high < 0 or high > maxScale):
+            high = maxScale
+
+        if low >= 0 and high >= 0 and low >= high:
+            continue
+
+        bands.append((tolerance, low, high))
+
+    return bands
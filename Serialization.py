@@ -1,60 +1,108 @@
-import mapscript
-
 from PyQt4.QtCore import *
 from PyQt4.QtGui import *
+from PyQt4.QtXml import QDomDocument
 from qgis.core import *
 from qgis.gui import *
 
 import SerializationUtils as utils
+import ClassCompiler
+import ExpressionCompiler
+from SerializationUtils import mapscript
+from ExportContext import ExportContext
 
 class SLDSerializer(object):
-    def __init__(self, layer, msLayer, msMap):
+    def __init__(self, layer, msLayer, msMap, context=None):
+        """Apply the style of a QGis vector layer to a mapscript layer through SLD
 
-        # Create a temporary .SLD file
-        tempSldFile = QTemporaryFile("rt_mapserver_exporter-XXXXXX.sld")
-        tempSldFile.open()
-        tempSldPath = tempSldFile.fileName()
-        tempSldFile.close()
-        
-        # Export the QGIS layer style to the .SLD file
-        errMsg, ok = layer.saveSldStyle( tempSldPath )
+            The SLD document is generated in memory. Parsing it with `applySLD()` is slow for
+            large rule sets, so the classes it yields are kept by map, under a hash of the style
+            of the layer (see: `utils.styleKey()`), and copied to the layers styled the same way.
+        """
 
-        if not ok:
-            QgsMessageLog.logMessage( errMsg, "RT MapServer Exporter" )
-        else:
-            #Set the mapserver layer style from the SLD file
-            
-            with open( unicode(tempSldPath), 'r' ) as fin:
-                sldContents = fin.read()
+        profiler = (context or ExportContext()).profiler
 
-            if mapscript.MS_SUCCESS != msLayer.applySLD( sldContents, msLayer.name ):
-                QgsMessageLog.logMessage(
-                    u"Something went wrong applying the SLD style to the layer '%s'" % msLayer.name,
-                    "RT MapServer Exporter"
-                )
+        if not hasattr(msMap, 'sldStyles'):
+            msMap.sldStyles = {}
+
+        key = utils.styleKey(layer)
+
+        if key in msMap.sldStyles:
+            with profiler.phase('sld.reuse'):
+                self.copyStyle(msMap.sldStyles[key], msLayer)
+            return
+
+        # Export the QGIS layer style to an SLD document
+        with profiler.phase('sld.save'):
+            sldDocument = QDomDocument()
+            layer.exportSldStyle(sldDocument, u'')
+
+        if sldDocument.documentElement().isNull():
+            QgsMessageLog.logMessage(
+                u"Unable to export the style of the layer '%s' to SLD" % layer.name(),
+                "RT MapServer Exporter"
+            )
+            return
+
+        # Set the mapserver layer style from the SLD document
+        with profiler.phase('sld.apply'):
+            applied = msLayer.applySLD(
+                unicode(sldDocument.toString()).encode('utf-8'), msLayer.name
+            )
+
+        if mapscript.MS_SUCCESS != applied:
+            QgsMessageLog.logMessage(
+                u"Something went wrong applying the SLD style to the layer '%s'" % msLayer.name,
+                "RT MapServer Exporter"
+            )
+            return
+
+        msMap.sldStyles[key] = (
+            [msLayer.getClass(i).clone() for i in range(msLayer.numclasses)],
+            msLayer.classitem,
+            msLayer.labelitem
+        )
 
-            QFile.remove( tempSldPath )
+    def copyStyle(self, style, msLayer):
+        """Give a layer the classes (and items) an SLD document yielded for another layer"""
+
+        classes, classitem, labelitem = style
+
+        # Layers own their classes, every layer gets copies of its own
+        for msClass in classes:
+            msLayer.insertClass(msClass.clone())
+
+        if classitem:
+            msLayer.classitem = classitem
+        if labelitem:
+            msLayer.labelitem = labelitem
 
 class LabelStyleSerializer(object):
-    def __init__(self, layer, msLayer, msMap, emitFontDefinitions=False):
+    def __init__(self, layer, msLayer, msMap, emitFontDefinitions=False, context=None):
         """Serialize labels of a QGis vector layer to mapscript"""
 
         self.layer = layer
         self.msLayer = msLayer
         self.msMap = msMap
+        self.ms = utils.backendFor(msMap)
+        self.context = context or ExportContext()
 
-        labelingEngine = QgsPalLabeling()
-        labelingEngine.loadEngineSettings()
+        labelingEngine = self.context.labelingEngine()
 
         if labelingEngine and labelingEngine.willUseLayer(self.layer):
             ps = QgsPalLayerSettings.fromLayer(self.layer)
 
+            # Label text: an attribute, or a string expression set as the TEXT of the classes
+            text = None
             if not ps.isExpression:
                 self.msLayer.labelitem = unicode(ps.fieldName).encode('utf-8')
             else:
-                pass
+                try:
+                    text = self.serializeLabelExpression(unicode(ps.fieldName))
+                except ExpressionCompiler.ExpressionCompileError as e:
+                    utils.warnUntranslatable(self.layer, u'labels skipped', ps.fieldName, e)
+                    return
 
-            msLabel = mapscript.labelObj()
+            msLabel = self.ms.labelObj()
 
             msLabel.type = mapscript.MS_TRUETYPE
             msLabel.encoding = 'utf-8'
@@ -78,7 +126,7 @@ class LabelStyleSerializer(object):
             if ps.scaleMax > 0:
                 self.msLayer.labelmaxscaledenom = ps.scaleMax
 
-            fontDef, msLabel.size = utils.serializeFontDefinition(ps.textFont, ps.textNamedStyle)
+            fontDef, msLabel.size = self.context.fontDefinition(ps.textFont, ps.textNamedStyle)
 
             # `emitFontDefinitions` gets set based on whether a fontset path is supplied through 
             # the plugin UI. There is no point in emitting font definitions without a valid fontset,
@@ -89,10 +137,12 @@ class LabelStyleSerializer(object):
                 msLabel.font = fontDef
 
             if ps.fontSizeInMapUnits:
-                utils.maybeSetLayerSizeUnitFromMap(QgsSymbolV2.MapUnit, self.msLayer)
+                utils.maybeSetLayerSizeUnitFromMap(
+                    QgsSymbolV2.MapUnit, self.msLayer, self.context.mapUnits()
+                )
 
             # Font size and color
-            msLabel.color = utils.serializeColor(ps.textColor)
+            msLabel.color = utils.serializeColor(ps.textColor, self.ms)
 
             if ps.fontLimitPixelSize:
                 msLabel.minsize = ps.fontMinPixelSize
@@ -127,21 +177,41 @@ class LabelStyleSerializer(object):
             # if no classes exist.
             #
           
-            if msLayer.numclasses > 0:
-                for c in range(0, msLayer.numclasses):
-                    msLayer.getClass(c).addLabel(msLabel)
-            else:
-                mapscript.classObj(msLayer).addLabel(msLabel)
+            if msLayer.numclasses == 0:
+                self.ms.classObj(msLayer)
+
+            for c in range(0, msLayer.numclasses):
+                msLayer.getClass(c).addLabel(msLabel)
+                if text is not None:
+                    msLayer.getClass(c).setText(text.encode('utf-8'))
+
+
+    def serializeLabelExpression(self, expression):
+        """Translate a label expression into a MapServer string expression, return None when it
+        is a plain attribute, which becomes the LABELITEM of the layer instead"""
+
+        tree = utils.expressionTree(expression)
+        if tree[0] == u'column':
+            self.msLayer.labelitem = tree[1].encode('utf-8')
+            return None
+
+        return ExpressionCompiler.toMapServerString(tree, utils.stringColumns(self.layer))
 
 
             
 class VectorLayerStyleSerializer(object):
-    def __init__(self, rctx, layer, msLayer, msMap):
+    def __init__(self, layer, msLayer, msMap, context=None):
         """Serialize a QGis vector layer renderer into mapscript classes"""
 
+        self.layer = layer
         self.msLayer = msLayer
         self.msMap = msMap
-        self.rctx = rctx
+        self.ms = utils.backendFor(msMap)
+        self.context = context or ExportContext()
+        self.rctx = self.context.renderContext()
+
+        # Condition shared by all the classes, left to the layer (see: LayerFilterSerializer)
+        self.layerFilter = None
 
         # Set the size units to pixels here as that seems to be the most roboust
         # and independent of map units
@@ -159,6 +229,9 @@ class VectorLayerStyleSerializer(object):
         elif isinstance(renderer, QgsGraduatedSymbolRendererV2):
             self.serializeGraduatedSymbolRenderer(renderer)
 
+        elif isinstance(renderer, QgsRuleBasedRendererV2):
+            self.serializeRuleBasedRenderer(renderer)
+
         else:
             QgsMessageLog.logMessage(
                 'Unhandled renderer type: %s' % type(renderer),
@@ -169,65 +242,239 @@ class VectorLayerStyleSerializer(object):
     def serializeSingleSymbolRenderer(self, renderer):
         """Serialize a QGis single symbol renderer into a MapServer class"""
 
-        msClass = mapscript.classObj(self.msLayer)
+        msClass = self.ms.classObj(self.msLayer)
 
         for sym in renderer.symbols():
-            SymbolLayerSerializer(sym, msClass, self.msLayer, self.msMap)
+            SymbolLayerSerializer(sym, msClass, self.msLayer, self.msMap, self.context)
 
 
     def serializeCategorizedSymbolRenderer(self, renderer):
         """Serialize a QGis categorized symbol renderer into MapServer classes"""
 
-        attr = renderer.usedAttributes()[0]
-        i = 0
-
-        for cat in renderer.categories():
-            msClass = mapscript.classObj(self.msLayer)
+        attr = unicode(renderer.usedAttributes()[0])
+        symbols = renderer.symbols()
 
+        categories = []
+        for cat, sym in zip(renderer.categories(), symbols):
             # XXX: type(cat.value()) differs whether the script is being run in QGis or as 
-            # a standalone PyQGis application, so we convert it accordingly.
+            # a standalone PyQGis application, so we convert it accordingly. NULL values stand
+            # for "all other values".
             cv = cat.value()
-            cv = cv.toString() if isinstance(cv, QVariant) else unicode(cv)
+            if isinstance(cv, QVariant):
+                cv = cv.toString()
+            elif cv is None:
+                cv = u''
 
-            msClass.setExpression((u'("[%s]" = "%s")' % (attr, cv)).encode('utf-8'))
-            SymbolLayerSerializer(renderer.symbols()[i], msClass, self.msLayer, self.msMap)
-            #add number to class name
-            msClass.name+='_'+str(i)
-            i = i + 1
+            categories.append((unicode(cv), utils.symbolKey(sym)))
+
+        classes, usesClassItem = ClassCompiler.compileCategories(
+            attr, categories, self.fieldType(attr)
+        )
+        if usesClassItem:
+            self.msLayer.classitem = attr.encode('utf-8')
+
+        self.serializeClasses(classes, symbols)
 
 
     def serializeGraduatedSymbolRenderer(self, renderer):
         """Serialize a QGis graduated symbol renderer into MapServer classes"""
 
         attr = unicode(renderer.usedAttributes()[0])
-        i = 0
-
-        for range in renderer.ranges():
-            msClass = mapscript.classObj(self.msLayer)
-
-            # We use '>=' instead of '>' when defining the first class to also include the lowest
-            # value of the range in the expression.
-            msClass.setExpression((u'(([%s] %s %f) And ([%s] <= %f))' % ( \
-                attr, \
-                '>=' if (i == 0) else '>', \
-                range.lowerValue(), \
-                attr, \
-                range.upperValue() \
-            )).encode('utf-8'))
-            SymbolLayerSerializer(renderer.symbols()[i], msClass, self.msLayer, self.msMap)
+        symbols = renderer.symbols()
+
+        ranges = [
+            (range.lowerValue(), range.upperValue(), utils.symbolKey(sym))
+            for range, sym in zip(renderer.ranges(), symbols)
+        ]
+
+        self.serializeClasses(ClassCompiler.compileRanges(attr, ranges), symbols)
+
+
+    def serializeRuleBasedRenderer(self, renderer):
+        """Serialize a QGis rule-based renderer into MapServer classes"""
+
+        symbols = []
+        rules = [
+            r for r in (self.compileRule(rule, symbols) for rule in renderer.rootRule().children())
+            if r is not None
+        ]
+
+        stringColumns = utils.stringColumns(self.layer)
+        self.layerFilter, (minScale, maxScale), classes = ClassCompiler.compileRules(
+            rules, stringColumns
+        )
+
+        # Classes only ever narrow the scale range of the layer
+        if minScale > 0 and minScale > self.msLayer.minscaledenom:
+            self.msLayer.minscaledenom = minScale
+        if maxScale > 0 and not 0 < self.msLayer.maxscaledenom <= maxScale:
+            self.msLayer.maxscaledenom = maxScale
+
+        for i, (tree, minScale, maxScale, indices) in enumerate(classes):
+            try:
+                expression = ExpressionCompiler.toMapServer(tree, stringColumns) \
+                        if tree is not None else None
+            except ExpressionCompiler.ExpressionCompileError as e:
+                utils.warnUntranslatable(
+                    self.layer, u'class %d skipped' % i, ExpressionCompiler.describe(tree), e
+                )
+                continue
+
+            msClass = self.ms.classObj(self.msLayer)
+
+            if expression is not None:
+                msClass.setExpression(expression.encode('utf-8'))
+            if minScale > 0:
+                msClass.minscaledenom = minScale
+            if maxScale > 0:
+                msClass.maxscaledenom = maxScale
+
+            for index in indices:
+                SymbolLayerSerializer(
+                    symbols[index], msClass, self.msLayer, self.msMap, self.context
+                )
+            msClass.name += '_' + str(i)
+
+
+    def compileRule(self, rule, symbols):
+        """Convert a rule and its children for `ClassCompiler.compileRules()`, None for rules
+        which are not active or whose filter cannot be translated
+
+            The symbols of the rules are appended to `symbols`, rules refer to them by index.
+        """
+
+        if not rule.active():
+            return None
+
+        tree = None
+        if not rule.isElse() and rule.filterExpression():
+            try:
+                tree = utils.expressionTree(unicode(rule.filterExpression()))
+            except ExpressionCompiler.ExpressionCompileError as e:
+                utils.warnUntranslatable(
+                    self.layer, u'rule "%s" skipped' % rule.label(), rule.filterExpression(), e
+                )
+                return None
+
+        symbol = None
+        if rule.symbol() is not None:
+            symbol = len(symbols)
+            symbols.append(rule.symbol())
+
+        children = [
+            r for r in (self.compileRule(child, symbols) for child in rule.children())
+            if r is not None
+        ]
+
+        return (
+            tree, rule.scaleMinDenom(), rule.scaleMaxDenom(), rule.isElse(), symbol, children
+        )
+
+
+    def fieldType(self, attr):
+        """Return the type of an attribute of the layer (see: ClassCompiler.py)"""
+
+        fields = self.layer.pendingFields()
+        index = fields.indexFromName(attr)
+        if index < 0:
+            return ClassCompiler.FIELD_STRING
+
+        fieldType = fields[index].type()
+        if fieldType in (QVariant.Int, QVariant.UInt, QVariant.LongLong, QVariant.ULongLong):
+            return ClassCompiler.FIELD_INTEGER
+        if fieldType == QVariant.Double:
+            return ClassCompiler.FIELD_REAL
+
+        return ClassCompiler.FIELD_STRING
+
+
+    def serializeClasses(self, classes, symbols):
+        """Serialize compiled classes (see: ClassCompiler.py), each with the symbol of its first
+        category or range"""
+
+        for expression, indices in classes:
+            msClass = self.ms.classObj(self.msLayer)
+
+            if expression is not None:
+                msClass.setExpression(expression.encode('utf-8'))
+
+            SymbolLayerSerializer(
+                symbols[indices[0]], msClass, self.msLayer, self.msMap, self.context
+            )
             #add number to class name
-            msClass.name+='_'+str(i)
-            i = i + 1
+            msClass.name+='_'+str(indices[0])
+
+
+
+class LayerFilterSerializer(object):
+    def __init__(self, layer, msLayer, msMap, conditions=None, context=None):
+        """Serialize the subset string of a QGis vector layer into a filter, along with the
+        conditions shared by all its classes (see: `VectorLayerStyleSerializer.layerFilter`)
+
+            Filters of PostGIS layers are pushed down to the database: `sql` is the condition to
+            add to the DATA of the layer, None for none. Other layers get a MapServer FILTER, and
+            so do conditions PostgreSQL has no equivalent for. `columns` are the attributes the
+            MapServer FILTER refers to.
+        """
+
+        self.layer = layer
+        self.msLayer = msLayer
+        self.msMap = msMap
+        self.context = context or ExportContext()
+        self.sql = None
+        self.columns = set()
+
+        trees = []
+
+        if layer.providerType() == 'postgres':
+            # The subset string of PostGIS layers is SQL already
+            uri = QgsDataSourceURI(layer.source())
+            sql = [unicode(uri.sql())] if uri.sql() != '' else []
+
+            if conditions is not None:
+                try:
+                    sql.append(ExpressionCompiler.toSql(conditions, utils.stringColumns(layer)))
+                except ExpressionCompiler.ExpressionCompileError:
+                    trees.append(conditions)
+
+            if len(sql) > 0:
+                self.sql = sql[0] if len(sql) == 1 else u' AND '.join(u'(%s)' % s for s in sql)
+
+        else:
+            subset = unicode(layer.subsetString())
+            if subset != u'':
+                try:
+                    trees.append(utils.expressionTree(subset))
+                except ExpressionCompiler.ExpressionCompileError as e:
+                    utils.warnUntranslatable(layer, u'exported unfiltered', subset, e)
+
+            if conditions is not None:
+                trees.append(conditions)
+
+        if len(trees) > 0:
+            tree = ExpressionCompiler.conjunction(trees)
+            try:
+                msLayer.setFilter(ExpressionCompiler.toMapServer(
+                    tree, utils.stringColumns(layer)
+                ).encode('utf-8'))
+                self.columns = ExpressionCompiler.columns(tree)
+            except ExpressionCompiler.ExpressionCompileError as e:
+                utils.warnUntranslatable(
+                    layer, u'exported unfiltered', ExpressionCompiler.describe(tree), e
+                )
 
 
 
 class SymbolLayerSerializer(object):
-    def __init__(self, sym, msClass, msLayer, msMap):
+    def __init__(self, sym, msClass, msLayer, msMap, context=None):
         """Serialize a QGis symbol layer into a MapServer style"""
         
         self.msClass = msClass
         self.msLayer = msLayer
         self.msMap = msMap
+        self.ms = utils.backendFor(msMap)
+        self.context = context or ExportContext()
+        self.profiler = self.context.profiler
         msClass.name=msLayer.name
         for i in range(0, sym.symbolLayerCount()):
             sl = sym.symbolLayer(i)
@@ -265,7 +512,7 @@ class SymbolLayerSerializer(object):
     def serializeSimpleLineSymbolLayer(self, sl, hatchProperties=None):
         """Serialize a QGis simple line symbol layer into a MapServer style"""
 
-        msStyle = mapscript.styleObj(self.msClass);
+        msStyle = self.ms.styleObj(self.msClass);
 
         # Line cap and line join
         msStyle.linecap = utils.serializePenCapStyle(sl.penCapStyle())
@@ -277,9 +524,9 @@ class SymbolLayerSerializer(object):
             msStyle.symbolname = utils.serializeHatchSymbol(self.msMap) 
             msStyle.size = hatchProperties['size']
             msStyle.angle = hatchProperties['angle']
-            msStyle.color = utils.serializeColor(sl.color())
+            msStyle.color = utils.serializeColor(sl.color(), self.ms)
         else:
-            msStyle.color = utils.serializeColor(sl.color())
+            msStyle.color = utils.serializeColor(sl.color(), self.ms)
        
         # Emit line pattern only if we have a non-solid pen
         if sl.penStyle() != Qt.NoPen and sl.penStyle() != Qt.SolidLine:
@@ -293,21 +540,23 @@ class SymbolLayerSerializer(object):
         # if we are using map units in QGis. This breaks every property with a size unit set to
         # anything other than the map unit.
         if (sl.width() > 0) and (hatchProperties == None):
-            utils.maybeSetLayerSizeUnitFromMap(sl.widthUnit(), self.msLayer)
+            utils.maybeSetLayerSizeUnitFromMap(
+                sl.widthUnit(), self.msLayer, self.context.mapUnits()
+            )
 
 
     def serializeSimpleFillSymbolLayer(self, sl):
         """Serialize a QGis simple fill symbol layer into MapServer styles"""
 
-        msStyleBg = mapscript.styleObj(self.msClass)
+        msStyleBg = self.ms.styleObj(self.msClass)
         msStyleBg.angle = sl.angle()
-        msStyleBg.color = utils.serializeColor(sl.fillColor())
+        msStyleBg.color = utils.serializeColor(sl.fillColor(), self.ms)
         msStyleBg.opacity = int((sl.fillColor().alpha() / 255.0) * 100)
 
         # Only serialize outline if we have one
         if sl.borderStyle() != Qt.NoPen:
-            msStyleOutline = mapscript.styleObj(self.msClass)
-            msStyleOutline.outlinecolor = utils.serializeColor(sl.borderColor())
+            msStyleOutline = self.ms.styleObj(self.msClass)
+            msStyleOutline.outlinecolor = utils.serializeColor(sl.borderColor(), self.ms)
 
             # QGis draws a default outline of .26mm (roughly 1px) even when the width is set to zero
             msStyleOutline.width = utils.sizeUnitToPx(sl.borderWidth(), sl.borderWidthUnit()) \
@@ -318,7 +567,9 @@ class SymbolLayerSerializer(object):
             # if we are using map units in QGis. This breaks every property with a size unit set to
             # anything other than the map unit.
             if (sl.borderWidth() > 0):
-                utils.maybeSetLayerSizeUnitFromMap(sl.borderWidthUnit(), self.msLayer)
+                utils.maybeSetLayerSizeUnitFromMap(
+                    sl.borderWidthUnit(), self.msLayer, self.context.mapUnits()
+                )
 
             # Emit line pattern only if we have a non-solid pen
             if sl.borderStyle() != Qt.SolidLine:
@@ -331,12 +582,11 @@ class SymbolLayerSerializer(object):
         # Emit fill only if it's visible and the marker is polygonal
         markerName = unicode(sl.name()).encode('utf-8')
         if (sl.fillColor().alpha() != 0) and utils.isWellKnownMarkerPolygonal(markerName):
-            msFillSymbol = utils.serializeWellKnownMarker(markerName, True)
-            self.msMap.symbolset.appendSymbol(msFillSymbol) 
+            msFillSymbol = utils.serializeWellKnownMarker(markerName, True, self.ms)
 
-            msStyleBg = mapscript.styleObj(self.msClass)
-            msStyleBg.symbolname = msFillSymbol.name
-            msStyleBg.color = utils.serializeColor(sl.fillColor())
+            msStyleBg = self.ms.styleObj(self.msClass)
+            msStyleBg.symbolname = utils.internSymbol(self.msMap, msFillSymbol, markerName)
+            msStyleBg.color = utils.serializeColor(sl.fillColor(), self.ms)
             msStyleBg.size = utils.sizeUnitToPx(sl.size(), sl.sizeUnit())
 
             # If `fillProperties` is a dict, we are serializing a marker symbol layer inside a point
@@ -347,12 +597,11 @@ class SymbolLayerSerializer(object):
 
         # Emit outline only if the marker has one
         if sl.outlineStyle() != Qt.NoPen:
-            msOutlineSymbol = utils.serializeWellKnownMarker(markerName, False)
-            self.msMap.symbolset.appendSymbol(msOutlineSymbol)
+            msOutlineSymbol = utils.serializeWellKnownMarker(markerName, False, self.ms)
 
-            msStyleOutline = mapscript.styleObj(self.msClass)
-            msStyleOutline.symbolname = msOutlineSymbol.name
-            msStyleOutline.color = utils.serializeColor(sl.borderColor())
+            msStyleOutline = self.ms.styleObj(self.msClass)
+            msStyleOutline.symbolname = utils.internSymbol(self.msMap, msOutlineSymbol, markerName)
+            msStyleOutline.color = utils.serializeColor(sl.borderColor(), self.ms)
 
             # QGis draws a default outline of .26mm even when the width is set to zero
             msStyleOutline.width = utils.sizeUnitToPx(sl.outlineWidth(), sl.outlineWidthUnit()) \
@@ -375,7 +624,8 @@ class SymbolLayerSerializer(object):
         
         """
         try:
-            msSymbol = utils.serializeSvgSymbol(unicode(sl.path()).encode('utf-8'))
+            with self.profiler.phase('symbols.svg'):
+                msSymbol = utils.serializeSvgSymbol(unicode(sl.path()).encode('utf-8'), self.ms)
         except Exception as e:
             QgsMessageLog.logMessage(
                 u'Cannot serialize SVG symbol: %s' % unicode(e),
@@ -383,17 +633,15 @@ class SymbolLayerSerializer(object):
             )
             return
 
-        self.msMap.symbolset.appendSymbol(msSymbol)
-
-        msStyle = mapscript.styleObj(self.msClass)
-        msStyle.symbolname = msSymbol.name
+        msStyle = self.ms.styleObj(self.msClass)
+        msStyle.symbolname = utils.internSymbol(self.msMap, msSymbol, 'svg')
         msStyle.size = utils.sizeUnitToPx(sl.size(), sl.sizeUnit())
 
 
     def serializeFontMarkerSymbolLayer(self, sl):
         """Serialize a QGis font marker symbol layer into a MapServer style"""
 
-        msSymbol = mapscript.symbolObj(utils.makeSymbolUUID('truetype'))
+        msSymbol = self.ms.symbolObj('truetype')
         msSymbol.type = mapscript.MS_SYMBOL_TRUETYPE
         msSymbol.filled = True
         msSymbol.inmapfile = True
@@ -403,11 +651,9 @@ class SymbolLayerSerializer(object):
         char = unicode(sl.character()).encode('utf-8')
         msSymbol.character = char
 
-        self.msMap.symbolset.appendSymbol(msSymbol)
-
-        msStyle = mapscript.styleObj(self.msClass)
-        msStyle.symbolname = msSymbol.name
-        msStyle.color = utils.serializeColor(sl.color())
+        msStyle = self.ms.styleObj(self.msClass)
+        msStyle.symbolname = utils.internSymbol(self.msMap, msSymbol, 'truetype')
+        msStyle.color = utils.serializeColor(sl.color(), self.ms)
         msStyle.size = utils.sizeUnitToPx(sl.size(), sl.sizeUnit())
 
 
@@ -1,17 +1,32 @@
 import os
-import re
-import string
-import codecs
-import binascii
-import random
+import hashlib
 from tempfile import mkstemp
 
 from PyQt4.QtCore import *
 from PyQt4.QtGui import *
+from PyQt4.QtXml import QDomDocument
 from qgis.core import *
 from qgis.gui import *
-from qgis.utils import iface
-import mapscript
+
+try:
+    import mapscript
+except ImportError:
+    # Only the pure Python backend is available (see: MapfileWriter.py)
+    import MapfileWriter as mapscript
+
+import MapfileWriter
+import SvgSymbols
+import ExpressionCompiler
+from ExpressionCompiler import ExpressionCompileError
+
+def backendFor(msObj):
+    """Return the module providing the mapscript API a map/layer/class/style object belongs to
+
+        This is either mapscript itself or its pure Python stand-in (see: MapfileWriter.py).
+    """
+
+    return MapfileWriter if isinstance(msObj, MapfileWriter.MapfileObject) else mapscript
+
 
 """Default outline width in pixels"""
 DEFAULT_OUTLINE_WIDTH = 1
@@ -26,20 +41,21 @@ SIZE_UNIT_MAP = {
     QGis.NauticalMiles:         mapscript.MS_NAUTICALMILES
 }
 
-def maybeSetLayerSizeUnitFromMap(unit, msLayer):
+def maybeSetLayerSizeUnitFromMap(unit, msLayer, mapUnits):
     """Set a mapfile layer's size unit from the CRS of the map if `unit` is set to QgsSymbolV2.MapUnit
     
         This is a workaround for providing scale-dependent symbology for layers.
         We cannot set per-style-attribute units in MapServer, so we set the unit on the layer level
         and pray that all hell does not break loose.
 
+        `mapUnits` are the units of the CRS of the map, None if unknown (see:
+        `ExportContext.mapUnits()`).
+
         FIXME: This is *REALLY* ugly.
     """
 
-    if (unit == QgsSymbolV2.MapUnit) and (iface is not None):
-        msLayer.sizeunits = SIZE_UNIT_MAP[
-            iface.mapCanvas().mapSettings().destinationCrs().mapUnits()
-        ]
+    if (unit == QgsSymbolV2.MapUnit) and (mapUnits is not None):
+        msLayer.sizeunits = SIZE_UNIT_MAP[mapUnits]
 
 """Qt -> MasServer pen styles
     (As per https://github.com/qgis/QGIS/blob/master/src/core/symbology-ng/qgssymbollayerv2utils.cpp)
@@ -102,8 +118,8 @@ LABEL_POSITION_MAP = {
     QgsPalLayerSettings.QuadrantBelowRight: mapscript.MS_LR
 }
 
-"""Default path for extracted SVG images"""
-SVG_IMAGE_DIR = 'svgrasters'
+"""mapscript SVG symbols parsed so far, by image type and path (see: `serializeSvgSymbol()`)"""
+SVG_SYMBOLS = {}
 
 def sizeUnitToPx(val, unit):
     """Convert millimeters/map units to pixels (assuming an 72dpi display)"""
@@ -114,16 +130,42 @@ def sizeUnitToPx(val, unit):
         return val
 
 
-def makeSymbolUUID(prefix=''):
-    """Generate a globally unique identifier to be used in symbol names"""
+"""Number of hex digits of the hash symbols are named after"""
+SYMBOL_HASH_LENGTH = 12
+
+
+def symbolKey(symbol):
+    """Return a string equal for identical symbols"""
+
+    doc = QDomDocument()
+    doc.appendChild(QgsSymbolLayerV2Utils.saveSymbol(u'symbol', symbol, doc))
+
+    return unicode(doc.toString())
+
 
-    return prefix + '_' + ''.join(random.choice(string.ascii_uppercase + string.digits) for _ in range(10))
+def styleKey(layer):
+    """Return a hash of the symbology of a vector layer, equal for layers styled identically
 
+        The scale range of the layer is part of the key, as QGis writes it to the SLD rules.
+    """
+
+    doc = QDomDocument()
+    doc.appendChild(layer.rendererV2().save(doc))
+
+    h = hashlib.sha1()
+    h.update(unicode(doc.toString()).encode('utf-8'))
+    h.update(b'\0%d' % layer.geometryType())
+
+    if layer.hasScaleBasedVisibility():
+        h.update(b'\0%r\0%r' % (layer.minimumScale(), layer.maximumScale()))
 
-def serializeColor(qColor):
+    return h.hexdigest()
+
+
+def serializeColor(qColor, ms=mapscript):
     """Serialize a QColor() into a mapscript.colorObj()"""
 
-    msColor = mapscript.colorObj(qColor.red(), qColor.green(), qColor.blue(), qColor.alpha())
+    msColor = ms.colorObj(qColor.red(), qColor.green(), qColor.blue(), qColor.alpha())
     return msColor
 
 def setPenStylePattern(style, pattern):
@@ -140,10 +182,12 @@ def setPenStylePattern(style, pattern):
             https://github.com/mapserver/mapserver/issues/4943
     """
 
-    if mapscript.MS_VERSION_MAJOR == 7:
+    ms = backendFor(style)
+
+    if ms.MS_VERSION_MAJOR == 7:
         style.pattern = pattern
 
-    elif (mapscript.MS_VERSION_MAJOR == 6) and (mapscript.MS_VERSION_MINOR >= 4):
+    elif (ms.MS_VERSION_MAJOR == 6) and (ms.MS_VERSION_MINOR >= 4):
         patternStr = "\nPATTERN %s END\nEND" % ' '.join(map(str, pattern))
         styleStr = style.convertToString().rsplit('END', 1)
 
@@ -183,43 +227,70 @@ def serializePenCapStyle(pcs):
 
     return PEN_CAP_STYLE_MAP[pcs]
 
-def serializeHatchSymbol(msMap):
-    """Create a per-mapfile singleton hatch symbol
+def symbolDefinition(msSymbol):
+    """Describe everything but the name of a mapscript.symbolObj(), as a string"""
+
+    msLine = msSymbol.getPoints()
+    points = [msLine.get(i) for i in range(msLine.numpoints)]
+
+    return u'%s' % ((
+        msSymbol.type, bool(msSymbol.filled), msSymbol.font, msSymbol.character,
+        msSymbol.imagepath, msSymbol.anchorpointx, msSymbol.anchorpointy,
+        tuple((p.x, p.y) for p in points)
+    ),)
 
-        HATCH symbols in MapServer do not have any attributes other than their name and type,
-        so a single instance is sufficient for all our needs.
+
+def internSymbol(msMap, msSymbol, prefix):
+    """Add a symbol to the symbol set of a map, unless an identical one is there already
+
+        Symbols are named after a hash of their definition, so that identical symbols share
+        a single entry and names do not change from one export to the next.
 
         This is a bit of a hack relying on the fact that you can set whatever attributes you want
-        on SWIG objects. Therefore we save the symbol name directly into the `mapObject`.
+        on SWIG objects. Therefore we save the names of the interned symbols directly into the
+        `mapObject`.
+
+        Returns the name of the symbol in the symbol set.
     """
 
-    if not hasattr(msMap, 'singletonHatchSymbolName'):
-        hatchSymbol = mapscript.symbolObj(makeSymbolUUID('hatch'))
-        hatchSymbol.type = mapscript.MS_SYMBOL_HATCH
-        hatchSymbol.inmapfile = True
+    if not hasattr(msMap, 'internedSymbolNames'):
+        msMap.internedSymbolNames = set()
 
-        msMap.symbolset.appendSymbol(hatchSymbol)
-        msMap.singletonHatchSymbolName = hatchSymbol.name
+    digest = hashlib.sha1(symbolDefinition(msSymbol).encode('utf-8')).hexdigest()
+    name = '%s_%s' % (prefix, digest[:SYMBOL_HASH_LENGTH])
 
-    return msMap.singletonHatchSymbolName
+    if name not in msMap.internedSymbolNames:
+        msSymbol.name = name
+        msSymbol.inmapfile = True
+        msMap.symbolset.appendSymbol(msSymbol)
+        msMap.internedSymbolNames.add(name)
 
+    return name
 
-def serializeSvgSymbol(svgPath):
-    """Serialize an SVG symbol into a mapscript.symbolObj()
 
-        We have a couple of problems here though:
+def serializeHatchSymbol(msMap):
+    """Create a per-mapfile singleton hatch symbol
+
+        HATCH symbols in MapServer do not have any attributes other than their name and type,
+        so a single instance is sufficient for all our needs.
+    """
+
+    ms = backendFor(msMap)
+    hatchSymbol = ms.symbolObj('hatch')
+    hatchSymbol.type = ms.MS_SYMBOL_HATCH
+
+    return internSymbol(msMap, hatchSymbol, 'hatch')
+
 
-        1. SVGs with embedded raster images
+def serializeSvgSymbol(svgPath, ms=mapscript):
+    """Serialize an SVG symbol into a mapscript.symbolObj()
 
-            As MapServer seems to be unable to handle SVG files with an embedded <image />, we use
-            some magic here to extract said image into a separate file and use a pixmap symbol
-            instead. Please note the following:
-                a. We only consider the first embedded image in the SVG file.
-                b. Embedded images are saved to the directory the SVG file resides in.
+        SVGs with embedded raster images are drawn as pixmap symbols (see: SvgSymbols.py).
 
-        2. As it is currently (MapServer 7.0.0-beta) impossible to set the `imagepath` attribute on
-           a symbolObj() we use a workaround that involves manually writing, then re-parsing
-           a symbol set definition file.
+        As it is currently (MapServer 7.0.0-beta) impossible to set the `imagepath` attribute on
+        a symbolObj() we use a workaround that involves manually writing, then re-parsing
+        a symbol set definition file. (This is not needed with the pure Python backend.) This is
+        only done once for every image, parsed symbols are kept in `SVG_SYMBOLS`.
 
             Possibly relevant MapServer bugs:
                 https://github.com/mapserver/mapserver/issues/4501
@@ -227,70 +298,23 @@ def serializeSvgSymbol(svgPath):
                 https://github.com/mapserver/mapserver/issues/5109
     """
 
-    # Check if the SVG file contains an embedded image
-    with codecs.open(svgPath, 'r', 'utf-8') as fin:
-        svgContents = fin.read().replace('\n', '')
-    
-    rx = re.compile(u'<image[^>]+xlink:href="([^"]+)"')
-    m = rx.search(svgContents)
-
-    if (m is not None):
-        # We have an image, check if its a data URI or a general one
-        uri = m.group(1)
-        imageType = 'PIXMAP'
-        symbolUUID = makeSymbolUUID('svgraster')
-
-        if uri[:10] == u'data:image':
-            # We have a data URI, save the image into an external file.
-            # Please note that we only consider base64-encoded images here.
-            #
-            dataURIRx = re.compile('data:image/(\w+);base64,(.+)')
-            dm = dataURIRx.match(uri)
-
-            if (dm is not None):
-                imageExt = dm.group(1)
-                try:
-                    imageData = bytearray(binascii.a2b_base64(dm.group(2)))
-                except:
-                    raise ValueError('Cannot decode base64 URI in embedded image while parsing SVG.') 
-                
-                imageName = '%s.%s' % (symbolUUID, imageExt)
-                imageDir = os.path.join(os.path.dirname(svgPath), SVG_IMAGE_DIR)
-                
-                if not os.path.exists(imageDir):
-                    os.makedirs(imageDir)
-
-                imagePath = os.path.join(imageDir, imageName).encode('utf-8')
-
-                with open(imagePath, 'wb') as imageOut:
-                    imageOut.write(imageData)
-
-            else:
-                raise ValueError('Invalid data URI encountered while parsing SVG.')
-            
-        else:
-            # We have a non-data URI.
-            # We only want to consider relative URIs here so perform some naive sanity checks on it
-
-            if uri.startswith('file://'):
-                uri = uri[7:]
-                if (uri.find('..') == -1) and (not uri.startswith('/')):
-                    imagePath = os.path.join(os.path.dirname(svgPath), uri)
-                else:
-                    raise ValueError('Invalid URI encountered while parsing SVG.')
-            else:
-                raise ValueError('Invalid URI encountered while parsing SVG.')
-    else:
-        # We do not have an embedded image thus the SVG is all vector and can probably be 
-        # rendered without a hitch
+    imageType, imagePath = SvgSymbols.svgImage(svgPath)
+
+    if ms is MapfileWriter:
+        msSymbol = ms.symbolObj('svg')
+        msSymbol.type = ms.MS_SYMBOL_PIXMAP if imageType == 'PIXMAP' else ms.MS_SYMBOL_SVG
+        msSymbol.imagepath = imagePath
+        msSymbol.inmapfile = True
 
-        imageType = 'SVG' 
-        imagePath = svgPath
+        return msSymbol
+
+    if (imageType, imagePath) in SVG_SYMBOLS:
+        return SVG_SYMBOLS[(imageType, imagePath)]
 
     symbolSetData = """
         SYMBOLSET
             SYMBOL
-                NAME "%s"
+                NAME "svg"
                 TYPE %s
                 IMAGE "%s"
                 ANCHORPOINT 0.5 0.5
@@ -300,21 +324,23 @@ def serializeSvgSymbol(svgPath):
 
     # Create a temporary file and open it
     (tempHandle, tempName) = mkstemp()
-    
-    # Write symbol set data
-    os.write(tempHandle, symbolSetData % (makeSymbolUUID('svg'), imageType, imagePath))
-    os.close(tempHandle)
 
-    # Load and parse the symbol set
-    msSymbolSet = mapscript.symbolSetObj(tempName)
+    try:
+        # Write symbol set data
+        os.write(tempHandle, symbolSetData % (imageType, imagePath))
+        os.close(tempHandle)
 
-    # Remove the temporary file
-    # os.unlink(tempName)
+        # Load and parse the symbol set
+        msSymbolSet = mapscript.symbolSetObj(tempName)
+    finally:
+        os.unlink(tempName)
 
     # Fetch and return our SVG symbol
     msSymbol = msSymbolSet.getSymbol(1)
     msSymbol.inmapfile = True
 
+    SVG_SYMBOLS[(imageType, imagePath)] = msSymbol
+
     return msSymbol
 
 
@@ -330,19 +356,19 @@ def isWellKnownMarkerPolygonal(marker):
     return marker not in LINEAL_WELL_KNOWN_MARKERS
 
 
-def serializeWellKnownMarker(marker, filled):
+def serializeWellKnownMarker(marker, filled, ms=mapscript):
     """Serialize a well known marker into a mapscript.symbolObj()"""
 
-    msSymbol = mapscript.symbolObj('%s' % (makeSymbolUUID(marker)))
-    msSymbol.type = mapscript.MS_SYMBOL_VECTOR
+    msSymbol = ms.symbolObj(marker)
+    msSymbol.type = ms.MS_SYMBOL_VECTOR
     msSymbol.inmapfile = True
-    msLine = mapscript.lineObj()
+    msLine = ms.lineObj()
 
     def setPoints(ps):
         """Set the points of the marker"""
 
         for p in ps:
-            msLine.add(mapscript.pointObj(p[0], p[1]))
+            msLine.add(ms.pointObj(p[0], p[1]))
 
         msSymbol.setPoints(msLine)
 
@@ -351,7 +377,7 @@ def serializeWellKnownMarker(marker, filled):
         mayHaveFill = isWellKnownMarkerPolygonal(marker)
     else:
         # We use a simple circle if the marker is not among our currently known markers
-        msSymbol.type = mapscript.MS_SYMBOL_ELLIPSE
+        msSymbol.type = ms.MS_SYMBOL_ELLIPSE
         setPoints([[1, 1]])
         mayHaveFill = True
 
@@ -385,3 +411,201 @@ def serializeFontDefinition(font, style):
     fm = QFontMetrics(font)
 
     return (unicode(fontDef).encode('utf8'), fm.height())
+
+
+"""QGis -> expression tree (see: ExpressionCompiler.py) binary operators"""
+BINARY_OPERATOR_MAP = {
+    QgsExpression.boEQ:         (u'compare', u'='),
+    QgsExpression.boNE:         (u'compare', u'<>'),
+    QgsExpression.boLT:         (u'compare', u'<'),
+    QgsExpression.boLE:         (u'compare', u'<='),
+    QgsExpression.boGT:         (u'compare', u'>'),
+    QgsExpression.boGE:         (u'compare', u'>='),
+    QgsExpression.boPlus:       (u'arithmetic', u'+'),
+    QgsExpression.boMinus:      (u'arithmetic', u'-'),
+    QgsExpression.boMul:        (u'arithmetic', u'*'),
+    QgsExpression.boDiv:        (u'arithmetic', u'/'),
+    QgsExpression.boMod:        (u'arithmetic', u'%'),
+    QgsExpression.boPow:        (u'arithmetic', u'^'),
+    QgsExpression.boLike:       (u'match', u'like'),
+    QgsExpression.boILike:      (u'match', u'ilike'),
+    QgsExpression.boRegexp:     (u'match', u'regexp')
+}
+
+"""QGis negated pattern matching operators -> the operators they negate"""
+NEGATED_MATCH_MAP = {
+    QgsExpression.boNotLike:    QgsExpression.boLike,
+    QgsExpression.boNotILike:   QgsExpression.boILike
+}
+
+
+def stringColumns(layer):
+    """Return the names of the attributes of a vector layer holding strings"""
+
+    return frozenset(
+        unicode(field.name()) for field in layer.pendingFields()
+        if field.type() not in (
+            QVariant.Int, QVariant.UInt, QVariant.LongLong, QVariant.ULongLong, QVariant.Double
+        )
+    )
+
+
+def expressionColumns(expression):
+    """Return the names of the attributes a QGis expression refers to, None for all of them"""
+
+    exp = QgsExpression(expression)
+    if exp.hasParserError():
+        return set()
+
+    names = set(unicode(name) for name in exp.referencedColumns())
+    return None if QgsFeatureRequest.AllAttributes in names else names
+
+
+def labelAttributes(layer):
+    """Return the names of the attributes the labels of a vector layer refer to, None for all of
+    them: the label field or expression, and the fields and expressions of data-defined
+    properties"""
+
+    ps = QgsPalLayerSettings.fromLayer(layer)
+    if not ps.enabled:
+        return set()
+
+    names = set()
+    expressions = []
+
+    if ps.isExpression:
+        expressions.append(ps.fieldName)
+    elif ps.fieldName:
+        names.add(unicode(ps.fieldName))
+
+    for dd in ps.dataDefinedProperties.values():
+        if not dd.isActive():
+            continue
+        if dd.useExpression():
+            expressions.append(dd.expressionString())
+        elif dd.field():
+            names.add(unicode(dd.field()))
+
+    for expression in expressions:
+        columns = expressionColumns(unicode(expression))
+        if columns is None:
+            return None
+        names |= columns
+
+    return names
+
+
+def warnUntranslatable(layer, what, expression, error):
+    """Report an expression which could not be translated, and what is exported without it"""
+
+    QgsMessageLog.logMessage(
+        u'Layer "%s": %s, "%s" cannot be translated (%s)' % (
+            layer.name(), what, expression, error
+        ),
+        u'RT MapServer Exporter', QgsMessageLog.WARNING
+    )
+
+
+def literalValue(value):
+    """Convert the value of a QGis literal to unicode, int, float, bool or None"""
+
+    if isinstance(value, QVariant):
+        value = value.toPyObject()
+
+    if value is None or (hasattr(value, 'isNull') and value.isNull()):
+        return None
+    if isinstance(value, (bool, int, long, float)):
+        return value
+
+    return unicode(value)
+
+
+def expressionTree(expression):
+    """Parse a QGis expression into a tree (see: ExpressionCompiler.py)
+
+        Raises ExpressionCompileError for expressions which do not parse, or have no equivalent.
+    """
+
+    exp = QgsExpression(expression)
+    if exp.hasParserError():
+        raise ExpressionCompileError(
+            u'Invalid expression "%s": %s' % (expression, exp.parserErrorString())
+        )
+
+    return expressionNodeTree(exp.rootNode())
+
+
+def expressionNodeTree(node):
+    """Convert a node of a parsed QGis expression into a tree"""
+
+    nodeType = node.nodeType()
+
+    if nodeType == QgsExpression.ntColumnRef:
+        return ExpressionCompiler.column(unicode(node.name()))
+
+    if nodeType == QgsExpression.ntLiteral:
+        return ExpressionCompiler.literal(literalValue(node.value()))
+
+    if nodeType == QgsExpression.ntUnaryOperator:
+        operand = expressionNodeTree(node.operand())
+        return (u'not' if node.op() == QgsExpression.uoNot else u'negate', operand)
+
+    if nodeType == QgsExpression.ntFunction:
+        name = unicode(QgsExpression.Functions()[node.fnIndex()].name()).lower()
+        if name not in ExpressionCompiler.FUNCTIONS and name != u'concat':
+            raise ExpressionCompileError(u'Unsupported function: %s()' % name)
+
+        arguments = node.args().list() if node.args() is not None else []
+        arguments = tuple(expressionNodeTree(n) for n in arguments)
+
+        # NULLs are concatenated as empty strings, as MapServer reads them
+        if name == u'concat':
+            return (u'concat', arguments, True)
+
+        return (u'function', name, arguments)
+
+    if nodeType == QgsExpression.ntInOperator:
+        values = tuple(expressionNodeTree(n) for n in node.list().list())
+        return (u'in', expressionNodeTree(node.node()), values, node.isNotIn())
+
+    if nodeType == QgsExpression.ntBinaryOperator:
+        op = node.op()
+        left, right = expressionNodeTree(node.opLeft()), expressionNodeTree(node.opRight())
+
+        if op == QgsExpression.boAnd:
+            return ExpressionCompiler.conjunction([left, right])
+        if op == QgsExpression.boOr:
+            return (u'or', tuple(
+                operand for tree in (left, right)
+                for operand in (tree[1] if tree[0] == u'or' else (tree,))
+            ))
+
+        if op == QgsExpression.boConcat:
+            return (u'concat', tuple(
+                operand for tree in (left, right)
+                for operand in (tree[1] if tree[0] == u'concat' and not tree[2] else (tree,))
+            ), False)
+
+        if op in (QgsExpression.boIs, QgsExpression.boIsNot):
+            negated = op == QgsExpression.boIsNot
+            if right == ExpressionCompiler.literal(None):
+                return (u'null', left, negated)
+            if left == ExpressionCompiler.literal(None):
+                return (u'null', right, negated)
+
+            return (u'compare', u'<>' if negated else u'=', left, right)
+
+        negated = op in NEGATED_MATCH_MAP
+        kind, name = BINARY_OPERATOR_MAP.get(NEGATED_MATCH_MAP.get(op, op), (None, None))
+
+        if kind == u'match':
+            if right[0] != u'literal' or not isinstance(right[1], basestring):
+                raise ExpressionCompileError(u'Patterns must be strings: %s' % node.dump())
+
+            tree = (kind, name, left, right[1])
+            return (u'not', tree) if negated else tree
+
+        if kind is not None:
+            return (kind, name, left, right)
+
+    raise ExpressionCompileError(u'Unsupported expression: %s' % node.dump())
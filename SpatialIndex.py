@@ -0,0 +1,266 @@
+"""Quadtree spatial indexes (.qix files) for shapefiles, as built by MapServer's `shptree`
+
+    MapServer reads a shapefile's .qix index, when there is one, to only look at the shapes
+    intersecting the extent of a request. The index is built here the way `shptree` (see:
+    maptree.c) builds it, so that `shptree` does not need to be installed where the mapfile is
+    exported:
+
+        - The root node covers the bounds in the shapefile header. A shape is pushed down to the
+          first of the four child nodes of a node that fully contains its bounds, and kept in
+          the node otherwise. Nodes are split in two along their longer side, twice, each half
+          overlapping the other (see: `SPLIT_RATIO`).
+        - Unless given, the depth of the tree is chosen for about 8 shapes per node.
+        - Empty subtrees are removed before writing.
+
+    Indexes are written in the "new" little endian format (`shptree file.shp 0 NL`).
+
+    Nothing in here depends on QGis or mapscript.
+"""
+
+import os
+import struct
+
+import MapfileUtils
+
+
+"""Ratio of a node's side covered by each of its halves"""
+SPLIT_RATIO = 0.55
+
+"""Byte order flag of the new index format (MS_NEW_LSB_ORDER in maptree.h)"""
+NEW_LSB_ORDER = 1
+
+"""Version of the index format"""
+INDEX_VERSION = 1
+
+"""Shapefile shape types whose records hold a single point instead of a bounding box"""
+POINT_TYPES = (1, 11, 21)
+
+
+def indexPath(shapefilePath):
+    """Return the path of the .qix index of a shapefile"""
+
+    return os.path.splitext(shapefilePath)[0] + '.qix'
+
+
+def indexIsCurrent(shapefilePath):
+    """Tell whether a shapefile has an index that is newer than its .shp and .shx files"""
+
+    qixPath = indexPath(shapefilePath)
+    if not os.path.isfile(qixPath):
+        return False
+
+    qixTime = os.path.getmtime(qixPath)
+    shxPath = os.path.splitext(shapefilePath)[0] + '.shx'
+
+    return all(
+        os.path.getmtime(p) <= qixTime for p in (shapefilePath, shxPath) if os.path.isfile(p)
+    )
+
+
+def readShapeBounds(shapefilePath):
+    """Read the bounds of a shapefile and of each of its shapes
+
+        Returns `(bounds, numShapes, shapes)`, where `bounds` is the `(minx, miny, maxx, maxy)`
+        tuple from the header and `shapes` yields `(id, bounds)` pairs, skipping null and empty
+        shapes. The .shx file is used to locate the records.
+    """
+
+    shxPath = os.path.splitext(shapefilePath)[0] + '.shx'
+    if not os.path.isfile(shxPath):
+        shxPath = os.path.splitext(shapefilePath)[0] + '.SHX'
+
+    with open(shapefilePath, 'rb') as fin:
+        header = fin.read(100)
+
+    if len(header) < 100 or struct.unpack('>i', header[0:4])[0] != 9994:
+        raise ValueError('Not a shapefile: %s' % shapefilePath)
+
+    shapeType = struct.unpack('<i', header[32:36])[0]
+    bounds = struct.unpack('<4d', header[36:68])
+
+    with open(shxPath, 'rb') as fin:
+        fin.seek(100)
+        index = fin.read()
+
+    numShapes = len(index) // 8
+
+    def shapes():
+        with open(shapefilePath, 'rb') as fin:
+            for i in range(numShapes):
+                offset, length = struct.unpack('>ii', index[i * 8:i * 8 + 8])
+
+                # Null shapes only consist of their type
+                if length * 2 <= 4:
+                    continue
+
+                fin.seek(offset * 2 + 12)
+
+                if shapeType in POINT_TYPES:
+                    x, y = struct.unpack('<2d', fin.read(16))
+                    rect = (x, y, x, y)
+                else:
+                    rect = struct.unpack('<4d', fin.read(32))
+
+                # Empty shapes have NaN bounds
+                if rect[0] != rect[0]:
+                    continue
+
+                yield i, rect
+
+    return bounds, numShapes, shapes()
+
+
+# --------------------------------------------------------------------------------------------------
+# Tree building
+# --------------------------------------------------------------------------------------------------
+
+class Node(object):
+    __slots__ = ('rect', 'ids', 'subnodes')
+
+    def __init__(self, rect):
+        self.rect = rect
+        self.ids = []
+        self.subnodes = []
+
+
+def contains(outer, inner):
+    return inner[0] >= outer[0] and inner[2] <= outer[2] and \
+        inner[1] >= outer[1] and inner[3] <= outer[3]
+
+
+def splitBounds(rect):
+    minx, miny, maxx, maxy = rect
+
+    if (maxx - minx) > (maxy - miny):
+        extent = maxx - minx
+        return (
+            (minx, miny, minx + extent * SPLIT_RATIO, maxy),
+            (maxx - extent * SPLIT_RATIO, miny, maxx, maxy)
+        )
+
+    extent = maxy - miny
+    return (
+        (minx, miny, maxx, miny + extent * SPLIT_RATIO),
+        (minx, maxy - extent * SPLIT_RATIO, maxx, maxy)
+    )
+
+
+def defaultDepth(numShapes):
+    """Choose a depth giving about 8 shapes per node, like `shptree` does"""
+
+    depth = 0
+    numNodes = 1
+    while numNodes * 4 < numShapes:
+        depth += 1
+        numNodes *= 2
+
+    return depth
+
+
+def addShape(node, shapeId, rect, maxDepth):
+    while True:
+        if maxDepth > 1 and len(node.subnodes) > 0:
+            for subnode in node.subnodes:
+                if contains(subnode.rect, rect):
+                    node = subnode
+                    maxDepth -= 1
+                    break
+            else:
+                break
+
+        elif maxDepth > 1:
+            half1, half2 = splitBounds(node.rect)
+            quads = splitBounds(half1) + splitBounds(half2)
+
+            if not any(contains(quad, rect) for quad in quads):
+                break
+
+            node.subnodes = [Node(quad) for quad in quads]
+
+        else:
+            break
+
+    node.ids.append(shapeId)
+
+
+def trim(node):
+    """Remove empty subtrees, returns True if `node` itself is empty"""
+
+    i = 0
+    while i < len(node.subnodes):
+        if trim(node.subnodes[i]):
+            # Like MapServer, move the last subnode into the place of the removed one
+            node.subnodes[i] = node.subnodes[-1]
+            node.subnodes.pop()
+        else:
+            i += 1
+
+    return len(node.subnodes) == 0 and len(node.ids) == 0
+
+
+def buildTree(bounds, shapes, numShapes, maxDepth=0):
+    """Build the quadtree of a set of shapes, see: `readShapeBounds()`
+
+        Returns the root node and the depth of the tree.
+    """
+
+    if maxDepth == 0:
+        maxDepth = defaultDepth(numShapes)
+
+    root = Node(tuple(bounds))
+    for shapeId, rect in shapes:
+        addShape(root, shapeId, rect, maxDepth)
+
+    trim(root)
+
+    return root, maxDepth
+
+
+# --------------------------------------------------------------------------------------------------
+# Writing
+# --------------------------------------------------------------------------------------------------
+
+def nodeSize(node):
+    """Size of the record of a node: offset, bounds, shape count, ids and subnode count"""
+
+    return 44 + 4 * len(node.ids)
+
+
+def subtreeSize(node):
+    return sum(nodeSize(subnode) + subtreeSize(subnode) for subnode in node.subnodes)
+
+
+def writeNode(fout, node):
+    # The offset lets readers skip the whole subtree of the node
+    fout.write(struct.pack('<i4di', subtreeSize(node), *(node.rect + (len(node.ids),))))
+    fout.write(struct.pack('<%di' % len(node.ids), *node.ids))
+    fout.write(struct.pack('<i', len(node.subnodes)))
+
+    for subnode in node.subnodes:
+        writeNode(fout, subnode)
+
+
+def writeIndex(qixPath, root, numShapes, maxDepth):
+    """Write a quadtree to a .qix file"""
+
+    # Write to a temporary file first, MapServer may be reading the index meanwhile
+    tempPath = qixPath + '.tmp'
+
+    with open(tempPath, 'wb') as fout:
+        fout.write(b'SQT' + struct.pack('<BB3x', NEW_LSB_ORDER, INDEX_VERSION))
+        fout.write(struct.pack('<ii', numShapes, maxDepth))
+        writeNode(fout, root)
+
+    MapfileUtils.replaceFile(tempPath, qixPath)
+
+
+def indexShapefile(shapefilePath, maxDepth=0):
+    """Build the .qix index of a shapefile, returns the path of the index"""
+
+    bounds, numShapes, shapes = readShapeBounds(shapefilePath)
+    root, maxDepth = buildTree(bounds, shapes, numShapes, maxDepth)
+
+    qixPath = indexPath(shapefilePath)
+    writeIndex(qixPath, root, numShapes, maxDepth)
+
+    return qixPath
@@ -0,0 +1,118 @@
+"""Images backing the SVG marker symbols of an export
+
+    MapServer seems to be unable to handle SVG files with an embedded <image />, so such markers
+    are drawn as pixmap symbols instead, using the embedded image:
+
+        - Only the first embedded image of an SVG file is considered.
+        - Images embedded as base64 data URIs are extracted into the `SVG_IMAGE_DIR` directory
+          next to the SVG file, under a name derived from a hash of their contents. Extracting the
+          same image again reuses the existing file.
+        - Images linked with relative file:// URIs are used in place.
+
+    The same marker is usually used by many classes, so SVG files are only read once as long as
+    they do not change: results are memoized by path, modification time and size.
+
+    Nothing in here depends on QGis or mapscript.
+"""
+
+import os
+import re
+import codecs
+import hashlib
+import binascii
+
+import MapfileUtils
+
+
+"""Default path for extracted SVG images"""
+SVG_IMAGE_DIR = 'svgrasters'
+
+"""Matches the link of the first embedded image of an SVG file"""
+IMAGE_RX = re.compile(u'<image[^>]+xlink:href="([^"]+)"')
+
+"""Matches base64-encoded data URIs, capturing the image type and the data"""
+DATA_URI_RX = re.compile(u'data:image/(\\w+);base64,(.+)')
+
+"""Number of hex digits of the hash extracted images are named after"""
+IMAGE_HASH_LENGTH = 16
+
+"""Image type and path of the SVG files read so far, by `(path, mtime, size)`"""
+_images = {}
+
+
+def extractDataUri(svgPath, uri):
+    """Save the image of a data URI next to an SVG file, return its path"""
+
+    dm = DATA_URI_RX.match(uri)
+    if dm is None:
+        raise ValueError('Invalid data URI encountered while parsing SVG.')
+
+    try:
+        imageData = binascii.a2b_base64(dm.group(2))
+    except (binascii.Error, TypeError):
+        raise ValueError('Cannot decode base64 URI in embedded image while parsing SVG.')
+
+    imageName = '%s.%s' % (
+        hashlib.sha1(imageData).hexdigest()[:IMAGE_HASH_LENGTH], dm.group(1)
+    )
+    imageDir = os.path.join(os.path.dirname(svgPath), SVG_IMAGE_DIR)
+    imagePath = os.path.join(imageDir, imageName)
+
+    # Images are named after their contents, an existing file is the very same image
+    if os.path.isfile(imagePath):
+        return imagePath
+
+    if not os.path.exists(imageDir):
+        os.makedirs(imageDir)
+
+    # Write to a temporary file first, so that interrupted exports leave no truncated images
+    tempPath = imagePath + '.%d.tmp' % os.getpid()
+    with open(tempPath, 'wb') as imageOut:
+        imageOut.write(imageData)
+
+    MapfileUtils.replaceFile(tempPath, imagePath)
+
+    return imagePath
+
+
+def readSvgImage(svgPath):
+    """Find out how to draw an SVG file, returns an `(imageType, imagePath)` pair
+
+        `imageType` is either 'SVG' (`imagePath` is the SVG file itself) or 'PIXMAP' (`imagePath`
+        is the image embedded in the SVG file).
+    """
+
+    with codecs.open(svgPath, 'r', 'utf-8') as fin:
+        svgContents = fin.read().replace('\n', '')
+
+    m = IMAGE_RX.search(svgContents)
+    if m is None:
+        # We do not have an embedded image thus the SVG is all vector and can probably be
+        # rendered without a hitch
+        return 'SVG', svgPath
+
+    uri = m.group(1)
+
+    if uri[:10] == u'data:image':
+        # Please note that we only consider base64-encoded images here.
+        return 'PIXMAP', extractDataUri(svgPath, uri)
+
+    # We only want to consider relative URIs here so perform some naive sanity checks on it
+    if uri.startswith('file://'):
+        uri = uri[7:]
+        if (uri.find('..') == -1) and (not uri.startswith('/')):
+            return 'PIXMAP', os.path.join(os.path.dirname(svgPath), uri)
+
+    raise ValueError('Invalid URI encountered while parsing SVG.')
+
+
+def svgImage(svgPath):
+    """Memoized `readSvgImage()`, SVG files are read again when they change"""
+
+    st = os.stat(svgPath)
+    key = (svgPath, st.st_mtime, st.st_size)
+
+    if key not in _images:
+        _images[key] = readSvgImage(svgPath)
+
+    return _images[key]
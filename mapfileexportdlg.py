@@ -227,32 +227,36 @@ class MapfileExportDlg(QDialog, Ui_MapfileExportDlg):
 
             tmpl += '<table class="idtmplt_tableclass">\n'
 
+            # `(name, comment)` pairs, read once as this may query the data source
+            fields = [
+                (unicode(f.name()), unicode(f.comment())) for f in layer.dataProvider().fields()
+            ]
+
             if orientation == Qt.Horizontal:
                 tmpl += '  <tr class="idtmplt_trclass_1h">\n'
-                for idx, fld in enumerate(layer.dataProvider().fields()):
-                    fldDescr = fld.comment() if fld.comment() != "" else fld.name()
+                for fldName, fldComment in fields:
+                    fldDescr = fldComment if fldComment != "" else fldName
                     tmpl += u'    <td class="idtmplt_tdclass_1h">"%s"</td>\n' % fldDescr
                 tmpl += '</tr>\n'
 
                 tmpl += '[feature limit=20]\n'
 
                 tmpl += '  <tr class="idtmplt_trclass_2h">\n'
-                for idx, fld in enumerate(layer.dataProvider().fields()):
-                    fldDescr = fld.comment() if fld.comment() != "" else fld.name()
-                    tmpl += u'    <td class="idtmplt_tdclass_2h">[item name="%s"]</td>\n' % fld.name()
+                for fldName, fldComment in fields:
+                    tmpl += u'    <td class="idtmplt_tdclass_2h">[item name="%s"]</td>\n' % fldName
                 tmpl += '  </tr>\n'
 
                 tmpl += '[/feature]\n'
 
             else:
-                for idx, fld in enumerate(layer.dataProvider().fields()):
+                for fldName, fldComment in fields:
                     tmpl += '  <tr class="idtmplt_trclass_v">\n'
 
-                    fldDescr = fld.comment() if fld.comment() != "" else fld.name()
+                    fldDescr = fldComment if fldComment != "" else fldName
                     tmpl += u'    <td class="idtmplt_tdclass_1v">"%s"</td>\n' % fldDescr
 
                     tmpl += '[feature limit=20]\n'
-                    tmpl += u'    <td class="idtmplt_tdclass_2v">[item name="%s"]</td>\n' % fld.name()
+                    tmpl += u'    <td class="idtmplt_tdclass_2v">[item name="%s"]</td>\n' % fldName
                     tmpl += '[/feature]\n'
 
                     tmpl += '  </tr>\n'
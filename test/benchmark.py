@@ -0,0 +1,375 @@
+"""Export benchmarks over synthetic projects
+
+    Builds projects with a given number of layers, classes per layer, SVG-marked layers and
+    labelled layers over the shapefiles in `data/shapefiles`, exports each of them with the
+    requested backends and records the export time and peak memory use. Results are written as
+    JSON and can be compared with those of an earlier run:
+
+        LC_ALL=C PYTHONPATH=/usr/share/qgis/python:~/.qgis2/python/plugins \\
+            python2 benchmark.py -o before.json
+        ... change the exporter ...
+        LC_ALL=C PYTHONPATH=/usr/share/qgis/python:~/.qgis2/python/plugins \\
+            python2 benchmark.py -o after.json --compare before.json
+
+    Layers cycle through polygons, lines and points (`grid`, `grid-polylines` and
+    `grid-centroids`) and alternate between categorized and graduated renderers on the `ID` field.
+    The first point layers use SVG markers, the first layers are labelled.
+
+    Peak memory is measured as the growth of the resident set size of the process, and with
+    tracemalloc where available (Python 3, Python objects only). Every export runs in a process
+    of its own, so that exports do not inherit each other's peak.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import multiprocessing
+from optparse import OptionParser
+from os import path
+
+from PyQt4.QtCore import *
+from PyQt4.QtGui import *
+from qgis.core import *
+
+QGIS_PREFIX = os.environ.get('QGIS_PREFIX_PATH', '/usr')
+TEST_WD     = path.dirname(path.abspath(__file__))
+SHAPE_PATH  = path.join(TEST_WD, 'data', 'shapefiles')
+SVG_MARKER  = path.join(TEST_WD, 'data', 'assets', 'map-marker.svg')
+
+"""Shapefiles layers cycle through, all of them have an `ID` field numbered from 0"""
+GEOMETRY_FILES = ['grid.shp', 'grid-polylines.shp', 'grid-centroids.shp']
+
+"""Number of features in each of the shapefiles above"""
+FEATURE_COUNT = 100
+
+"""Default configurations: (name, layers, classes, SVG-marked layers, labelled layers)"""
+CONFIGURATIONS = [
+    ('small',   10,  5,  2,   5),
+    ('medium', 100, 10, 10,  50),
+    ('large',  500, 20, 50, 250),
+]
+
+BACKENDS = ['mapscript', 'python']
+
+
+class DummyLegendInterface(object):
+    def isLayerVisible(self, layer):
+        return True
+
+
+# --------------------------------------------------------------------------------------------------
+# Synthetic projects
+# --------------------------------------------------------------------------------------------------
+
+def classSymbol(layer, i, svg):
+    symbol = QgsSymbolV2.defaultSymbol(layer.geometryType())
+    symbol.setColor(QColor.fromHsv((i * 37) % 360, 200, 200))
+
+    if svg:
+        symbol.appendSymbolLayer(QgsSvgMarkerSymbolLayerV2(SVG_MARKER, 4 + i % 4))
+
+    return symbol
+
+
+def categorizedRenderer(layer, classes, svg):
+    categories = [
+        QgsRendererCategoryV2(i, classSymbol(layer, i, svg), u'category %d' % i)
+        for i in range(classes)
+    ]
+    return QgsCategorizedSymbolRendererV2(u'ID', categories)
+
+
+def graduatedRenderer(layer, classes, svg):
+    step = float(FEATURE_COUNT) / classes
+    ranges = [
+        QgsRendererRangeV2(i * step, (i + 1) * step, classSymbol(layer, i, svg), u'range %d' % i)
+        for i in range(classes)
+    ]
+    return QgsGraduatedSymbolRendererV2(u'ID', ranges)
+
+
+def syntheticLayers(numLayers, numClasses, numSvgLayers, numLabelledLayers):
+    """Create the layers of a synthetic project and add them to the layer registry"""
+
+    layers = []
+    svgLayers = 0
+
+    for i in range(numLayers):
+        fileName = GEOMETRY_FILES[i % len(GEOMETRY_FILES)]
+        layer = QgsVectorLayer(path.join(SHAPE_PATH, fileName), u'layer %d' % i, 'ogr')
+        if not layer.isValid():
+            raise RuntimeError('Unable to load %s' % fileName)
+
+        svg = (layer.geometryType() == QGis.Point and svgLayers < numSvgLayers)
+        if svg:
+            svgLayers += 1
+
+        if i % 2 == 0:
+            layer.setRendererV2(categorizedRenderer(layer, numClasses, svg))
+        else:
+            layer.setRendererV2(graduatedRenderer(layer, numClasses, svg))
+
+        if i < numLabelledLayers:
+            ps = QgsPalLayerSettings()
+            ps.enabled = True
+            ps.fieldName = u'ID'
+            ps.writeToLayer(layer)
+
+        layers.append(layer)
+
+    QgsMapLayerRegistry.instance().addMapLayers(layers, False)
+
+    return layers
+
+
+# --------------------------------------------------------------------------------------------------
+# Measurements
+# --------------------------------------------------------------------------------------------------
+
+def residentSetSize():
+    """Return the resident set size of the process in bytes
+
+        Falls back to the peak resident set size where the current one cannot be read, and to
+        None where neither is available.
+    """
+
+    try:
+        with open('/proc/self/statm') as fin:
+            return int(fin.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        pass
+
+    try:
+        import resource
+        scale = 1 if sys.platform == 'darwin' else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    except ImportError:
+        return None
+
+
+class MemoryMeter(object):
+    """Measure the peak memory use of a block of code
+
+        `rssPeak` is the peak growth of the resident set size, which includes memory allocated by
+        QGis and mapscript. As the RSS can only be sampled, call `sample()` wherever memory use
+        is high. `pythonPeak` is the peak of the memory allocated by Python objects, as traced
+        by tracemalloc, and is only available with Python 3.
+    """
+
+    def __init__(self):
+        try:
+            import tracemalloc
+        except ImportError:
+            tracemalloc = None
+
+        self.tracemalloc = tracemalloc
+        self.baseline = None
+        self.rssPeak = None
+        self.pythonPeak = None
+
+    def __enter__(self):
+        self.baseline = residentSetSize()
+        self.rssPeak = 0
+
+        if self.tracemalloc is not None:
+            self.tracemalloc.start()
+
+        return self
+
+    def sample(self):
+        """Record the current memory use"""
+
+        rss = residentSetSize()
+        if rss is not None and self.baseline is not None:
+            self.rssPeak = max(self.rssPeak, rss - self.baseline)
+
+    def __exit__(self, *args):
+        self.sample()
+
+        if self.tracemalloc is not None:
+            self.pythonPeak = self.tracemalloc.get_traced_memory()[1]
+            self.tracemalloc.stop()
+
+        return False
+
+
+def initBenchmark():
+    global MapfileExporter, Profiler
+
+    QgsApplication.setPrefixPath(QGIS_PREFIX, True)
+    initBenchmark.app = QgsApplication([], False)
+    initBenchmark.app.initQgis()
+
+    from rt_mapserver_exporter import MapfileExporter, Profiler
+
+
+def runExport(job):
+    """Export a synthetic project in a worker process and return the measurements"""
+
+    (name, numLayers, numClasses, numSvgLayers, numLabelledLayers), backend, outDir = job
+
+    QgsMapLayerRegistry.instance().removeAllMapLayers()
+
+    start = time.time()
+    layers = syntheticLayers(numLayers, numClasses, numSvgLayers, numLabelledLayers)
+    setupSeconds = time.time() - start
+
+    extent = QgsRectangle(layers[0].extent())
+    for l in layers:
+        extent.combineExtentWith(l.extent())
+
+    mapfilePath = path.join(outDir, '%s-%s.map' % (name, backend))
+
+    # Sample the RSS at the end of every layer
+    meter = MemoryMeter()
+    profiler = Profiler.Profiler(
+        lambda phase, layer, seconds: meter.sample() if phase == 'layer' else None
+    )
+
+    with meter:
+        start = time.time()
+        ok = MapfileExporter.export(
+            name = name,
+            extent = extent,
+            projection = str(layers[0].crs().toProj4()),
+            shapePath = SHAPE_PATH,
+            backgroundColor = QColor(255, 255, 255),
+            mapfilePath = unicode(mapfilePath),
+            fontsetPath = u'fontset',
+            useSLD = False,
+            legend = DummyLegendInterface(),
+            layers = layers,
+            backend = backend,
+            profiler = profiler
+        )
+        seconds = time.time() - start
+
+    return {
+        'configuration': name,
+        'backend': backend,
+        'layers': numLayers,
+        'classes': numClasses,
+        'svgLayers': numSvgLayers,
+        'labelledLayers': numLabelledLayers,
+        'ok': bool(ok),
+        'setupSeconds': setupSeconds,
+        'seconds': seconds,
+        'peakMemory': meter.rssPeak,
+        'peakPythonMemory': meter.pythonPeak,
+        'mapfileSize': path.getsize(mapfilePath) if ok else None,
+        'phases': profiler.report()['phases'],
+    }
+
+
+# --------------------------------------------------------------------------------------------------
+# Reports
+# --------------------------------------------------------------------------------------------------
+
+def resultKey(result):
+    return (result['configuration'], result['backend'])
+
+
+def formatMemory(n):
+    return '-' if n is None else '%.1fMB' % (n / 1048576.0)
+
+
+def printResults(results, reference=None):
+    referenceResults = {}
+    if reference is not None:
+        referenceResults = dict((resultKey(r), r) for r in reference['results'])
+
+    print '%-10s %-10s %7s %10s %10s %10s' % (
+        'config', 'backend', 'layers', 'seconds', 'memory', 'vs. ref'
+    )
+
+    for r in results:
+        comparison = ''
+        ref = referenceResults.get(resultKey(r))
+        if ref is not None and ref['ok'] and r['ok']:
+            comparison = '%.2fx' % (ref['seconds'] / max(r['seconds'], 1e-6))
+
+        print '%-10s %-10s %7d %10.2f %10s %10s' % (
+            r['configuration'], r['backend'], r['layers'],
+            r['seconds'], formatMemory(r['peakMemory']), comparison
+        )
+
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-c', '--configuration', action='append', default=[],
+            metavar='NAME:LAYERS:CLASSES:SVG:LABELS',
+            help='benchmark this configuration instead of the default ones, may be repeated')
+    parser.add_option('-b', '--backend', action='append', default=[], choices=BACKENDS,
+            help='benchmark this backend only, may be repeated [default: all]')
+    parser.add_option('-r', '--repeat', type='int', default=3,
+            help='export each configuration this many times and keep the fastest [default: 3]')
+    parser.add_option('-o', '--output', metavar='FILE',
+            help='write the results to this JSON file')
+    parser.add_option('--compare', metavar='FILE',
+            help='compare the export times with those of an earlier run')
+
+    opts, args = parser.parse_args(argv)
+
+    configurations = CONFIGURATIONS
+    if opts.configuration:
+        configurations = []
+        for c in opts.configuration:
+            fields = c.split(':')
+            if len(fields) != 5:
+                parser.error('Invalid configuration: %s' % c)
+            configurations.append(tuple([fields[0]] + [int(f) for f in fields[1:]]))
+
+    backends = opts.backend or BACKENDS
+
+    reference = None
+    if opts.compare:
+        with open(opts.compare) as fin:
+            reference = json.load(fin)
+
+    outDir = tempfile.mkdtemp()
+    results = []
+
+    try:
+        for configuration in configurations:
+            for backend in backends:
+                best = None
+
+                for i in range(opts.repeat):
+                    # A fresh process for every export, so that peaks do not carry over
+                    pool = multiprocessing.Pool(1, initializer=initBenchmark)
+                    try:
+                        result = pool.apply(runExport, ((configuration, backend, outDir),))
+                    finally:
+                        pool.close()
+                        pool.join()
+
+                    if best is None or result['seconds'] < best['seconds']:
+                        best = result
+
+                results.append(best)
+                sys.stderr.write('%s/%s: %.2fs\n' % (configuration[0], backend, best['seconds']))
+    finally:
+        shutil.rmtree(outDir)
+
+    printResults(results, reference)
+
+    if opts.output:
+        with open(opts.output, 'w') as fout:
+            json.dump({
+                'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'host': platform.node(),
+                'python': platform.python_version(),
+                'qgis': QGis.QGIS_VERSION,
+                'repeat': opts.repeat,
+                'results': results,
+            }, fout, indent=2)
+
+    return 0 if all(r['ok'] for r in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
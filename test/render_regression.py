@@ -0,0 +1,296 @@
+"""Render regression and performance checks over the cases of `data/test.qgs`
+
+    Each layer of the test project (markers, SVG, line styles, graduated, categorized, complex
+    fills, labels, ...) is exported on its own with both backends, and both mapfiles are rendered
+    with mapscript. The images must match the reference image of the case in `data/reference`,
+    within a tolerance, and rendering must fit in the time budget of the case (see:
+    `RENDER_BUDGETS`), so that changes to the serializers can be judged on both correctness and
+    speed.
+
+    The images of both backends must also match each other. A case without a reference image
+    fails: reference images are only written when RT_UPDATE_REFERENCES is set, along with the
+    MapServer version that drew them (see: `data/reference/README`). Review them before checking
+    them in, as they come from the code under test. Budgets assume a typical development
+    machine, RT_BUDGET_FACTOR scales them for slower ones. Labels are drawn with the font in
+    RT_TEST_FONT, or the first of `FONT_CANDIDATES` found.
+
+    Needs PyQGis and mapscript, and writes into the source tree when updating references, so it
+    is not named like the unit tests. Run it like `test.py` (see: test.sh), or `make regression`:
+
+        LC_ALL=C PYTHONPATH=/usr/share/qgis/python:~/.qgis2/python/plugins \\
+            python2 -m unittest render_regression
+"""
+
+import os
+import sys
+import time
+import codecs
+import shutil
+import tempfile
+import unittest
+from os import path
+
+try:
+    from PyQt4.QtCore import *
+    from PyQt4.QtGui import *
+    from qgis.core import *
+    import mapscript
+    HAVE_QGIS = True
+except ImportError:
+    HAVE_QGIS = False
+
+QGIS_PREFIX    = '/usr'
+TEST_WD        = path.dirname(path.abspath(__file__))
+TEST_PROJECT   = path.join(TEST_WD, 'data', 'test.qgs')
+SHAPE_PATH     = path.join(TEST_WD, 'data')
+REFERENCE_PATH = path.join(TEST_WD, 'data', 'reference')
+VERSION_PATH   = path.join(REFERENCE_PATH, 'VERSION')
+
+IMAGE_SIZE         = (300, 300)
+EXTENT_BUFFER_SIZE = 10
+
+"""Render time budget of each case, in seconds (the fastest of `RENDER_REPEAT` renders)"""
+RENDER_BUDGETS = {
+    '01-single-point':        0.05,
+    '02-single-line':         0.05,
+    '03-single-polygon':      0.05,
+    '04-well-known-markers':  0.10,
+    '05-svg-markers':         0.20,
+    '06-font-marker':         0.10,
+    '07-line-styles':         0.10,
+    '08-line-cap-styles':     0.10,
+    '09-line-join-styles':    0.10,
+    '10-polygons-graduated':  0.10,
+    '11-polygons-categorized': 0.10,
+    '12-complex-fills':       0.20,
+    '13-basic-labeling':      0.20,
+    '14-label-positioning':   0.20
+}
+
+"""Number of times each mapfile is rendered"""
+RENDER_REPEAT = 5
+
+"""Largest difference, in any channel, between two pixels considered the same"""
+PIXEL_TOLERANCE = 16
+
+"""Largest fraction of differing pixels between an image and its reference"""
+MISMATCH_TOLERANCE = 0.005
+
+"""Fonts used for all the font aliases of the mapfiles, if RT_TEST_FONT is not set"""
+FONT_CANDIDATES = [
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+    '/usr/share/fonts/dejavu/DejaVuSans.ttf',
+    '/usr/share/fonts/TTF/DejaVuSans.ttf'
+]
+
+BACKENDS = ['mapscript', 'python']
+
+
+class DummyLegendInterface(object):
+    def isLayerVisible(self, layer):
+        return True
+
+
+def budgetFactor():
+    return float(os.environ.get('RT_BUDGET_FACTOR', '1'))
+
+
+def testFont():
+    candidates = [os.environ.get('RT_TEST_FONT')] + FONT_CANDIDATES
+    for fontPath in candidates:
+        if fontPath and path.isfile(fontPath):
+            return fontPath
+
+    return None
+
+
+def writeFontset(fontListPath, fontsetPath, fontPath):
+    """Map every font alias used by a mapfile to the same font (as test.sh does)"""
+
+    with codecs.open(fontListPath, 'r', 'utf-8') as fin:
+        aliases = [line.strip() for line in fin if line.strip() != '']
+
+    with codecs.open(fontsetPath, 'w', 'utf-8') as fout:
+        for alias in aliases:
+            fout.write(u'%s %s\n' % (alias, fontPath))
+
+
+def referenceVersion():
+    """Return the version of MapServer the reference images were drawn with, None if unknown"""
+
+    if not path.isfile(VERSION_PATH):
+        return None
+
+    with codecs.open(VERSION_PATH, 'r', 'utf-8') as fin:
+        return fin.read().strip()
+
+
+def imageDifference(image, reference):
+    """Return the fraction of pixels differing by more than `PIXEL_TOLERANCE` in any channel"""
+
+    if image.size() != reference.size():
+        return 1.0
+
+    differing = 0
+    for y in range(image.height()):
+        for x in range(image.width()):
+            a, b = image.pixel(x, y), reference.pixel(x, y)
+            if a != b and max(
+                abs(qRed(a) - qRed(b)), abs(qGreen(a) - qGreen(b)), abs(qBlue(a) - qBlue(b)),
+                abs(qAlpha(a) - qAlpha(b))
+            ) > PIXEL_TOLERANCE:
+                differing += 1
+
+    return differing / float(image.width() * image.height())
+
+
+@unittest.skipUnless(HAVE_QGIS, 'PyQGis and mapscript are required')
+class RenderRegressionTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        QgsApplication.setPrefixPath(QGIS_PREFIX, True)
+        cls.qgs = QgsApplication(sys.argv, False)
+        cls.qgs.initQgis()
+
+        QgsProject.instance().setFileName(TEST_PROJECT)
+        QgsProject.instance().read(QFileInfo(TEST_PROJECT))
+
+        from rt_mapserver_exporter import MapfileExporter
+        cls.exporter = MapfileExporter
+
+        cls.tempDir = tempfile.mkdtemp()
+        cls.font = testFont()
+        cls.timings = []
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tempDir)
+
+        for case, backend, seconds in cls.timings:
+            sys.stderr.write('\n%-24s %-10s %7.1f ms (budget %.0f ms)' % (
+                case, backend, seconds * 1000, RENDER_BUDGETS[case] * budgetFactor() * 1000
+            ))
+        sys.stderr.write('\n')
+
+    def export(self, layer, backend):
+        caseDir = path.join(self.tempDir, '%s-%s' % (layer.name(), backend))
+        os.makedirs(caseDir)
+
+        mapfilePath = path.join(caseDir, 'test.map')
+        fontsetPath = path.join(caseDir, 'fontset')
+
+        ok = self.exporter.export(
+            name = str(layer.name()),
+            width = IMAGE_SIZE[0],
+            height = IMAGE_SIZE[1],
+            extent = layer.extent().buffer(EXTENT_BUFFER_SIZE),
+            projection = str(layer.crs().toProj4()),
+            shapePath = SHAPE_PATH,
+            backgroundColor = QColor(255, 255, 255),
+            imageType = 'png',
+            mapfilePath = mapfilePath,
+            fontsetPath = fontsetPath,
+            useSLD = False,
+            legend = DummyLegendInterface(),
+            layers = [layer],
+            backend = backend
+        )
+        self.assertTrue(ok)
+
+        writeFontset(path.join(caseDir, 'fonts.txt'), fontsetPath, self.font)
+
+        return mapfilePath
+
+    def render(self, mapfilePath):
+        """Render a mapfile, return the image and the fastest render time"""
+
+        msMap = mapscript.mapObj(mapfilePath)
+
+        best = None
+        for i in range(RENDER_REPEAT):
+            start = time.time()
+            msImage = msMap.draw()
+            seconds = time.time() - start
+            best = seconds if best is None else min(best, seconds)
+
+        imagePath = mapfilePath[:-len('.map')] + '.png'
+        msImage.save(imagePath)
+
+        return QImage(imagePath).convertToFormat(QImage.Format_ARGB32), best
+
+    def checkCase(self, case):
+        if self.font is None:
+            self.skipTest('No font to draw labels with, set RT_TEST_FONT')
+
+        layers = QgsMapLayerRegistry.instance().mapLayersByName(case)
+        self.assertEqual(len(layers), 1)
+
+        referencePath = path.join(REFERENCE_PATH, case + '.png')
+        images = {}
+
+        for backend in BACKENDS:
+            image, seconds = self.render(self.export(layers[0], backend))
+            images[backend] = image
+            self.timings.append((case, backend, seconds))
+
+            self.assertTrue(
+                seconds <= RENDER_BUDGETS[case] * budgetFactor(),
+                '%s (%s backend) renders in %.1f ms, over its %.1f ms budget' % (
+                    case, backend, seconds * 1000, RENDER_BUDGETS[case] * budgetFactor() * 1000
+                )
+            )
+
+        # Both backends must draw the same map, whether or not there is a reference yet
+        difference = imageDifference(images['python'], images['mapscript'])
+        self.assertTrue(
+            difference <= MISMATCH_TOLERANCE,
+            '%s differs between the backends by %.2f%% of its pixels' % (case, difference * 100)
+        )
+
+        if os.environ.get('RT_UPDATE_REFERENCES'):
+            if not path.isdir(REFERENCE_PATH):
+                os.makedirs(REFERENCE_PATH)
+
+            images['mapscript'].save(referencePath)
+            with codecs.open(VERSION_PATH, 'w', 'utf-8') as fout:
+                fout.write(mapscript.msGetVersion().decode('utf-8') + u'\n')
+
+        self.assertTrue(
+            path.isfile(referencePath),
+            'No reference image for %s, see data/reference/README' % case
+        )
+
+        reference = QImage(referencePath).convertToFormat(QImage.Format_ARGB32)
+
+        # Anti-aliasing changes between versions of MapServer and AGG
+        version = mapscript.msGetVersion().decode('utf-8')
+        if referenceVersion() not in (None, version):
+            versions = u' (reference images drawn by %s, not %s)' % (referenceVersion(), version)
+        else:
+            versions = u''
+
+        for backend in BACKENDS:
+            difference = imageDifference(images[backend], reference)
+            self.assertTrue(
+                difference <= MISMATCH_TOLERANCE,
+                '%s (%s backend) differs from its reference image by %.2f%% of its pixels%s' % (
+                    case, backend, difference * 100, versions
+                )
+            )
+
+def caseTest(case):
+    def test(self):
+        self.checkCase(case)
+
+    test.__doc__ = 'Render %s' % case
+    return test
+
+
+# One test per case, e.g. `test_05_svg_markers`
+for case in sorted(RENDER_BUDGETS):
+    setattr(RenderRegressionTest, 'test_' + case.replace('-', '_'), caseTest(case))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,189 @@
+"""Check that the pure Python backend produces the same map as the mapscript backend
+
+    Both backends export `data/test.qgs`, then both mapfiles are loaded with mapscript and their
+    layers, classes, styles, labels and symbols are compared. Symbols are compared by definition,
+    as their names are random.
+
+    Needs PyQGis and mapscript, run it like `test.py` (see: test.sh):
+
+        LC_ALL=C PYTHONPATH=/usr/share/qgis/python:~/.qgis2/python/plugins \\
+            python2 -m unittest test_backends
+"""
+
+import sys
+import shutil
+import tempfile
+import unittest
+from os import path
+
+try:
+    from PyQt4.QtCore import *
+    from PyQt4.QtGui import *
+    from qgis.core import *
+    import mapscript
+    HAVE_QGIS = True
+except ImportError:
+    HAVE_QGIS = False
+
+QGIS_PREFIX  = '/usr'
+TEST_WD      = path.dirname(path.abspath(__file__))
+TEST_PROJECT = path.join(TEST_WD, 'data', 'test.qgs')
+SHAPE_PATH   = path.join(TEST_WD, 'data')
+
+
+class DummyLegendInterface(object):
+    def isLayerVisible(self, layer):
+        return True
+
+
+def describeColor(c):
+    return (c.red, c.green, c.blue)
+
+
+def describeSymbol(msMap, name):
+    """Describe a symbol by its definition rather than by its (random) name"""
+
+    if not name:
+        return None
+
+    s = msMap.symbolset.getSymbolByName(name)
+    line = s.getPoints()
+    points = [(line.get(i).x, line.get(i).y) for i in range(line.numpoints)]
+
+    return (s.type, s.filled, s.font, s.character, s.imagepath, points)
+
+
+def describeStyle(msMap, s):
+    return (
+        describeSymbol(msMap, s.symbolname), describeColor(s.color),
+        describeColor(s.outlinecolor), s.size, s.width, s.angle, s.gap, s.opacity,
+        s.linecap, s.linejoin
+    )
+
+
+def describeLabel(l):
+    return (
+        l.font, l.size, l.minsize, l.maxsize, l.position, l.offsetx, l.offsety, l.angle,
+        describeColor(l.color), l.wrap, l.partials, l.force, l.priority, l.buffer,
+        l.getBinding(mapscript.MS_LABEL_BINDING_ANGLE)
+    )
+
+
+def describeClass(msMap, c):
+    return (
+        c.name, c.getExpressionString(),
+        [describeStyle(msMap, c.getStyle(i)) for i in range(c.numstyles)],
+        [describeLabel(c.getLabel(i)) for i in range(c.numlabels)]
+    )
+
+
+def describeLayer(msMap, l):
+    e = l.extent
+    return (
+        l.name, l.type, l.status, l.data, l.connection, l.connectiontype, l.getProjection(),
+        (e.minx, e.miny, e.maxx, e.maxy), l.minscaledenom, l.maxscaledenom, l.labelitem,
+        l.sizeunits, l.opacity, l.getMetaData('ows_title'), l.getMetaData('ows_srs'),
+        [describeClass(msMap, l.getClass(i)) for i in range(l.numclasses)]
+    )
+
+
+def describeMap(msMap):
+    e = msMap.extent
+    return (
+        msMap.name, msMap.width, msMap.height, msMap.units, (e.minx, e.miny, e.maxx, e.maxy),
+        msMap.getProjection(), msMap.imagetype, msMap.getMetaData('ows_title'),
+        [describeLayer(msMap, msMap.getLayer(i)) for i in range(msMap.numlayers)]
+    )
+
+
+@unittest.skipUnless(HAVE_QGIS, 'PyQGis and mapscript are required')
+class BackendEquivalenceTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        QgsApplication.setPrefixPath(QGIS_PREFIX, True)
+        cls.qgs = QgsApplication(sys.argv, False)
+        cls.qgs.initQgis()
+
+        QgsProject.instance().setFileName(TEST_PROJECT)
+        QgsProject.instance().read(QFileInfo(TEST_PROJECT))
+
+        from rt_mapserver_exporter import MapfileExporter
+        cls.exporter = MapfileExporter
+
+        cls.tempDir = tempfile.mkdtemp()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tempDir)
+
+    def export(self, backend):
+        layers = QgsMapLayerRegistry.instance().mapLayers().values()
+        extent = QgsRectangle(layers[0].extent())
+        for l in layers:
+            extent.combineExtentWith(l.extent())
+
+        mapfilePath = path.join(self.tempDir, '%s.map' % backend)
+
+        ok = self.exporter.export(
+            name = 'test',
+            extent = extent,
+            projection = str(layers[0].crs().toProj4()),
+            shapePath = SHAPE_PATH,
+            backgroundColor = QColor(255, 255, 255),
+            mapfilePath = mapfilePath,
+            useSLD = False,
+            legend = DummyLegendInterface(),
+            layers = layers,
+            backend = backend
+        )
+        self.assertTrue(ok)
+
+        return mapscript.mapObj(mapfilePath)
+
+    def testBackendsProduceEquivalentMaps(self):
+        reference = self.export(self.exporter.BACKEND_MAPSCRIPT)
+        streamed = self.export(self.exporter.BACKEND_PYTHON)
+
+        self.assertEqual(describeMap(streamed), describeMap(reference))
+
+    def testSymbolsAreInterned(self):
+        streamed = self.export(self.exporter.BACKEND_PYTHON)
+
+        # Index 0 is the default symbol
+        definitions = [
+            repr(describeSymbol(streamed, streamed.symbolset.getSymbol(i).name))
+            for i in range(1, streamed.symbolset.numsymbols)
+        ]
+        self.assertEqual(len(definitions), len(set(definitions)))
+
+    def testSldStylesAreShared(self):
+        layer = QgsMapLayerRegistry.instance().mapLayersByName('10-polygons-graduated')[0]
+        copy = QgsVectorLayer(layer.source(), 'copy', layer.providerType())
+        copy.setRendererV2(layer.rendererV2().clone())
+
+        mapfilePath = path.join(self.tempDir, 'sld.map')
+        ok = self.exporter.export(
+            name = 'sld',
+            extent = layer.extent(),
+            projection = str(layer.crs().toProj4()),
+            shapePath = SHAPE_PATH,
+            mapfilePath = mapfilePath,
+            useSLD = True,
+            legend = DummyLegendInterface(),
+            layers = [layer, copy]
+        )
+        self.assertTrue(ok)
+
+        msMap = mapscript.mapObj(mapfilePath)
+        first, second = msMap.getLayer(0), msMap.getLayer(1)
+
+        self.assertTrue(first.numclasses > 0)
+        self.assertEqual(
+            [describeClass(msMap, second.getClass(i)) for i in range(second.numclasses)],
+            [describeClass(msMap, first.getClass(i)) for i in range(first.numclasses)]
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+"""Unit tests for the renderer to class compiler in ClassCompiler.py
+
+    These do not need QGis or mapscript. Run them with:
+
+        python2 -m unittest discover -s test -p 'test_*.py'
+"""
+
+import sys
+import unittest
+from os import path
+
+TEST_WD = path.dirname(path.abspath(__file__))
+sys.path.insert(0, path.dirname(TEST_WD))
+
+import ClassCompiler
+from ExpressionCompiler import column, literal, conjunction
+
+
+class CompileCategoriesTest(unittest.TestCase):
+
+    def testPlainValuesAndLists(self):
+        classes, usesClassItem = ClassCompiler.compileCategories(u'landuse', [
+            (u'forest', 'green'), (u'water', 'blue'), (u'park', 'green'), (u'lake', 'blue'),
+            (u'urban', 'grey')
+        ])
+
+        self.assertTrue(usesClassItem)
+        self.assertEqual(classes, [
+            (u'{forest,park}', [0, 2]), (u'{water,lake}', [1, 3]), (u'urban', [4])
+        ])
+
+    def testCatchAllComesLast(self):
+        classes, usesClassItem = ClassCompiler.compileCategories(u'code', [
+            (u'', 'grey'), (u'1', 'red'), (u'2', 'grey'), (u'3', 'blue'), (u'1', 'blue')
+        ], ClassCompiler.FIELD_INTEGER)
+
+        # Categories looking like the catch-all one are left to it, repeated values are dead
+        self.assertEqual(classes, [(u'1', [1]), (u'3', [3]), (None, [0])])
+
+    def testRealValuesAreComparedAsNumbers(self):
+        classes, usesClassItem = ClassCompiler.compileCategories(u'ratio', [
+            (u'0.5', 'a'), (u'1.25', 'a')
+        ], ClassCompiler.FIELD_REAL)
+
+        self.assertFalse(usesClassItem)
+        self.assertEqual(classes, [(u'([ratio] = 0.5 OR [ratio] = 1.25)', [0, 1])])
+
+    def testSpecialValuesFallBackToLogicalExpressions(self):
+        classes, usesClassItem = ClassCompiler.compileCategories(u'name', [
+            (u'(a)', 'x'), (u'b,c', 'y'), (u'd', 'y')
+        ])
+
+        self.assertFalse(usesClassItem)
+        self.assertEqual(classes, [
+            (u'("[name]" = "(a)")', [0]), (u'("[name]" = "b,c" OR "[name]" = "d")', [1, 2])
+        ])
+
+
+class CompileRangesTest(unittest.TestCase):
+
+    def testAdjacentRangesAreMerged(self):
+        classes = ClassCompiler.compileRanges(u'pop', [
+            (0.0, 10.5, 'a'), (10.5, 20.0, 'a'), (20.0, 30.0, 'b'), (40.0, 50.0, 'b')
+        ])
+
+        self.assertEqual(classes, [
+            (u'([pop] >= 0.0 AND [pop] <= 20.0)', [0, 1]),
+            (u'([pop] > 20.0 AND [pop] <= 30.0)', [2]),
+            (u'([pop] > 40.0 AND [pop] <= 50.0)', [3])
+        ])
+
+
+def equals(attr, value):
+    return (u'compare', u'=', column(attr), literal(value))
+
+
+class CompileRulesTest(unittest.TestCase):
+
+    def testNestedRulesAreFlattenedAndFactored(self):
+        roads = equals(u'kind', u'road')
+        layerFilter, scales, classes = ClassCompiler.compileRules([
+            (roads, 0, 0, False, None, [
+                (equals(u'class', u'track'), 1000, 50000, False, 0, []),
+                (None, 1000, 0, True, 1, [])
+            ]),
+            (roads, 1000, 25000, False, 2, [])
+        ])
+
+        # The last rule is shadowed by the else rule
+        self.assertEqual(layerFilter, roads)
+        self.assertEqual(scales, (1000, 0))
+        self.assertEqual(classes, [
+            (equals(u'class', u'track'), 0, 50000, [0]),
+            (None, 0, 0, [1])
+        ])
+
+    def testParentSymbolsComeFirst(self):
+        layerFilter, scales, classes = ClassCompiler.compileRules([
+            (equals(u'a', 1), 0, 0, False, 0, [
+                (equals(u'b', 2), 0, 10000, False, 1, []),
+                (equals(u'b', 3), 20000, 10000, False, 2, [])
+            ])
+        ])
+
+        # The rule with an empty scale range is dropped
+        self.assertEqual(layerFilter, equals(u'a', 1))
+        self.assertEqual(classes, [(equals(u'b', 2), 0, 10000, [0, 1]), (None, 0, 0, [0])])
+
+    def testOnlyExclusiveClassesAreReordered(self):
+        pattern = (u'match', u'regexp', column(u'name'), u'^A')
+        layerFilter, scales, classes = ClassCompiler.compileRules([
+            (pattern, 0, 0, False, 0, []),
+            (equals(u'class', u'primary'), 0, 0, False, 1, []),
+            (equals(u'class', u'secondary'), 0, 5000, False, 2, []),
+            (equals(u'class', u'motorway'), 0, 0, False, 3, [])
+        ])
+
+        # Regexes are expensive, but could match the same features as the other classes
+        self.assertEqual(layerFilter, None)
+        self.assertEqual([cls[3] for cls in classes], [[0], [1], [2], [3]])
+
+        layerFilter, scales, classes = ClassCompiler.compileRules([
+            (conjunction([equals(u'class', u'primary'), pattern]), 0, 0, False, 0, []),
+            (equals(u'class', u'secondary'), 0, 0, False, 1, []),
+            (equals(u'class', u'motorway'), 0, 0, False, 2, [])
+        ])
+
+        self.assertEqual([cls[3] for cls in classes], [[1], [2], [0]])
+
+    def testStringClassesKeepTheirOrder(self):
+        rules = [
+            (equals(u'code', 2), 0, 0, False, 0, []),
+            ((u'compare', u'>', column(u'code'), literal(10)), 0, 0, False, 1, [])
+        ]
+
+        # Numbers: the comparison matches more features, and none of those of the equality
+        layerFilter, scales, classes = ClassCompiler.compileRules(rules)
+        self.assertEqual([cls[3] for cls in classes], [[1], [0]])
+
+        # Strings: '2' > '10', so both classes may match the same features
+        layerFilter, scales, classes = ClassCompiler.compileRules(rules, set([u'code']))
+        self.assertEqual([cls[3] for cls in classes], [[0], [1]])
+
+    def testFalseRulesAreDropped(self):
+        self.assertEqual(
+            ClassCompiler.compileRules([(literal(None), 0, 0, False, 0, [])]),
+            (None, (0, 0), [])
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
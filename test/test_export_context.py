@@ -0,0 +1,64 @@
+"""Check the state shared by the layers of an export (see: ExportContext.py)
+
+    Needs PyQGis, run it like `test.py` (see: test.sh):
+
+        LC_ALL=C PYTHONPATH=/usr/share/qgis/python:~/.qgis2/python/plugins \\
+            python2 -m unittest test_export_context
+"""
+
+import sys
+import unittest
+
+try:
+    from PyQt4.QtCore import *
+    from PyQt4.QtGui import *
+    from qgis.core import *
+    HAVE_QGIS = True
+except ImportError:
+    HAVE_QGIS = False
+
+QGIS_PREFIX = '/usr'
+
+
+@unittest.skipUnless(HAVE_QGIS, 'PyQGis is required')
+class ExportContextTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        QgsApplication.setPrefixPath(QGIS_PREFIX, True)
+        cls.qgs = QgsApplication(sys.argv, False)
+        cls.qgs.initQgis()
+
+        from rt_mapserver_exporter import ExportContext, SerializationUtils
+        cls.contextModule = ExportContext
+        cls.utils = SerializationUtils
+
+    def setUp(self):
+        self.context = self.contextModule.ExportContext()
+
+    def testLabelingEngineIsShared(self):
+        self.assertTrue(self.context.labelingEngine() is self.context.labelingEngine())
+        self.assertTrue(self.context.renderContext() is None)
+
+    def testFontDefinitionsAreMemoized(self):
+        font = QFont('DejaVu Sans', 12)
+        definition = self.context.fontDefinition(font, u'Bold')
+
+        self.assertEqual(definition, self.utils.serializeFontDefinition(font, u'Bold'))
+        self.assertTrue(self.context.fontDefinition(QFont('DejaVu Sans', 12), u'Bold') is definition)
+        self.assertFalse(self.context.fontDefinition(font, u'Normal') is definition)
+
+    def testCrsStringsAreMemoized(self):
+        crs = QgsCoordinateReferenceSystem(4326, QgsCoordinateReferenceSystem.EpsgCrsId)
+        strings = self.context.crsStrings(crs)
+
+        self.assertEqual(strings, (unicode(crs.toProj4()), u'EPSG:4326'))
+        self.assertTrue(self.context.crsStrings(QgsCoordinateReferenceSystem(crs)) is strings)
+
+        # Invalid CRSs have no id to tell them apart
+        self.context.crsStrings(QgsCoordinateReferenceSystem())
+        self.assertEqual(self.context._crsStrings.keys(), [crs.srsid()])
+
+
+if __name__ == '__main__':
+    unittest.main()
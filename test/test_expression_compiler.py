@@ -0,0 +1,246 @@
+"""Unit tests for the expression compiler in ExpressionCompiler.py
+
+    These do not need QGis or mapscript. Run them with:
+
+        python2 -m unittest discover -s test -p 'test_*.py'
+"""
+
+import sys
+import unittest
+from os import path
+
+TEST_WD = path.dirname(path.abspath(__file__))
+sys.path.insert(0, path.dirname(TEST_WD))
+
+import ExpressionCompiler as ec
+from ExpressionCompiler import column, literal
+
+
+def equals(attr, value):
+    return (u'compare', u'=', column(attr), literal(value))
+
+
+class ToMapServerTest(unittest.TestCase):
+
+    def testComparisonsFollowOperandTypes(self):
+        self.assertEqual(
+            ec.toMapServer(equals(u'name', u'Main "St"')), u'("[name]" = "Main \\"St\\"")'
+        )
+        self.assertEqual(ec.toMapServer(equals(u'lanes', 2)), u'([lanes] = 2)')
+        self.assertEqual(
+            ec.toMapServer((u'compare', u'<>', column(u'code'), literal(1.5)), [u'code']),
+            u'("[code]" != "1.5")'
+        )
+        self.assertEqual(
+            ec.toMapServer((u'compare', u'>=', (u'arithmetic', u'*', column(u'a'), literal(2)),
+                column(u'b'))),
+            u'(([a] * 2) >= [b])'
+        )
+
+    def testLogicalOperators(self):
+        tree = (u'or', (
+            ec.conjunction([equals(u'a', 1), (u'not', equals(u'b', 2))]),
+            (u'null', column(u'c'), False)
+        ))
+        self.assertEqual(
+            ec.toMapServer(tree), u'((([a] = 1) AND (NOT ([b] = 2))) OR ("[c]" = ""))'
+        )
+
+    def testPatternsBecomeRegularExpressions(self):
+        self.assertEqual(
+            ec.toMapServer((u'match', u'like', column(u'name'), u'A.%_')),
+            u'("[name]" ~ "^A\\..*.$")'
+        )
+        self.assertEqual(
+            ec.toMapServer((u'match', u'ilike', column(u'name'), u'%road')),
+            u'("[name]" ~* "^.*road$")'
+        )
+
+    def testInLists(self):
+        self.assertEqual(
+            ec.toMapServer((u'in', column(u'a'), (literal(1), literal(2)), True)),
+            u'(NOT ([a] IN "1,2"))'
+        )
+        self.assertEqual(
+            ec.toMapServer((u'in', column(u'a'), (literal(u'x,y'), literal(u'z')), False)),
+            u'(("[a]" = "x,y") OR ("[a]" = "z"))'
+        )
+
+    def testUntranslatableTrees(self):
+        self.assertRaises(ec.ExpressionCompileError, ec.toMapServer, equals(u'a', None))
+        self.assertRaises(ec.ExpressionCompileError, ec.toMapServer,
+                (u'null', literal(1), False))
+        self.assertRaises(ec.ExpressionCompileError, ec.toMapServer, column(u'a'))
+
+
+class ToMapServerStringTest(unittest.TestCase):
+
+    def testConcatenations(self):
+        tree = (u'concat', (
+            column(u'name'), literal(u' ('),
+            (u'function', u'format_number', (
+                (u'arithmetic', u'/', column(u'area'), literal(10000)), literal(2)
+            )),
+            literal(u' ha)')
+        ), False)
+        self.assertEqual(
+            ec.toMapServerString(tree),
+            u'("[name]" + " (" + commify(tostring(([area] / 10000), "%.2f")) + " ha)")'
+        )
+
+    def testFunctions(self):
+        self.assertEqual(
+            ec.toMapServerString((u'function', u'title', (column(u'name'),))),
+            u'(initcap("[name]"))'
+        )
+        self.assertEqual(
+            ec.toMapServerString((u'function', u'to_string', (column(u'pop'),))),
+            u'("[pop]")'
+        )
+        self.assertEqual(
+            ec.toMapServer((u'compare', u'>', (u'function', u'length', (column(u'name'),)),
+                literal(3))),
+            u'(length("[name]") > 3)'
+        )
+        self.assertRaises(ec.ExpressionCompileError, ec.toMapServerString,
+                (u'function', u'format_number', (column(u'a'), column(u'b'))))
+        self.assertRaises(ec.ExpressionCompileError, ec.toMapServerString,
+                (u'function', u'upper', ()))
+
+
+class ToSqlTest(unittest.TestCase):
+
+    def testConditions(self):
+        tree = ec.conjunction([
+            equals(u'kind', u"o'clock"),
+            (u'in', column(u'a'), (literal(1), literal(2)), True),
+            (u'null', column(u'b "c"'), True),
+            (u'match', u'ilike', column(u'name'), u'%road'),
+            (u'compare', u'>', (u'arithmetic', u'/', column(u'pop'), literal(2)), literal(1.5))
+        ])
+        self.assertEqual(ec.toSql(tree), u' AND '.join([
+            u"((\"kind\" = 'o''clock')",
+            u'("a" NOT IN (1, 2))',
+            u'("b ""c""" IS NOT NULL)',
+            u"(\"name\" ILIKE '%road')",
+            u'(("pop" / 2::float8) > 1.5))'
+        ]))
+
+    def testValues(self):
+        self.assertEqual(
+            ec.toSql((u'concat', (column(u'a'), (u'function', u'length', (column(u'b'),))), False),
+                set([u'a', u'b'])),
+            u'("a" || CAST(char_length("b") AS text))'
+        )
+        self.assertEqual(ec.toSql(literal(None)), u'NULL')
+        self.assertRaises(ec.ExpressionCompileError, ec.toSql,
+                (u'function', u'format_number', (column(u'a'), literal(2))))
+
+    def testConcatSkipsNulls(self):
+        self.assertEqual(
+            ec.toSql((u'concat', (column(u'a'), literal(u'-'), column(u'b')), True), set([u'a'])),
+            u"(COALESCE(\"a\", '') || COALESCE('-', '') || COALESCE(CAST(\"b\" AS text), ''))"
+        )
+
+    def testMixedTypes(self):
+        strings = set([u'code', u'name'])
+
+        # Numbers compared with strings are compared as strings
+        self.assertEqual(ec.toSql(equals(u'code', 5), strings), u"(\"code\" = '5')")
+        self.assertEqual(
+            ec.toSql((u'in', column(u'code'), (literal(1), literal(u'2a')), False), strings),
+            u"(\"code\" IN ('1', '2a'))"
+        )
+
+        # Unless they are numeric attributes, which strings holding numbers are compared with
+        self.assertEqual(ec.toSql(equals(u'pop', u'10'), strings), u'("pop" = 10)')
+        self.assertEqual(
+            ec.toSql((u'match', u'like', column(u'pop'), u'1%'), strings),
+            u"(CAST(\"pop\" AS text) LIKE '1%')"
+        )
+
+        self.assertRaises(ec.ExpressionCompileError, ec.toSql, equals(u'pop', u'x'), strings)
+        self.assertRaises(ec.ExpressionCompileError, ec.toSql,
+                (u'compare', u'=', column(u'name'), column(u'pop')), strings)
+
+
+class ColumnsTest(unittest.TestCase):
+
+    def testColumnsOfAllOperands(self):
+        tree = ec.conjunction([
+            (u'in', column(u'a'), (literal(1), column(u'b')), False),
+            (u'match', u'like', (u'function', u'upper', (column(u'c'),)), u'X%'),
+            (u'null', (u'concat', (column(u'd'), literal(u'x')), False), True),
+            (u'not', (u'compare', u'<', (u'negate', column(u'e')), column(u'a')))
+        ])
+        self.assertEqual(ec.columns(tree), set([u'a', u'b', u'c', u'd', u'e']))
+        self.assertEqual(ec.columns(literal(1)), set())
+
+
+class ExcludesTest(unittest.TestCase):
+
+    def testValuesAndIntervals(self):
+        self.assertTrue(ec.excludes([equals(u'a', u'x')], [equals(u'a', u'y')]))
+        self.assertTrue(ec.excludes(
+            [(u'in', column(u'a'), (literal(1), literal(2)), False)], [equals(u'a', 3)]
+        ))
+        self.assertTrue(ec.excludes(
+            [(u'compare', u'<', column(u'a'), literal(10))],
+            [(u'compare', u'<=', literal(10), column(u'a'))]
+        ))
+        self.assertFalse(ec.excludes(
+            [(u'compare', u'<=', column(u'a'), literal(10))],
+            [(u'compare', u'>=', column(u'a'), literal(10))]
+        ))
+        self.assertFalse(ec.excludes([equals(u'a', u'x')], [equals(u'b', u'y')]))
+
+    def testStringsAreComparedAsStrings(self):
+        # Both match '2': strings have no numeric intervals
+        self.assertFalse(ec.excludes(
+            [(u'compare', u'>', column(u'name'), literal(u'10'))],
+            [(u'compare', u'<', column(u'name'), literal(u'9'))]
+        ))
+        self.assertFalse(ec.excludes(
+            [(u'compare', u'>', column(u'name'), literal(10))],
+            [(u'compare', u'<', column(u'name'), literal(9))], set([u'name'])
+        ))
+        self.assertTrue(ec.excludes(
+            [(u'compare', u'>', column(u'pop'), literal(10))],
+            [(u'compare', u'<', column(u'pop'), literal(9))], set([u'name'])
+        ))
+
+        # Values of string attributes are the strings MapServer compares
+        self.assertTrue(ec.excludes(
+            [equals(u'name', 2)], [(u'in', column(u'name'), (literal(u'3'), literal(4)), False)],
+            set([u'name'])
+        ))
+        self.assertFalse(ec.excludes(
+            [equals(u'name', 2)], [equals(u'name', u'2')], set([u'name'])
+        ))
+        self.assertTrue(ec.excludes(
+            [equals(u'name', 2.0)], [equals(u'name', u'2')], set([u'name'])
+        ))
+
+    def testNegations(self):
+        self.assertTrue(ec.excludes(
+            [equals(u'a', 1)], [(u'not', equals(u'a', 1)), equals(u'b', 2)]
+        ))
+
+
+class EstimatesTest(unittest.TestCase):
+
+    def testRegularExpressionsCostMore(self):
+        self.assertTrue(
+            ec.cost((u'match', u'regexp', column(u'a'), u'x')) > ec.cost(equals(u'a', u'x'))
+        )
+
+    def testSelectivity(self):
+        self.assertAlmostEqual(
+            ec.selectivity(ec.conjunction([equals(u'a', 1), equals(u'b', 1)])), 0.01
+        )
+        self.assertAlmostEqual(ec.selectivity((u'not', equals(u'a', 1))), 0.9)
+        self.assertEqual(ec.selectivity(literal(False)), 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
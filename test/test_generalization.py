@@ -0,0 +1,77 @@
+"""Check the scale-banded export of generalized layers (see: Generalization.py)
+
+    Needs PyQGis, run it like `test.py` (see: test.sh):
+
+        LC_ALL=C PYTHONPATH=/usr/share/qgis/python:~/.qgis2/python/plugins \\
+            python2 -m unittest test_generalization
+"""
+
+import sys
+import shutil
+import tempfile
+import unittest
+from os import path
+
+try:
+    from PyQt4.QtCore import *
+    from PyQt4.QtGui import *
+    from qgis.core import *
+    HAVE_QGIS = True
+except ImportError:
+    HAVE_QGIS = False
+
+QGIS_PREFIX = '/usr'
+TEST_WD     = path.dirname(path.abspath(__file__))
+SHAPEFILES  = path.join(TEST_WD, 'data', 'shapefiles')
+
+
+class DummyLegendInterface(object):
+    def isLayerVisible(self, layer):
+        return layer.name() == u'grid'
+
+
+@unittest.skipUnless(HAVE_QGIS, 'PyQGis is required')
+class GeneralizationTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        QgsApplication.setPrefixPath(QGIS_PREFIX, True)
+        cls.qgs = QgsApplication(sys.argv, False)
+        cls.qgs.initQgis()
+
+        from rt_mapserver_exporter import Generalization
+        cls.generalization = Generalization
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def testLayersAreSplitIntoBands(self):
+        polygons = QgsVectorLayer(path.join(SHAPEFILES, 'grid.shp'), 'grid', 'ogr')
+        points = QgsVectorLayer(path.join(SHAPEFILES, 'grid-centroids.shp'), 'points', 'ogr')
+        tolerances = {u'grid': [1, 10], u'points': [1, 10]}
+
+        layers, legend = self.generalization.generalize(
+            [polygons, points], DummyLegendInterface(), tolerances, self.tempDir
+        )
+
+        # Points are left alone
+        self.assertEqual([l.name() for l in layers], [u'grid_0', u'grid_1', u'grid_2', u'points'])
+
+        bands = layers[:3]
+        self.assertEqual(bands[0].source(), polygons.source())
+        for band in bands:
+            self.assertTrue(band.isValid())
+            self.assertTrue(legend.isLayerVisible(band))
+            self.assertEqual(band.customProperty(self.generalization.GROUP_PROPERTY), u'grid')
+            self.assertEqual(band.featureCount(), polygons.featureCount())
+
+        # Bands follow each other
+        self.assertEqual(bands[0].maximumScale(), bands[1].minimumScale())
+        self.assertEqual(bands[1].maximumScale(), bands[2].minimumScale())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+"""Check the consolidation of look-alike layers into tiled layers (see: LayerGroups.py)
+
+    Needs PyQGis, run it like `test.py` (see: test.sh):
+
+        LC_ALL=C PYTHONPATH=/usr/share/qgis/python:~/.qgis2/python/plugins \\
+            python2 -m unittest test_layer_groups
+"""
+
+import sys
+import shutil
+import tempfile
+import unittest
+from os import path
+
+try:
+    from PyQt4.QtCore import *
+    from PyQt4.QtGui import *
+    from qgis.core import *
+    HAVE_QGIS = True
+except ImportError:
+    HAVE_QGIS = False
+
+QGIS_PREFIX = '/usr'
+TEST_WD     = path.dirname(path.abspath(__file__))
+SHAPEFILES  = path.join(TEST_WD, 'data', 'shapefiles')
+
+
+class DummyLegendInterface(object):
+    def isLayerVisible(self, layer):
+        return True
+
+
+@unittest.skipUnless(HAVE_QGIS, 'PyQGis is required')
+class LayerGroupsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        QgsApplication.setPrefixPath(QGIS_PREFIX, True)
+        cls.qgs = QgsApplication(sys.argv, False)
+        cls.qgs.initQgis()
+
+        from rt_mapserver_exporter import LayerGroups
+        cls.groups = LayerGroups
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def layer(self, shapefile, name):
+        # Every layer gets a copy of its shapefile, like tiles would
+        for ext in ('.shp', '.shx', '.dbf', '.prj'):
+            shutil.copy(path.join(SHAPEFILES, shapefile + ext), path.join(self.tempDir, name + ext))
+
+        layer = QgsVectorLayer(path.join(self.tempDir, name + '.shp'), name, 'ogr')
+        self.assertTrue(layer.isValid())
+        return layer
+
+    def testGroupsAdjacentLookAlikes(self):
+        layers = [
+            self.layer('grid', 'parcels_north'),
+            self.layer('grid', 'parcels_south'),
+            self.layer('grid-polylines', 'roads'),
+            self.layer('grid', 'parcels_east'),
+        ]
+
+        groups = self.groups.findGroups(layers, DummyLegendInterface(), 2)
+        self.assertEqual([[l.name() for l in g] for g in groups], [
+            [u'parcels_north', u'parcels_south'], [u'roads'], [u'parcels_east']
+        ])
+        self.assertEqual(self.groups.groupName(groups[0]), u'parcels')
+
+        # Different styles keep layers apart
+        layers[1].rendererV2().symbol().setColor(QColor(1, 2, 3))
+        groups = self.groups.findGroups(layers, DummyLegendInterface(), 2)
+        self.assertEqual(len(groups), 4)
+
+    def testWritesTileIndex(self):
+        layers = [self.layer('grid', 'tile_%d' % i) for i in range(3)]
+        tileIndexDir = path.join(self.tempDir, 'tiles')
+
+        units = self.groups.consolidate(layers, DummyLegendInterface(), 2, tileIndexDir)
+        self.assertEqual(len(units), 1)
+
+        group, tileIndexPath = units[0]
+        self.assertEqual(tileIndexPath, path.join(tileIndexDir, u'tile.shp'))
+
+        index = QgsVectorLayer(tileIndexPath, 'index', 'ogr')
+        self.assertEqual(
+            sorted(f[self.groups.TILE_ITEM] for f in index.getFeatures()),
+            sorted(self.groups.layerFile(l) for l in layers)
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
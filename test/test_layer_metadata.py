@@ -0,0 +1,104 @@
+"""Check the prefetching and caching of layer metadata (see: LayerMetadata.py)
+
+    Needs PyQGis, run it like `test.py` (see: test.sh):
+
+        LC_ALL=C PYTHONPATH=/usr/share/qgis/python:~/.qgis2/python/plugins \\
+            python2 -m unittest test_layer_metadata
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+from os import path
+
+try:
+    from PyQt4.QtCore import *
+    from PyQt4.QtGui import *
+    from qgis.core import *
+    HAVE_QGIS = True
+except ImportError:
+    HAVE_QGIS = False
+
+QGIS_PREFIX = '/usr'
+TEST_WD     = path.dirname(path.abspath(__file__))
+SHAPEFILES  = path.join(TEST_WD, 'data', 'shapefiles')
+
+
+@unittest.skipUnless(HAVE_QGIS, 'PyQGis is required')
+class LayerMetadataTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        QgsApplication.setPrefixPath(QGIS_PREFIX, True)
+        cls.qgs = QgsApplication(sys.argv, False)
+        cls.qgs.initQgis()
+
+        from rt_mapserver_exporter import LayerMetadata
+        cls.metadata = LayerMetadata
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def layer(self, shapefile):
+        for ext in ('.shp', '.shx', '.dbf', '.prj'):
+            shutil.copy(path.join(SHAPEFILES, shapefile + ext), self.tempDir)
+
+        layer = QgsVectorLayer(path.join(self.tempDir, shapefile + '.shp'), shapefile, 'ogr')
+        self.assertTrue(layer.isValid())
+        return layer
+
+    def testPrefetchMatchesLayers(self):
+        layers = [self.layer(name) for name in ('grid', 'grid-polylines', 'grid-centroids')]
+
+        metadata = self.metadata.prefetch(layers, threads=3)
+        self.assertEqual(sorted(metadata.keys()), sorted(l.id() for l in layers))
+
+        for layer in layers:
+            extent = layer.extent()
+            self.assertEqual(metadata[layer.id()].extent, (
+                extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum()
+            ))
+            self.assertEqual(metadata[layer.id()].authid, layer.crs().authid())
+            self.assertEqual(
+                [name for name, comment in metadata[layer.id()].fields],
+                [f.name() for f in layer.pendingFields()]
+            )
+
+    def testPrefetchAppliesSubsetStrings(self):
+        layer = self.layer('grid')
+        layer.setSubsetString('"ID" < 10')
+
+        # Metadata is read from a layer of its own, built from the data source of the layer
+        extent = layer.extent()
+        self.assertEqual(self.metadata.prefetch([layer], threads=2)[layer.id()].extent, (
+            extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum()
+        ))
+
+    def testCacheFollowsDataFiles(self):
+        layer = self.layer('grid')
+        cachePath = path.join(self.tempDir, 'metadata')
+
+        self.metadata.prefetch([layer], cachePath=cachePath)
+        self.assertEqual(len(os.listdir(cachePath)), 1)
+
+        # Cached entries are used as long as the data files do not change
+        key, remote = self.metadata.sourceKey(layer)
+        self.assertFalse(remote)
+        self.assertTrue(path.isfile(path.join(cachePath, key + '.json')))
+
+        later = time.time() + 10
+        os.utime(path.join(self.tempDir, 'grid.shp'), (later, later))
+        self.assertNotEqual(self.metadata.sourceKey(layer)[0], key)
+
+        self.metadata.prefetch([layer], cachePath=cachePath)
+        self.assertEqual(len(os.listdir(cachePath)), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,267 @@
+"""Unit tests for the mapfile minification in MapfileMinifier.py
+
+    These do not need QGis or mapscript. Run them with:
+
+        python2 -m unittest discover -s test -p 'test_*.py'
+"""
+
+import os
+import sys
+import codecs
+import shutil
+import tempfile
+import unittest
+from os import path
+
+TEST_WD = path.dirname(path.abspath(__file__))
+sys.path.insert(0, path.dirname(TEST_WD))
+
+import MapfileMinifier
+import MapfileWriter as ms
+
+
+"""A map the way mapscript saves it, with all its defaults"""
+SAVED_MAP = u'''MAP
+  EXTENT 0 0 100 100
+  IMAGECOLOR 255 255 255
+  IMAGETYPE "png"
+  NAME "saved"
+  SIZE 800 600
+  STATUS ON
+  UNITS METERS
+
+  OUTPUTFORMAT
+    NAME "png"
+    MIMETYPE "image/png"
+    DRIVER "AGG/PNG"
+    EXTENSION "png"
+    IMAGEMODE RGB
+    TRANSPARENT FALSE
+  END # OUTPUTFORMAT
+
+  OUTPUTFORMAT
+    NAME "png"
+    MIMETYPE "image/png"
+    DRIVER "AGG/PNG"
+    EXTENSION "png"
+    IMAGEMODE RGBA
+    TRANSPARENT TRUE
+  END # OUTPUTFORMAT
+
+  PROJECTION
+    "init=epsg:4326"
+  END # PROJECTION
+  LEGEND
+    KEYSIZE 20 10
+    KEYSPACING 5 5
+    LABEL
+      SIZE MEDIUM
+      OFFSET 0 0
+      SHADOWSIZE 1 1
+      TYPE BITMAP
+    END # LABEL
+    POSITION LL
+    STATUS OFF
+  END # LEGEND
+
+  QUERYMAP
+    COLOR 255 255 0
+    SIZE -1 -1
+    STATUS OFF
+    STYLE HILITE
+  END # QUERYMAP
+
+  REFERENCE
+    COLOR 255 0 0
+    EXTENT -1 -1 -1 -1
+    STATUS OFF
+  END # REFERENCE
+
+  SCALEBAR
+    ALIGN CENTER
+    COLOR 0 0 0
+    IMAGECOLOR 255 255 255
+    INTERVALS 4
+    LABEL
+      SIZE MEDIUM
+      OFFSET 0 0
+      SHADOWSIZE 1 1
+      TYPE BITMAP
+    END # LABEL
+    POSITION LL
+    SIZE 200 3
+    STATUS OFF
+    STYLE 0
+    UNITS MILES
+  END # SCALEBAR
+
+  WEB
+    IMAGEPATH "/tmp/"
+    QUERYFORMAT "text/html"
+    LEGENDFORMAT "text/html"
+    BROWSEFORMAT "text/html"
+  END # WEB
+
+  LAYER
+    DATA "points.shp"
+    METADATA
+      "wms_title"	"points  #1"
+    END # METADATA
+    NAME "points"
+    SIZEUNITS PIXELS
+    STATUS ON
+    TOLERANCEUNITS PIXELS
+    TYPE POINT
+    UNITS METERS
+    CLASS
+      NAME "class"
+      EXPRESSION ("[name]" = "a  b")
+      LABEL
+        ANGLE 0.000000
+        FONT "sans"
+        OFFSET 0 0
+        PARTIALS TRUE
+        POSITION CC
+        SHADOWSIZE 1 1
+        SIZE 10
+        TYPE TRUETYPE
+      END # LABEL
+      STYLE
+        ANGLE 0
+        COLOR 255 0 0
+        MAXSIZE 500
+        OFFSET 0 0
+        SIZE 8
+        SYMBOL "circle"
+        WIDTH 1
+      END # STYLE
+    END # CLASS
+  END # LAYER
+
+END # MAP
+'''
+
+"""The same map, minified"""
+MINIFIED_MAP = u'''MAP
+EXTENT 0 0 100 100
+IMAGETYPE "png"
+NAME "saved"
+SIZE 800 600
+OUTPUTFORMAT
+NAME "png"
+MIMETYPE "image/png"
+DRIVER "AGG/PNG"
+EXTENSION "png"
+IMAGEMODE RGBA
+TRANSPARENT TRUE
+END
+PROJECTION
+"init=epsg:4326"
+END
+WEB
+IMAGEPATH "/tmp/"
+END
+LAYER
+DATA "points.shp"
+METADATA
+"wms_title"	"points  #1"
+END
+NAME "points"
+STATUS ON
+TYPE POINT
+CLASS
+NAME "class"
+EXPRESSION ("[name]" = "a  b")
+LABEL
+FONT "sans"
+SIZE 10
+TYPE TRUETYPE
+END
+STYLE
+COLOR 255 0 0
+SIZE 8
+SYMBOL "circle"
+END
+END
+END
+END
+'''
+
+
+def readFile(filePath):
+    with codecs.open(filePath, 'r', 'utf-8') as fin:
+        return fin.read()
+
+
+def writeFile(filePath, contents):
+    with codecs.open(filePath, 'w', 'utf-8') as fout:
+        fout.write(contents)
+
+
+class MinifyMapfileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def testDropsDefaults(self):
+        mapfilePath = path.join(self.tempDir, u'test.map')
+        writeFile(mapfilePath, SAVED_MAP)
+
+        sizeBefore, sizeAfter = MapfileMinifier.minifyMapfile(mapfilePath)
+
+        self.assertEqual(readFile(mapfilePath), MINIFIED_MAP)
+        self.assertEqual(sizeAfter, len(MINIFIED_MAP))
+        self.assertTrue(sizeAfter * 2 < sizeBefore)
+        self.assertEqual(os.listdir(self.tempDir), [u'test.map'])
+
+    def testIsIdempotent(self):
+        lines = MINIFIED_MAP.splitlines()
+        self.assertEqual(MapfileMinifier.minifyLines(lines), lines)
+
+    def testKeepsReferenceMapsWithAnImage(self):
+        lines = MapfileMinifier.minifyLines([
+            u'MAP', u'  REFERENCE', u'    IMAGE "ref.png"', u'    STATUS OFF', u'  END # REFERENCE',
+            u'END # MAP'
+        ])
+        self.assertEqual(lines, [u'MAP', u'REFERENCE', u'IMAGE "ref.png"', u'END', u'END'])
+
+    def testMinifiesStreamedMapfiles(self):
+        msMap = ms.mapObj()
+        msMap.name = 'streamed'
+        msMap.setImageType('png')
+
+        msLayer = ms.layerObj(msMap)
+        msLayer.name = 'lines'
+        msLayer.type = ms.MS_LAYER_LINE
+        msStyle = ms.styleObj(ms.classObj(msLayer))
+        msStyle.color = ms.colorObj(0, 0, 255)
+
+        mapfilePath = path.join(self.tempDir, u'streamed.map')
+        msMap.save(mapfilePath)
+        MapfileMinifier.minifyMapfile(mapfilePath)
+
+        self.assertEqual(readFile(mapfilePath), u'\n'.join([
+            u'MAP', u'NAME "streamed"', u'IMAGETYPE png',
+            u'LAYER', u'NAME "lines"', u'TYPE LINE',
+            u'CLASS', u'STYLE', u'COLOR 0 0 255', u'END', u'END',
+            u'END',
+            u'END'
+        ]) + u'\n')
+
+    def testRejectsUnbalancedBlocks(self):
+        self.assertRaises(ValueError, MapfileMinifier.minifyLines, [u'MAP', u'  LAYER', u'END'])
+        self.assertRaises(ValueError, MapfileMinifier.minifyLines, [u'MAP', u'END', u'END'])
+
+    def testMeasuresParseTime(self):
+        loaded = []
+        seconds = MapfileMinifier.parseTime(u'test.map', loaded.append, repeat=3)
+
+        self.assertEqual(loaded, [u'test.map'] * 3)
+        self.assertTrue(seconds >= 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+"""Unit tests for the mapfile text helpers in MapfileUtils.py
+
+    These do not need QGis or mapscript. Run them with:
+
+        python2 -m unittest discover -s test -p 'test_*.py'
+"""
+
+import os
+import re
+import sys
+import time
+import codecs
+import shutil
+import tempfile
+import unittest
+from os import path
+
+TEST_WD = path.dirname(path.abspath(__file__))
+sys.path.insert(0, path.dirname(TEST_WD))
+
+import MapfileUtils
+
+
+"""Size of the synthetic mapfile used for timing the post-processing"""
+SYNTHETIC_LAYERS = 1000
+SYNTHETIC_FONTS = 40
+
+
+def writeSyntheticMapfile(mapfilePath, numLayers, numFonts):
+    """Write a large mapfile looking like one saved by mapscript, with labels in many fonts"""
+
+    with codecs.open(mapfilePath, 'w', 'utf-8') as fout:
+        fout.write(u'MAP\n  NAME "synthetic"\n  EXTENT 0 0 100 100\n')
+
+        for i in range(numLayers):
+            fout.write(u'  LAYER\n    NAME "layer %d"\n    TYPE POINT\n' % i)
+
+            for j in range(3):
+                fout.write(
+                    u'    CLASS\n'
+                    u'      NAME "class %d"\n'
+                    u'      EXPRESSION ("[attr]" = "%d")\n'
+                    u'      STYLE\n        COLOR 255 0 0\n        SIZE 8\n      END # STYLE\n'
+                    u'      LABEL\n        FONT "Font Family %d"\n        SIZE 10\n      END # LABEL\n'
+                    u'    END # CLASS\n' % (j, j, (i + j) % numFonts)
+                )
+
+            fout.write(u'  END # LAYER\n')
+
+        fout.write(u'END # MAP\n')
+
+
+def legacyPostProcessMapfile(mapfilePath, fontsetPath, fontListPath):
+    """The list-based post-processing `MapfileExporter.export()` used to do"""
+
+    fin = codecs.open(mapfilePath, 'r', 'utf-8')
+    parts = [line.rstrip('\n') for line in fin]
+    fin.close()
+
+    fonts = []
+    searchFontRx = re.compile(u'^\\s*FONT\\s+')
+
+    for line in filter(searchFontRx.search, parts):
+        fontName = re.sub(searchFontRx, '', line)[1:-1]
+        alias = fontName.replace(' ', '')
+
+        if alias not in fonts:
+            fonts.append(alias)
+            replaceFontRx = re.compile(u"^(\\s*FONT\\s+\")%s(\".*)$" % re.escape(fontName))
+            parts = [replaceFontRx.sub(u"\\g<1>%s\\g<2>" % alias, part) for part in parts]
+
+    with codecs.open(fontListPath, 'w', 'utf-8') as fout:
+        for alias in fonts:
+            fout.write(alias + '\n')
+
+    mapRx = re.compile("^MAP(\r\n|\r|\n)*$")
+    pos = parts.index(list(filter(lambda x: mapRx.match(x), parts))[0])
+    parts.insert(pos + 1, u'  FONTSET "%s"' % fontsetPath)
+
+    with codecs.open(mapfilePath, 'w', 'utf-8') as fout:
+        for part in parts:
+            fout.write(part + '\n')
+
+    return fonts
+
+
+def readFile(filePath):
+    with codecs.open(filePath, 'r', 'utf-8') as fin:
+        return fin.read()
+
+
+class PostProcessMapfileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def tempPath(self, name):
+        return path.join(self.tempDir, name)
+
+    def testRewritesFontsAndInsertsFontset(self):
+        mapfilePath = self.tempPath(u'test.map')
+        writeSyntheticMapfile(mapfilePath, 3, 2)
+
+        fonts, fontsetAdded = MapfileUtils.postProcessMapfile(
+            mapfilePath, u'fontset', self.tempPath(u'fonts.txt')
+        )
+
+        self.assertTrue(fontsetAdded)
+        self.assertEqual(fonts, [u'FontFamily0', u'FontFamily1'])
+        self.assertEqual(readFile(self.tempPath(u'fonts.txt')), u'FontFamily0\nFontFamily1\n')
+
+        contents = readFile(mapfilePath)
+        self.assertTrue(contents.startswith(u'MAP\n  FONTSET "fontset"\n  NAME "synthetic"\n'))
+        self.assertTrue(u'FONT "FontFamily1"' in contents)
+        self.assertFalse(u'FONT "Font Family' in contents)
+
+    def testLeavesUnchangedMapfileAlone(self):
+        mapfilePath = self.tempPath(u'test.map')
+        with codecs.open(mapfilePath, 'w', 'utf-8') as fout:
+            fout.write(u'MAP\n  NAME "plain"\nEND # MAP\n')
+
+        fonts, fontsetAdded = MapfileUtils.postProcessMapfile(mapfilePath)
+
+        self.assertEqual(fonts, [])
+        self.assertFalse(fontsetAdded)
+        self.assertEqual(readFile(mapfilePath), u'MAP\n  NAME "plain"\nEND # MAP\n')
+        self.assertEqual(os.listdir(self.tempDir), [u'test.map'])
+
+    def testMatchesLegacyOutputAndIsFaster(self):
+        legacyPath = self.tempPath(u'legacy.map')
+        streamPath = self.tempPath(u'stream.map')
+        writeSyntheticMapfile(legacyPath, SYNTHETIC_LAYERS, SYNTHETIC_FONTS)
+        shutil.copy(legacyPath, streamPath)
+
+        start = time.time()
+        legacyFonts = legacyPostProcessMapfile(
+            legacyPath, u'fontset', self.tempPath(u'legacy-fonts.txt')
+        )
+        legacyTime = time.time() - start
+
+        start = time.time()
+        streamFonts, _ = MapfileUtils.postProcessMapfile(
+            streamPath, u'fontset', self.tempPath(u'stream-fonts.txt')
+        )
+        streamTime = time.time() - start
+
+        sys.stderr.write('\npost-processing %d fonts: legacy %.2fs, streaming %.2fs (%.1fx)\n' % (
+            SYNTHETIC_FONTS, legacyTime, streamTime, legacyTime / max(streamTime, 1e-6)
+        ))
+
+        self.assertEqual(streamFonts, legacyFonts)
+        self.assertEqual(readFile(streamPath), readFile(legacyPath))
+        self.assertEqual(
+            readFile(self.tempPath(u'stream-fonts.txt')),
+            readFile(self.tempPath(u'legacy-fonts.txt'))
+        )
+        self.assertTrue(streamTime * 5 < legacyTime)
+
+    def testMergesFontLists(self):
+        fontListPath = self.tempPath(u'fonts.txt')
+
+        MapfileUtils.mergeFontList(fontListPath, [u'FontB', u'FontA'])
+        MapfileUtils.mergeFontList(fontListPath, [u'FontA', u'FontC'])
+
+        self.assertEqual(readFile(fontListPath), u'FontB\nFontA\nFontC\n')
+        self.assertEqual(
+            sorted(os.listdir(self.tempDir)), [u'fonts.txt', u'fonts.txt.lock']
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
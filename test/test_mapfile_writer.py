@@ -0,0 +1,203 @@
+"""Unit tests for the pure Python mapfile backend in MapfileWriter.py
+
+    These do not need QGis or mapscript. Run them with:
+
+        python2 -m unittest discover -s test -p 'test_*.py'
+"""
+
+import sys
+import json
+import codecs
+import shutil
+import tempfile
+import unittest
+from os import path
+
+TEST_WD = path.dirname(path.abspath(__file__))
+sys.path.insert(0, path.dirname(TEST_WD))
+
+import MapfileWriter as ms
+
+
+def buildMap(numLayers):
+    """Build a map whose layers each have a labelled class drawn with a symbol of their own"""
+
+    msMap = ms.mapObj()
+    msMap.name = 'fragments'
+    msMap.extent = ms.rectObj(0, 0, 100, 100)
+
+    for i in range(numLayers):
+        msSymbol = ms.symbolObj('symbol %d' % i)
+        msSymbol.type = ms.MS_SYMBOL_TRUETYPE
+        msSymbol.font = 'Symbol Font'
+        msSymbol.character = '&#%d;' % (65 + i)
+        msSymbol.inmapfile = ms.MS_TRUE
+        msMap.symbolset.appendSymbol(msSymbol)
+
+        msLayer = ms.layerObj(msMap)
+        msLayer.name = 'layer %d' % i
+        msLayer.type = ms.MS_LAYER_POINT
+        msLayer.status = ms.MS_ON
+        msLayer.data = 'layer%d.shp' % i
+
+        msClass = ms.classObj(msLayer)
+        msClass.name = 'class %d' % i
+
+        msStyle = ms.styleObj(msClass)
+        msStyle.symbolname = msSymbol.name
+        msStyle.color = ms.colorObj(255, 0, i)
+
+        msLabel = ms.labelObj()
+        msLabel.type = ms.MS_TRUETYPE
+        msLabel.font = 'Label Font %d' % i
+        msClass.addLabel(msLabel)
+
+    return msMap
+
+
+def readFile(filePath):
+    with codecs.open(filePath, 'r', 'utf-8') as fin:
+        return fin.read()
+
+
+class MapfileStreamFragmentTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def write(self, fileName, writeLayer):
+        msMap = buildMap(3)
+        stream = ms.MapfileStream(path.join(self.tempDir, fileName), msMap)
+        stream.begin()
+
+        while msMap.numlayers > 0:
+            writeLayer(stream, msMap.getLayer(0))
+
+        stream.end()
+
+        return stream
+
+    def testFragmentsMatchLayers(self):
+        direct = self.write('direct.map', lambda stream, l: stream.writeLayer(l))
+
+        def writeThroughJSON(stream, msLayer):
+            fragment = json.loads(json.dumps(stream.layerFragment(msLayer)))
+            stream.msMap.removeLayer(msLayer.index)
+            stream.writeFragment(fragment)
+
+        cached = self.write('cached.map', writeThroughJSON)
+
+        self.assertEqual(
+            readFile(path.join(self.tempDir, 'cached.map')),
+            readFile(path.join(self.tempDir, 'direct.map'))
+        )
+        self.assertEqual(cached.fonts, direct.fonts)
+        self.assertEqual(direct.fonts[0], u'LabelFont0')
+
+    def testFragmentSymbolsAreWrittenOnce(self):
+        msMap = buildMap(2)
+        msLayer = msMap.getLayer(0)
+
+        # A layer coming from a previous export, whose symbol is no longer in the symbolset
+        stream = ms.MapfileStream(path.join(self.tempDir, 'test.map'), msMap)
+        fragment = stream.layerFragment(msLayer)
+        msMap.symbolset.symbols.pop(1)
+
+        stream.begin()
+        stream.writeFragment(fragment)
+        stream.writeFragment(fragment)
+        stream.writeLayer(msMap.getLayer(1))
+        stream.end()
+
+        contents = readFile(path.join(self.tempDir, 'test.map'))
+        self.assertEqual(contents.count(u'NAME "symbol 0"'), 1)
+        self.assertEqual(contents.count(u'NAME "symbol 1"'), 1)
+        self.assertEqual(contents.count(u'SYMBOL "symbol 0"'), 2)
+        self.assertTrue(contents.rstrip().endswith(u'END # MAP'))
+
+    def testFragmentSymbolsAreReconciled(self):
+        # Fragments rendered from separate maps, as worker processes do
+        first, second, third = buildMap(1), buildMap(2), buildMap(1)
+        second.symbolset.getSymbol(1).name = 'unused'
+        second.symbolset.getSymbol(2).name = 'symbol 0'
+        second.getLayer(1).getClass(0).getStyle(0).symbolname = 'symbol 0'
+        third.symbolset.getSymbol(1).name = 'copy of symbol 0'
+        third.getLayer(0).getClass(0).getStyle(0).symbolname = 'copy of symbol 0'
+
+        msMap = ms.mapObj()
+        stream = ms.MapfileStream(path.join(self.tempDir, 'test.map'), msMap)
+        fragments = [
+            ms.MapfileStream(None, first).layerFragment(first.getLayer(0)),
+            ms.MapfileStream(None, second).layerFragment(second.getLayer(1)),
+            ms.MapfileStream(None, third).layerFragment(third.getLayer(0))
+        ]
+
+        stream.begin()
+        for fragment in fragments:
+            stream.writeFragment(fragment)
+        stream.end()
+
+        contents = readFile(path.join(self.tempDir, 'test.map'))
+
+        # Same name, different definitions: the second symbol is renamed
+        self.assertEqual(contents.count(u'NAME "symbol 0"'), 1)
+        self.assertEqual(contents.count(u'NAME "symbol 0-1"'), 1)
+        self.assertEqual(contents.count(u'SYMBOL "symbol 0-1"'), 1)
+
+        # Different names, same definition: the first name is used
+        self.assertFalse(u'copy of symbol 0' in contents)
+        self.assertEqual(contents.count(u'SYMBOL "symbol 0"'), 2)
+
+
+
+class MapfileStreamSymbolsetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def export(self, fileName, msMap):
+        symbolsetPath = path.join(self.tempDir, 'symbols.sym')
+        stream = ms.MapfileStream(path.join(self.tempDir, fileName), msMap, '', symbolsetPath)
+        stream.begin()
+
+        while msMap.numlayers > 0:
+            stream.writeLayer(msMap.getLayer(0))
+
+        stream.end()
+
+        return readFile(path.join(self.tempDir, fileName))
+
+    def testSymbolsAreSharedAcrossMapfiles(self):
+        first, second = buildMap(2), buildMap(3)
+        second.symbolset.getSymbol(1).name = 'symbol 9'
+
+        firstContents = self.export('first.map', first)
+        secondContents = self.export('second.map', second)
+
+        for contents in (firstContents, secondContents):
+            self.assertTrue(u'SYMBOLSET "symbols.sym"' in contents)
+            self.assertFalse(u'NAME "symbol 0"' in contents)
+
+        symbolset = readFile(path.join(self.tempDir, 'symbols.sym'))
+        self.assertTrue(symbolset.startswith(u'SYMBOLSET\n'))
+        self.assertTrue(symbolset.endswith(u'END # SYMBOLSET\n'))
+
+        # Each symbol is written once, sorted by name
+        names = [line.strip() for line in symbolset.splitlines() if line.startswith(u'    NAME')]
+        self.assertEqual(names, [
+            u'NAME "symbol %d"' % i for i in (0, 1, 2, 9)
+        ])
+
+        # Exporting again adds nothing
+        self.export('third.map', buildMap(2))
+        self.assertEqual(readFile(path.join(self.tempDir, 'symbols.sym')), symbolset)
+
+
+if __name__ == '__main__':
+    unittest.main()
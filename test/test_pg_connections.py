@@ -0,0 +1,98 @@
+"""Unit tests for the PostGIS connection string normalization in PgConnections.py
+
+    These do not need QGis or mapscript. Run them with:
+
+        python2 -m unittest discover -s test -p 'test_*.py'
+"""
+
+import sys
+import codecs
+import shutil
+import tempfile
+import unittest
+from os import path
+
+TEST_WD = path.dirname(path.abspath(__file__))
+sys.path.insert(0, path.dirname(TEST_WD))
+
+import PgConnections
+
+
+SERVICE_FILE = u"""
+# Production database
+[gis]
+host=db.example.com
+port=5432
+dbname=gis
+user=mapserver
+password=secret
+
+[other]
+host=db.example.com
+dbname=other
+"""
+
+
+class PgConnectionsTest(unittest.TestCase):
+
+    def testParsesQuotedValues(self):
+        params = PgConnections.parseConnectionInfo(
+            u"dbname='my db' host=localhost password='it\\'s' sslmode=disable"
+        )
+        self.assertEqual(list(params.items()), [
+            (u'dbname', u'my db'), (u'host', u'localhost'), (u'password', u"it's"),
+            (u'sslmode', u'disable')
+        ])
+
+        self.assertRaises(ValueError, PgConnections.parseConnectionInfo, u'dbname')
+
+    def testNormalizesEquivalentConnections(self):
+        connections = PgConnections.PgConnections()
+
+        a = connections.normalize(u"dbname='gis' host=db port=5432 user='ms' sslmode=disable")
+        b = connections.normalize(u"host=db user=ms dbname=gis sslmode=disable")
+        c = connections.normalize(u"host=db user=other dbname=gis sslmode=disable")
+
+        self.assertEqual(a, u'host=db dbname=gis user=ms sslmode=disable')
+        self.assertEqual(a, b)
+        self.assertNotEqual(a, c)
+        self.assertEqual(connections.summary(), u'3 PostGIS layers use 2 distinct connections')
+
+    def testRefersToServiceEntries(self):
+        tempDir = tempfile.mkdtemp()
+        try:
+            serviceFilePath = path.join(tempDir, 'pg_service.conf')
+            with codecs.open(serviceFilePath, 'w', 'utf-8') as fout:
+                fout.write(SERVICE_FILE)
+
+            services = PgConnections.readServiceFile(serviceFilePath)
+        finally:
+            shutil.rmtree(tempDir)
+
+        self.assertEqual(list(services.keys()), [u'gis', u'other'])
+
+        connections = PgConnections.PgConnections(services)
+        normalize = connections.normalize
+
+        self.assertEqual(
+            normalize(u"dbname='gis' host=db.example.com port=5432 user='mapserver' "
+                u"password='secret' sslmode=disable"),
+            u'service=gis sslmode=disable'
+        )
+
+        # A different password must not be replaced by the one of the service
+        self.assertEqual(
+            normalize(u"dbname='gis' host=db.example.com user='mapserver' password='other'"),
+            u'host=db.example.com dbname=gis user=mapserver password=other'
+        )
+
+        # Neither may a user the service does not name
+        self.assertEqual(
+            normalize(u"dbname='other' host=db.example.com user='someone'"),
+            u'host=db.example.com dbname=other user=someone'
+        )
+        self.assertEqual(normalize(u"dbname='other' host=db.example.com"), u'service=other')
+
+
+if __name__ == '__main__':
+    unittest.main()
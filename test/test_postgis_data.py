@@ -0,0 +1,117 @@
+"""Check the DATA of PostGIS layers (see: `MapfileExporter.postgisData()`)
+
+    Needs PyQGis, run it like `test.py` (see: test.sh):
+
+        LC_ALL=C PYTHONPATH=/usr/share/qgis/python:~/.qgis2/python/plugins \\
+            python2 -m unittest test_postgis_data
+"""
+
+import sys
+import unittest
+
+try:
+    from PyQt4.QtCore import *
+    from PyQt4.QtGui import *
+    from qgis.core import *
+    HAVE_QGIS = True
+except ImportError:
+    HAVE_QGIS = False
+
+QGIS_PREFIX = '/usr'
+
+
+class StaticFilter(object):
+    """Stands for a `Serialization.LayerFilterSerializer` using a given set of columns"""
+
+    def __init__(self, columns=(), sql=None):
+        self.columns = set(columns)
+        self.sql = sql
+
+
+@unittest.skipUnless(HAVE_QGIS, 'PyQGis is required')
+class PostgisDataTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        QgsApplication.setPrefixPath(QGIS_PREFIX, True)
+        cls.qgs = QgsApplication(sys.argv, False)
+        cls.qgs.initQgis()
+
+        from rt_mapserver_exporter import MapfileExporter
+        cls.exporter = MapfileExporter
+
+    def uri(self, key):
+        uri = QgsDataSourceURI()
+        uri.setDataSource('public', 'roads', 'geom', '', key)
+        return uri
+
+    def layer(self, *renderAttributes):
+        layer = QgsVectorLayer(
+            'LineString?crs=epsg:4326&field=gid:integer&field=kind:string&field=lanes:integer'
+            '&field=name:string&field=notes:string',
+            'roads', 'memory'
+        )
+        self.assertTrue(layer.isValid())
+
+        if renderAttributes:
+            renderer = QgsCategorizedSymbolRendererV2(
+                renderAttributes[0], [], QgsSymbolV2.defaultSymbol(layer.geometryType())
+            )
+            layer.setRendererV2(renderer)
+
+        return layer
+
+    def testPlainData(self):
+        self.assertEqual(
+            self.exporter.postgisData(self.uri('gid'), 4326),
+            u'geom FROM "public"."roads" USING UNIQUE gid USING srid=4326'
+        )
+        self.assertEqual(
+            self.exporter.postgisData(self.uri('gid'), 4326, u'("lanes" > 2)'),
+            u'geom FROM "public"."roads" USING UNIQUE gid USING srid=4326 FILTER (("lanes" > 2))'
+        )
+
+    def testSubqueryFetchesColumns(self):
+        self.assertEqual(
+            self.exporter.postgisData(self.uri('gid'), 4326, u'("lanes" > 2)', [u'kind', u'gid']),
+            u'geom FROM (SELECT "gid", "geom", "kind" FROM "public"."roads" WHERE ("lanes" > 2))'
+            u' AS t USING UNIQUE gid USING srid=4326'
+        )
+
+    def testNoSubqueryWithoutKey(self):
+        self.assertEqual(
+            self.exporter.postgisData(self.uri(''), 4326, None, [u'kind']),
+            u'geom FROM "public"."roads" USING srid=4326'
+        )
+
+    def testColumnsOfRendererAndFilter(self):
+        layer = self.layer('kind')
+
+        self.assertEqual(
+            self.exporter.postgisColumns(layer, StaticFilter([u'lanes'])), [u'kind', u'lanes']
+        )
+
+        # Attributes which are not in the table are left to QGis
+        self.assertEqual(
+            self.exporter.postgisColumns(layer, StaticFilter([u'lanes', u'length'])),
+            [u'kind', u'lanes']
+        )
+
+    def testColumnsOfLabels(self):
+        layer = self.layer('kind')
+        layer.setCustomProperty('labeling', 'pal')
+        layer.setCustomProperty('labeling/enabled', True)
+        layer.setCustomProperty('labeling/fieldName', 'name')
+
+        self.assertEqual(
+            self.exporter.postgisColumns(layer, StaticFilter()), [u'kind', u'name']
+        )
+
+        # Labels with expressions that cannot be analyzed may need any attribute
+        layer.setCustomProperty('labeling/isExpression', True)
+        layer.setCustomProperty('labeling/fieldName', 'eval("name")')
+        self.assertEqual(self.exporter.postgisColumns(layer, StaticFilter()), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+"""Unit tests for the export profiler in Profiler.py
+
+    These do not need QGis or mapscript. Run them with:
+
+        python2 -m unittest discover -s test -p 'test_*.py'
+"""
+
+import sys
+import json
+import codecs
+import shutil
+import tempfile
+import unittest
+from os import path
+
+TEST_WD = path.dirname(path.abspath(__file__))
+sys.path.insert(0, path.dirname(TEST_WD))
+
+import Profiler
+
+
+class ProfilerTest(unittest.TestCase):
+
+    def profile(self, profiler):
+        with profiler.phase('header'):
+            pass
+
+        for name in [u'roads', u'rivers', u'roads']:
+            with profiler.layer(name):
+                with profiler.phase('style'):
+                    with profiler.phase('symbols.svg'):
+                        pass
+
+        profiler.record('end', 0.5)
+
+    def testRecordsPhasesAndLayers(self):
+        calls = []
+        profiler = Profiler.Profiler(lambda *args: calls.append(args))
+        self.profile(profiler)
+
+        report = profiler.report()
+        self.assertEqual(list(report['phases'].keys()),
+                ['header', 'symbols.svg', 'style', 'layer', 'end'])
+        self.assertEqual(report['phases']['style']['calls'], 3)
+        self.assertEqual(report['phases']['end'], {'seconds': 0.5, 'calls': 1})
+
+        self.assertEqual(list(report['layers'].keys()), [u'roads', u'rivers'])
+        self.assertEqual(report['layers'][u'roads']['layer']['calls'], 2)
+        self.assertEqual(report['layers'][u'rivers']['symbols.svg']['calls'], 1)
+        self.assertFalse('header' in report['layers'][u'roads'])
+
+        self.assertEqual(len(calls), 11)
+        self.assertEqual(calls[0][:2], ('header', None))
+        self.assertEqual(calls[1][:2], ('symbols.svg', u'roads'))
+        self.assertEqual(calls[-1], ('end', None, 0.5))
+
+    def testDumpsJSON(self):
+        tempDir = tempfile.mkdtemp()
+        try:
+            profiler = Profiler.Profiler()
+            self.profile(profiler)
+
+            filePath = path.join(tempDir, 'profile.json')
+            profiler.dump(filePath)
+
+            with codecs.open(filePath, 'r', 'utf-8') as fin:
+                self.assertEqual(json.load(fin), json.loads(json.dumps(profiler.report())))
+        finally:
+            shutil.rmtree(tempDir)
+
+    def testNullProfilerRecordsNothing(self):
+        self.profile(Profiler.NULL_PROFILER)
+        self.assertFalse(hasattr(Profiler.NULL_PROFILER, 'phases'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+"""Unit tests for the raster overview builder in RasterOverviews.py
+
+    These do not need QGis or mapscript, the tests building overviews need the GDAL Python
+    bindings. Run them with:
+
+        python2 -m unittest discover -s test -p 'test_*.py'
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+from os import path
+
+TEST_WD = path.dirname(path.abspath(__file__))
+sys.path.insert(0, path.dirname(TEST_WD))
+
+import RasterOverviews
+
+
+class OverviewLevelsTest(unittest.TestCase):
+
+    def testLevels(self):
+        self.assertEqual(RasterOverviews.overviewLevels(256, 256), [])
+        self.assertEqual(RasterOverviews.overviewLevels(257, 100), [2])
+        self.assertEqual(RasterOverviews.overviewLevels(1000, 1000), [2, 4])
+        self.assertEqual(RasterOverviews.overviewLevels(300, 40000), [2, 4, 8, 16, 32, 64, 128, 256])
+
+
+@unittest.skipUnless(RasterOverviews.isAvailable(), 'The GDAL Python bindings are required')
+class BuildOverviewsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def raster(self, name, width, height):
+        gdal = RasterOverviews.gdal
+        rasterPath = path.join(self.tempDir, name)
+
+        dataset = gdal.GetDriverByName('GTiff').Create(rasterPath, width, height, 1, gdal.GDT_Byte)
+        dataset.GetRasterBand(1).Fill(42)
+        dataset = None
+
+        return rasterPath
+
+    def testBuildsMissingOverviewsOnce(self):
+        rasterPaths = [self.raster('a.tif', 1000, 800), self.raster('b.tif', 600, 600)]
+
+        results = sorted(RasterOverviews.buildAllOverviews(rasterPaths, 'average', jobs=2))
+        self.assertEqual([(r[0], r[1], r[3]) for r in results], [
+            (rasterPaths[0], True, None), (rasterPaths[1], True, None)
+        ])
+        self.assertTrue(path.isfile(rasterPaths[0] + '.ovr'))
+
+        dataset = RasterOverviews.gdal.Open(rasterPaths[0])
+        self.assertEqual(dataset.GetRasterBand(1).GetOverviewCount(), 2)
+        dataset = None
+
+        # Current overviews are left alone, outdated ones are built again
+        later = time.time() + 10
+        os.utime(rasterPaths[1], (later, later))
+
+        results = sorted(RasterOverviews.buildAllOverviews(rasterPaths))
+        self.assertEqual([r[1] for r in results], [False, True])
+
+    def testRejectsUnknownResampling(self):
+        self.assertRaises(
+            ValueError, list, RasterOverviews.buildAllOverviews([], 'bogus')
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+"""Unit tests for the render profiler in RenderProfiler.py
+
+    These do not need QGis. Run them with:
+
+        python2 -m unittest discover -s test -p 'test_*.py'
+
+    Profiling an actual mapfile, written over the shapefiles in `data/shapefiles`, needs mapscript
+    and is skipped without it.
+"""
+
+import sys
+import json
+import codecs
+import shutil
+import tempfile
+import unittest
+from os import path
+
+TEST_WD = path.dirname(path.abspath(__file__))
+SHAPEFILES = path.join(TEST_WD, 'data', 'shapefiles')
+sys.path.insert(0, path.dirname(TEST_WD))
+
+try:
+    import mapscript
+    HAVE_MAPSCRIPT = True
+except ImportError:
+    HAVE_MAPSCRIPT = False
+
+import MapfileWriter as ms
+import RenderProfiler
+
+
+def writeGridMapfile(mapfilePath):
+    """Write a mapfile drawing the grid shapefiles of the test data"""
+
+    msMap = ms.mapObj()
+    msMap.name = 'grid'
+    msMap.units = ms.MS_DD
+    msMap.setSize(256, 256)
+    msMap.extent = ms.rectObj(-90, -100, 100, 90)
+    msMap.shapepath = SHAPEFILES
+
+    for name, layerType in [
+        ('grid', ms.MS_LAYER_POLYGON), ('grid-polylines', ms.MS_LAYER_LINE),
+        ('grid-centroids', ms.MS_LAYER_POINT)
+    ]:
+        msLayer = ms.layerObj(msMap)
+        msLayer.name = name
+        msLayer.type = layerType
+        msLayer.status = ms.MS_ON
+        msLayer.data = name + '.shp'
+
+        for i, expression in enumerate(['([ID] < 50)', '([ID] >= 50)']):
+            msClass = ms.classObj(msLayer)
+            msClass.setExpression(expression)
+            msStyle = ms.styleObj(msClass)
+            msStyle.color = ms.colorObj(255 * i, 0, 0)
+            msStyle.size = 4
+
+    msMap.save(mapfilePath)
+
+
+class RenderProfilerTest(unittest.TestCase):
+
+    def testScaleExtentMatchesMapServerScale(self):
+        minx, miny, maxx, maxy = RenderProfiler.scaleExtent(0, 0, 10000, 101, 51, ms.MS_METERS)
+
+        # msCalculateScale(): (maxx - minx) / ((width - 1) / (resolution * inchesPerUnit))
+        self.assertAlmostEqual((maxx - minx) / (100 / (72 * 39.3701)), 10000)
+        self.assertAlmostEqual(minx, -maxx)
+        self.assertAlmostEqual((maxy - miny) * 2, maxx - minx)
+
+    def testGridExtentsCoverTheMap(self):
+        extents = RenderProfiler.gridExtents((0, 0, 300, 300), 1000, 3, 256, 256, ms.MS_METERS)
+
+        self.assertEqual(len(extents), 9)
+        centers = [((e[0] + e[2]) / 2, (e[1] + e[3]) / 2) for e in extents]
+        for (x, y), expected in zip(centers, [(50, 250), (150, 250), (250, 250), (50, 150)]):
+            self.assertAlmostEqual(x, expected[0])
+            self.assertAlmostEqual(y, expected[1])
+
+        self.assertRaises(
+            ValueError, RenderProfiler.gridExtents, (0, 0, 1, 1), 1000, 1, 256, 256, ms.MS_PIXELS
+        )
+
+    def testRanksLayersAndScales(self):
+        profile = RenderProfiler.RenderProfile()
+        profile.addLayer('cheap', 1, 1)
+        profile.addLayer('expensive', 3, 5)
+
+        for seconds in (0.001, 0.003):
+            profile.record('cheap', 1000, seconds)
+            profile.record('expensive', 1000, seconds * 2)
+        profile.record('cheap', 50000, 0.010)
+        profile.record('expensive', 50000, 0.008)
+
+        self.assertEqual([l for l, s in profile.rankedLayers()], ['expensive', 'cheap'])
+        self.assertEqual(
+            [(l, scale) for l, scale, s in profile.rankedScales()],
+            [('cheap', 50000), ('expensive', 50000), ('expensive', 1000), ('cheap', 1000)]
+        )
+        self.assertAlmostEqual(profile.rankedScales()[2][2], 0.004)
+
+        report = json.loads(json.dumps(profile.report()))
+        self.assertEqual(report['layers']['expensive']['styles'], 5)
+        self.assertEqual(report['scales'][0]['layer'], 'cheap')
+
+        text = profile.format(top=1)
+        self.assertTrue('expensive' in text.splitlines()[1])
+        self.assertEqual(len(text.splitlines()), 4)
+
+    @unittest.skipUnless(HAVE_MAPSCRIPT, 'mapscript is required')
+    def testProfilesExportedMapfile(self):
+        tempDir = tempfile.mkdtemp()
+        try:
+            mapfilePath = path.join(tempDir, 'grid.map')
+            writeGridMapfile(mapfilePath)
+
+            msMap = mapscript.mapObj(mapfilePath)
+            profile = RenderProfiler.profileMap(msMap, [1000000, 50000000], grid=2, repeat=1)
+
+            self.assertEqual(
+                sorted(profile.layers.keys()), ['grid', 'grid-centroids', 'grid-polylines']
+            )
+            self.assertEqual(profile.layers['grid'], {'classes': 2, 'styles': 2})
+            self.assertEqual(len(profile.rankedScales()), 6)
+            self.assertTrue(all(e['renders'] == 4 for e in profile.times['grid'].values()))
+
+            # Layers are left as they were
+            self.assertEqual(msMap.getLayer(0).status, mapscript.MS_ON)
+        finally:
+            shutil.rmtree(tempDir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+"""Unit tests for the scale ranges of generalized layers in ScaleBands.py
+
+    These do not need QGis or mapscript. Run them with:
+
+        python2 -m unittest discover -s test -p 'test_*.py'
+"""
+
+import sys
+import unittest
+from os import path
+
+TEST_WD = path.dirname(path.abspath(__file__))
+sys.path.insert(0, path.dirname(TEST_WD))
+
+import ScaleBands
+from MapfileWriter import MS_METERS, MS_DD, MS_PIXELS
+
+
+class ScaleBandsTest(unittest.TestCase):
+
+    def testToleranceScale(self):
+        # 10m at 72 dpi make a pixel at 1:28346
+        self.assertAlmostEqual(ScaleBands.toleranceScale(10, MS_METERS), 28346.472)
+        self.assertAlmostEqual(ScaleBands.toleranceScale(0.001, MS_DD), 314982.288)
+        self.assertRaises(ValueError, ScaleBands.toleranceScale, 1, MS_PIXELS)
+
+    def testBandsCoverAllScales(self):
+        bands = ScaleBands.scaleBands([100, 10, 10, 0], MS_METERS, resolution=100)
+        self.assertEqual([(t, round(lo), round(hi)) for t, lo, hi in bands], [
+            (0, -1, 39370), (10, 39370, 393701), (100, 393701, -1)
+        ])
+
+    def testBandsFollowTheLayerScaleRange(self):
+        bands = ScaleBands.scaleBands([10, 100], MS_METERS, 50000, 1000000, resolution=100)
+        self.assertEqual([(t, round(lo), round(hi)) for t, lo, hi in bands], [
+            (10, 50000, 393701), (100, 393701, 1000000)
+        ])
+
+        # Only the full resolution data is left at large scales
+        bands = ScaleBands.scaleBands([10, 100], MS_METERS, -1, 20000, resolution=100)
+        self.assertEqual(bands, [(0, -1, 20000)])
+
+
+if __name__ == '__main__':
+    unittest.main()
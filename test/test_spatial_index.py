@@ -0,0 +1,148 @@
+"""Unit tests for the quadtree index writer in SpatialIndex.py
+
+    These do not need QGis or mapscript. Run them with:
+
+        python2 -m unittest discover -s test -p 'test_*.py'
+"""
+
+import os
+import sys
+import time
+import shutil
+import struct
+import tempfile
+import unittest
+from os import path
+
+TEST_WD = path.dirname(path.abspath(__file__))
+sys.path.insert(0, path.dirname(TEST_WD))
+
+import SpatialIndex
+
+SHAPEFILES = path.join(TEST_WD, 'data', 'shapefiles')
+
+
+def readIndex(qixPath):
+    """Read a .qix file the way MapServer does, returns the header and the root node
+
+        Nodes are `(rect, ids, subnodes)` tuples. The offset of each node is checked against
+        the actual size of its subtree.
+    """
+
+    with open(qixPath, 'rb') as fin:
+        data = fin.read()
+
+    signature, byteOrder, version = struct.unpack('<3sBB3x', data[:8])
+    numShapes, maxDepth = struct.unpack('<ii', data[8:16])
+
+    def readNode(pos):
+        offset, minx, miny, maxx, maxy, n = struct.unpack('<i4di', data[pos:pos + 40])
+        ids = list(struct.unpack('<%di' % n, data[pos + 40:pos + 40 + 4 * n]))
+        numSubnodes = struct.unpack('<i', data[pos + 40 + 4 * n:pos + 44 + 4 * n])[0]
+
+        subtreeStart = pos = pos + 44 + 4 * n
+        subnodes = []
+        for i in range(numSubnodes):
+            subnode, pos = readNode(pos)
+            subnodes.append(subnode)
+
+        if pos - subtreeStart != offset:
+            raise ValueError('Bad subtree offset')
+
+        return ((minx, miny, maxx, maxy), ids, subnodes), pos
+
+    root, end = readNode(16)
+    if end != len(data):
+        raise ValueError('Trailing data')
+
+    return (signature, byteOrder, version, numShapes, maxDepth), root
+
+
+def intersects(a, b):
+    return a[0] <= b[2] and a[2] >= b[0] and a[1] <= b[3] and a[3] >= b[1]
+
+
+def query(node, rect):
+    """Collect the ids of the shapes of the nodes intersecting `rect`, like MapServer does"""
+
+    nodeRect, ids, subnodes = node
+    if not intersects(nodeRect, rect):
+        return set()
+
+    found = set(ids)
+    for subnode in subnodes:
+        found |= query(subnode, rect)
+
+    return found
+
+
+class SpatialIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def copyShapefile(self, name):
+        for ext in ('.shp', '.shx', '.dbf'):
+            shutil.copy(path.join(SHAPEFILES, name + ext), self.tempDir)
+
+        return path.join(self.tempDir, name + '.shp')
+
+    def testIndexHoldsEveryShapeInItsNode(self):
+        for name in ('grid', 'grid-polylines', 'grid-centroids'):
+            shapefilePath = self.copyShapefile(name)
+            qixPath = SpatialIndex.indexShapefile(shapefilePath)
+
+            header, root = readIndex(qixPath)
+            self.assertEqual(header, (b'SQT', 1, 1, 100, 5))
+
+            bounds, numShapes, shapes = SpatialIndex.readShapeBounds(shapefilePath)
+            shapes = dict(shapes)
+            self.assertEqual(sorted(shapes.keys()), list(range(100)))
+
+            # Every shape is in exactly one node, whose rectangle contains it
+            seen = []
+
+            def visit(node):
+                rect, ids, subnodes = node
+                self.assertTrue(len(ids) > 0 or len(subnodes) > 0)
+                for i in ids:
+                    self.assertTrue(SpatialIndex.contains(rect, shapes[i]))
+                seen.extend(ids)
+                for subnode in subnodes:
+                    visit(subnode)
+
+            visit(root)
+            self.assertEqual(sorted(seen), list(range(100)))
+
+            # Queries find every intersecting shape, and only part of the others
+            minx, miny, maxx, maxy = bounds
+            box = (minx, miny, minx + (maxx - minx) / 5, miny + (maxy - miny) / 5)
+            found = query(root, box)
+            expected = set(i for i, rect in shapes.items() if intersects(rect, box))
+
+            self.assertTrue(expected <= found)
+            self.assertTrue(len(found) < 50)
+
+    def testIndexIsCurrent(self):
+        shapefilePath = self.copyShapefile('grid')
+        self.assertFalse(SpatialIndex.indexIsCurrent(shapefilePath))
+
+        SpatialIndex.indexShapefile(shapefilePath)
+        self.assertTrue(SpatialIndex.indexIsCurrent(shapefilePath))
+
+        later = time.time() + 10
+        os.utime(shapefilePath, (later, later))
+        self.assertFalse(SpatialIndex.indexIsCurrent(shapefilePath))
+
+    def testDefaultDepth(self):
+        self.assertEqual(SpatialIndex.defaultDepth(0), 0)
+        self.assertEqual(SpatialIndex.defaultDepth(4), 0)
+        self.assertEqual(SpatialIndex.defaultDepth(5), 1)
+        self.assertEqual(SpatialIndex.defaultDepth(100), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+"""Unit tests for the SVG marker images in SvgSymbols.py
+
+    These do not need QGis or mapscript. Run them with:
+
+        python2 -m unittest discover -s test -p 'test_*.py'
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+from os import path
+
+TEST_WD = path.dirname(path.abspath(__file__))
+sys.path.insert(0, path.dirname(TEST_WD))
+
+import SvgSymbols
+
+ASSETS = path.join(TEST_WD, 'data', 'assets')
+
+
+class SvgImageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def copyAsset(self, name, copyName=None):
+        copyPath = path.join(self.tempDir, copyName or name)
+        shutil.copy(path.join(ASSETS, name), copyPath)
+        return copyPath
+
+    def testVectorSvg(self):
+        svgPath = self.copyAsset('map-marker.svg')
+        self.assertEqual(SvgSymbols.svgImage(svgPath), ('SVG', svgPath))
+
+    def testEmbeddedImagesAreExtractedOnce(self):
+        first = self.copyAsset('map-marker-raster-embed.svg', 'a.svg')
+        second = self.copyAsset('map-marker-raster-embed.svg', 'b.svg')
+
+        imageType, imagePath = SvgSymbols.svgImage(first)
+        self.assertEqual(imageType, 'PIXMAP')
+        self.assertEqual(path.dirname(imagePath), path.join(self.tempDir, SvgSymbols.SVG_IMAGE_DIR))
+        self.assertTrue(imagePath.endswith('.png'))
+
+        # The same image gets the same file
+        self.assertEqual(SvgSymbols.svgImage(second), ('PIXMAP', imagePath))
+        self.assertEqual(os.listdir(path.dirname(imagePath)), [path.basename(imagePath)])
+
+    def testChangedFilesAreReadAgain(self):
+        svgPath = self.copyAsset('map-marker.svg')
+        self.assertEqual(SvgSymbols.svgImage(svgPath)[0], 'SVG')
+
+        shutil.copy(path.join(ASSETS, 'map-marker-raster-embed.svg'), svgPath)
+        later = time.time() + 10
+        os.utime(svgPath, (later, later))
+        self.assertEqual(SvgSymbols.svgImage(svgPath)[0], 'PIXMAP')
+
+    def testUnsupportedLinks(self):
+        svgPath = self.copyAsset('map-marker-raster-link.svg')
+        self.assertRaises(ValueError, SvgSymbols.svgImage, svgPath)
+
+
+if __name__ == '__main__':
+    unittest.main()
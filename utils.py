@@ -1,5 +1,11 @@
-import mapscript
+try:
+    import mapscript
+except ImportError:
+    # Only the pure Python backend is available (see: MapfileWriter.py)
+    import MapfileWriter as mapscript
+
 import utils
+from PyQt4.QtGui import QApplication, QMessageBox
 from qgis.core import *
 
 def toUTF8(s):
@@ -30,3 +36,15 @@ def getLayerType(layer):
             return mapscript.MS_LAYER_LINE
     if layer.geometryType() == QGis.Polygon:
             return mapscript.MS_LAYER_POLYGON
+
+def warn(message):
+    """Warn the user about a problem with the export
+
+        Warnings are always written to the message log. A message box is only shown when running
+        with a GUI, so that headless exports (see: BatchExporter.py) do not block or crash.
+    """
+
+    QgsMessageLog.logMessage(message, 'RT MapServer Exporter')
+
+    if QApplication.type() != QApplication.Tty:
+        QMessageBox.warning(None, 'RT MapServer Exporter', message)